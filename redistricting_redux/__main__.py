@@ -1,7 +1,208 @@
 #from . import app #has to be this way for "python3 -m redistricting_redux" to run
 #Do the poetry dependencies work right if you do it this way?
 
+import argparse
+import json
+import sys
+import instrumentation
 import app # has to be this way for "poetry run python redistricting_redux" to run
 
-#Do I need to have a separate app file a la PA1 or can it be all in here?
-app.run()
\ No newline at end of file
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="redistricting_redux",
+        description="Draw random Congressional district maps and estimate how fair they are.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record time, call counts and peak memory per pipeline phase")
+    parser.add_argument("--profile-output", default=None,
+                        help="Write the --profile report here as JSON instead of printing it to stderr")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("interactive", help="Step through one map with prompts (the default)")
+    subparsers.add_parser("list", help="List the supported states")
+
+    batch = subparsers.add_parser("batch",
+        help="Draw maps without prompts and write one JSON record per map")
+    batch.add_argument("--states", nargs="+", required=True,
+                       help="2-letter postal codes of supported states")
+    batch.add_argument("--seeds", default="1",
+                       help="Seeds to draw with, e.g. '1-100' or '3,7,20-25'")
+    batch.add_argument("--deviation", type=int, default=None,
+                       help="Allowed population deviation (default: target district population // 10)")
+    batch.add_argument("--swap-steps", type=int, default=0,
+                       help="Max repeated_pop_swap cycles (or flow passes) per map; 0 skips balancing")
+    batch.add_argument("--method", choices=["dart", "multilevel"], default="dart",
+                       help="Draw with the dart throw, or coarsen-draw-refine (balances as it draws)")
+    batch.add_argument("--balancer", choices=["swap", "flow"], default="swap",
+                       help="Balance by repeated pop swaps, or by min-cost flow between all districts at once")
+    batch.add_argument("--milp-seconds", type=float, default=0,
+                       help="After balancing, give an exact MILP solver this long to finish; 0 skips it")
+    batch.add_argument("--compactness", action="store_true",
+                       help="Add Polsby-Popper scores and cut edges to each record")
+    batch.add_argument("--lean", action="store_true",
+                       help="Load only the columns maps need, in compact dtypes, to fit more states in memory")
+    batch.add_argument("--ntrials", type=int, default=0,
+                       help="Trials for the seat-share model; 0 skips prediction")
+    batch.add_argument("--emulator", action="store_true",
+                       help="Predict seat shares from the precomputed emulator table instead of training a model")
+    batch.add_argument("--output", default="-",
+                       help="NDJSON output file, or '-' for stdout")
+    batch.add_argument("--checkpoint-dir", default=None,
+                       help="Checkpoint each map's balancing here and resume maps that already have one")
+    batch.add_argument("--plan-store", default=None,
+                       help="Also save every plan, deduplicated, to a plan store in this directory")
+    batch.add_argument("--verbose", action="store_true",
+                       help="Let progress messages go to stdout along with the records")
+
+    bench = subparsers.add_parser("bench",
+        help="Time each pipeline stage on bundled states and record the results")
+    bench.add_argument("--states", nargs="+", default=None,
+                       help="States to benchmark (default: NV AZ NC GA OH TX)")
+    bench.add_argument("--seeds", default="2023",
+                       help="Seeds to draw with, e.g. '1-3'")
+    bench.add_argument("--swap-steps", type=int, default=3,
+                       help="stop_after for repeated_pop_swap")
+    bench.add_argument("--ethan-steps", type=int, default=10,
+                       help="stop_after for each of Ethan's balancers")
+    bench.add_argument("--history", default="redistricting_redux/benchmarks/history.jsonl",
+                       help="JSON-lines file each run is appended to")
+    bench.add_argument("--compare", action="store_true",
+                       help="Don't run; compare the last two recorded runs instead")
+    bench.add_argument("--startup", action="store_true",
+                       help="Don't run; time how long the CLI takes to start instead")
+
+    emulator = subparsers.add_parser("emulator",
+        help="Rebuild the seat-share emulator table by simulation and check it against direct simulation")
+    emulator.add_argument("--trials", type=int, default=None,
+                          help="Simulations per grid point (default: emulator.EMULATOR_TRIALS)")
+    emulator.add_argument("--workers", type=int, default=None,
+                          help="Worker processes (default: number of CPUs)")
+    emulator.add_argument("--output", default=None,
+                          help="Where to write the table (default: emulator.EMULATOR_FILEPATH)")
+
+    pipeline = subparsers.add_parser("pipeline",
+        help="Load, draw, balance, dissolve and predict for several states in parallel")
+    pipeline.add_argument("--states", nargs="+", default=None,
+                          help="States to run (default: all supported states)")
+    pipeline.add_argument("--seed", type=int, default=2023,
+                          help="Seed to draw every state's map with")
+    pipeline.add_argument("--workers", type=int, default=None,
+                          help="Most states to run at once (default: number of CPUs)")
+    pipeline.add_argument("--memory-mb", type=int, default=None,
+                          help="Address space budget per state, in MB (Linux only; counts reserved, not just used, memory); a state over it fails on its own")
+    pipeline.add_argument("--deviation", type=int, default=None,
+                          help="Allowed population deviation (default: target district population // 10)")
+    pipeline.add_argument("--swap-steps", type=int, default=5,
+                          help="Max repeated_pop_swap cycles (or flow passes) per state; 0 skips balancing")
+    pipeline.add_argument("--method", choices=["dart", "multilevel"], default="dart",
+                          help="How to draw each map")
+    pipeline.add_argument("--balancer", choices=["swap", "flow"], default="swap",
+                          help="Balance by repeated pop swaps, or by min-cost flow passes")
+    pipeline.add_argument("--milp-seconds", type=float, default=0,
+                          help="After balancing, give an exact MILP solver this long to finish; 0 skips it")
+    pipeline.add_argument("--lean", action="store_true",
+                          help="Load only the columns maps need, in compact dtypes, to fit more states in memory")
+    pipeline.add_argument("--ntrials", type=int, default=0,
+                          help="Trials for the seat-share model; 0 skips prediction")
+    pipeline.add_argument("--output", default=None,
+                          help="Also write the full summary here as JSON")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile:
+        instrumentation.enable()
+    try:
+        run_command(args)
+    finally:
+        if args.profile:
+            instrumentation.disable()
+            if args.profile_output:
+                with open(args.profile_output, "w") as f:
+                    json.dump(instrumentation.report(), f, indent=2)
+            else:
+                print(instrumentation.format_report(), file=sys.stderr)
+
+
+def run_command(args):
+    if args.command == "list":
+        for k, v in app.SUPPORTED_STATES.items():
+            print(f"{k} ({v['fullname']}): {v['num_districts']} districts")
+    elif args.command == "batch":
+        import batch
+        seeds = batch.parse_seeds(args.seeds)
+        if args.output == "-":
+            out = sys.stdout
+        else:
+            out = open(args.output, "w")
+        try:
+            batch.run_batch(args.states, seeds, allowed_deviation=args.deviation,
+                            swap_steps=args.swap_steps, ntrials=args.ntrials,
+                            out=out, quiet=not args.verbose, method=args.method,
+                            checkpoint_dir=args.checkpoint_dir,
+                            plan_store_dir=args.plan_store,
+                            balancer=args.balancer,
+                            milp_seconds=args.milp_seconds,
+                            compactness=args.compactness,
+                            lean=args.lean,
+                            emulator=args.emulator)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    elif args.command == "bench":
+        import benchmark
+        if args.startup:
+            seconds = benchmark.measure_startup()
+            print(f"Median startup time: {seconds:.3f}s (target: {benchmark.STARTUP_TARGET_S}s)")
+            if seconds > benchmark.STARTUP_TARGET_S:
+                sys.exit(1)
+        elif args.compare:
+            history = benchmark.load_history(args.history)
+            if len(history) < 2:
+                sys.exit("Need at least two recorded runs to compare.")
+            rows = benchmark.compare_runs(history[-2], history[-1])
+            print(benchmark.format_comparison(rows))
+            if any(row['regression'] for row in rows):
+                sys.exit(1)
+        else:
+            import batch
+            run = benchmark.run_benchmarks(args.states, batch.parse_seeds(args.seeds),
+                                           swap_steps=args.swap_steps,
+                                           ethan_steps=args.ethan_steps,
+                                           history_fp=args.history)
+            print(json.dumps(run['medians'], indent=2))
+    elif args.command == "emulator":
+        import emulator
+        ntrials = args.trials or emulator.EMULATOR_TRIALS
+        table = emulator.build_emulator_table(ntrials, max_workers=args.workers)
+        table.update(emulator.validate_emulator(table, ntrials=ntrials,
+                                                max_workers=args.workers))
+        emulator.save_emulator_table(table, args.output or emulator.EMULATOR_FILEPATH)
+        print(f"Largest standard error of a grid point: {table['seat_share_se'].max():.4f}")
+        print(f"Error against direct simulation: max {table['max_error']:.4f}, "
+              f"RMS {table['rms_error']:.4f} (simulated values' own standard error: "
+              f"up to {table['simulation_se']:.4f})")
+    elif args.command == "pipeline":
+        import pipeline
+        summary = pipeline.run_pipeline(args.states, seed=args.seed, max_workers=args.workers,
+                                        memory_budget_mb=args.memory_mb,
+                                        allowed_deviation=args.deviation,
+                                        swap_steps=args.swap_steps, method=args.method,
+                                        ntrials=args.ntrials, balancer=args.balancer,
+                                        milp_seconds=args.milp_seconds,
+                                        lean=args.lean)
+        print(pipeline.format_summary(summary))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(summary, f, indent=2)
+        if summary['failed']:
+            sys.exit(1)
+    else:
+        #Do I need to have a separate app file a la PA1 or can it be all in here?
+        app.run()
+
+
+if __name__ == "__main__":
+    #worker processes started with spawn/forkserver re-import this module
+    main()
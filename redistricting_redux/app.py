@@ -1,11 +1,10 @@
 #This file, and organization of project into package, by: Matt Jackson
 
-from load_state_data import load_state 
-from draw_random_maps import draw_dart_throw_map, repeated_pop_swap, population_deviation, district_pops, target_dist_pop, dissolve_map, plot_dissolved_map
-from regression import predict_state_voteshare
+#Only light imports up here, so the state list and --help come up right away.
+#geopandas, pandas, matplotlib and scikit-learn get imported inside run(),
+#once we know there's a state to load.
 from collections import OrderedDict
 import time
-from stats import population_sum, mean_voteshare, winner_2020
 
 #suppress FutureWarning and UserWarning in dissolve_map()
 #syntax from "Mike" answer (1/22/2013) here:
@@ -41,11 +40,19 @@ def run(state_input=None):
             break
         elif state_input not in SUPPORTED_STATES:
             print("That's not the postal code of a state we currently have data for.")
+    if state_input not in SUPPORTED_STATES:
+        print("Goodbye for now!")
+        return
     state_fullname = SUPPORTED_STATES[state_input]['fullname']
     print(f"You typed: {state_input} (for {state_fullname})")
 
+    from prefetch import start_state_load, TrainingPrefetcher
+    #load the state and start on the model's training data in the background
+    #while the user answers the next prompts. The training worker processes
+    #are started first, before there's a loading thread to fork alongside
+    trainer = TrainingPrefetcher()
     print(f"Importing {state_input} 2020 Redistricting Data Hub data...")
-    df = load_state(state_input)
+    df_future = start_state_load(state_input)
 
     user_seed = ''
     while not type(user_seed) == int:
@@ -58,14 +65,32 @@ def run(state_input=None):
             user_seed = int(user_seed)
     print(f"Alright. You picked: {user_seed}")
     print("Let's draw a random map and see how fair it is!")
-    time.sleep(1)
+    from draw_random_maps import draw_dart_throw_map, repeated_pop_swap, population_deviation, district_pops, target_dist_pop, dissolve_map, plot_dissolved_map
+    from regression import predict_state_voteshare
+    from stats import population_sum, mean_voteshare, winner_2020
+    from simplified_geometry import DISPLAY_RESOLUTION
+    from checkpoint import checkpoint_filepath, load_checkpoint, save_df_checkpoint, restore_df_dist_ids, reopen_checkpoint, remove_checkpoint
+    if not df_future.done():
+        print("Still importing state data...")
+    df = df_future.result()
 
     num_districts = SUPPORTED_STATES[state_input]['num_districts']
     target_pop = target_dist_pop(df, num_districts)
     print(f"({state_fullname} has {num_districts} Congressional districts and {population_sum(df)} people.)\nGoal is: {target_pop} people per district\n")
-    time.sleep(2)
 
-    draw_dart_throw_map(df, num_districts, seed=user_seed)
+    #a killed run leaves a checkpoint behind, so offer to pick it back up
+    checkpoint_fp = checkpoint_filepath(state_input, user_seed)
+    saved = load_checkpoint(checkpoint_fp, num_units=len(df))
+    resume_choice = None
+    if saved is not None:
+        resume_choice = input("You have a saved map for this state and seed from an earlier run.\nType 'yes' to pick up where you left off: ")
+    if resume_choice in {'yes', 'Yes', 'YES'}:
+        restore_df_dist_ids(df, saved['assignment'])
+        print(f"Picked up your saved map after {len(saved['deviations'])} swap cycles.")
+    else:
+        remove_checkpoint(checkpoint_fp)
+        draw_dart_throw_map(df, num_districts, seed=user_seed)
+        save_df_checkpoint(checkpoint_fp, df)
 
     print(f"\nThe populations of your districts are:\n{district_pops(df)}")
     deviation = population_deviation(df)
@@ -97,14 +122,28 @@ def run(state_input=None):
             if not user_steps.isdigit():
                 print("That's not a valid integer, so let's go with 5.")
                 user_steps = 5
+            #each round swaps more on the map the last one finished with
+            reopen_checkpoint(checkpoint_fp)
             repeated_pop_swap(df, allowed_deviation=user_allowed_deviation, 
-                            plot_each_step=False, stop_after=int(user_steps))
+                            plot_each_step=False, stop_after=int(user_steps),
+                            checkpoint_fp=checkpoint_fp)
             deviation = population_deviation(df)
             if deviation <= user_allowed_deviation:
                 break
             else:
                 print("It looks like districts still aren't as balanced as you want.")
                 swap_choice = input("Do you wish to continue the swapping process for more steps? ")
+        if deviation > user_allowed_deviation:
+            milp_choice = input("We can also try to finish balancing exactly, by solving for the best precincts\nto move near district borders. Type 'yes' to try: ")
+            if milp_choice in YES:
+                milp_seconds = input("How many seconds should the solver get? More time gets closer to exact balance,\nbut states with many districts rarely get all the way there: ")
+                if not milp_seconds.isdigit() or int(milp_seconds) == 0:
+                    print("That's not a valid number of seconds, so let's go with 60.")
+                    milp_seconds = 60
+                from milp_balance import milp_balance
+                milp_balance(df, allowed_deviation=user_allowed_deviation,
+                             time_limit=int(milp_seconds))
+                print(f"\nThe populations of your districts are now:\n{district_pops(df)}")
 
     print("\nOkay, we have our map set up. Let's estimate how fair it is!")
     winner = winner_2020(df)
@@ -117,21 +156,34 @@ def run(state_input=None):
     time.sleep(1)
 
     print("Let's get the by-district results for your map. This may take a few seconds...")
-    df_dists = dissolve_map(df)
+    df_dists = dissolve_map(df, resolution=DISPLAY_RESOLUTION)
     print("Here are the 2020 presidential election vote margins in each district you drew:")
     print("positive point_swing: Democratic win; negative: Republican win")
     print(df_dists[['POP100', 'point_swing']])
+    from partisan_metrics import ensemble_metrics
+    metrics = ensemble_metrics(df_dists['G20PREDBID'].to_numpy(), df_dists['G20PRERTRU'].to_numpy())
+    print("\nSome measures of partisan fairness for your map (positive: favors Democrats;\nnegative: favors Republicans; 0 is perfectly even):")
+    print(f"Efficiency gap: {metrics['efficiency_gap']:.3f}   Mean-median: {metrics['mean_median']:.3f}")
+    print(f"Partisan bias: {metrics['partisan_bias']:.3f}   Declination: {metrics['declination']:.3f}")
 
     time.sleep(1)
 
     print("Let's now use our partisan balance model to predict the expected\npartisan balance of our state.")
     print("Please input the number of trials you would like to run to generate the model.")
     print("More trials will result in longer runtime, but will produce more precise results.")
-    ntrials = input("For context, 100 trials takes about a minute. : ")
-    if not ntrials.isdigit():
-        ntrials = 50
-        print("Setting ntrials to 50 - input was not numeric")
-    prediction = predict_state_voteshare(state_input, int(ntrials))
+    ntrials = input("For context, 100 trials takes about a minute. Or type 'table' to look the answer up\nin our precomputed table of simulations instead, which is instant: ")
+    if ntrials in {'table', 'Table', 'TABLE'}:
+        from emulator import SeatShareEmulator
+        trainer.shutdown()
+        model = SeatShareEmulator()
+        ntrials = 0
+    else:
+        if not ntrials.isdigit():
+            ntrials = 50
+            print("Setting ntrials to 50 - input was not numeric")
+        #training data generated in the background so far is reused
+        model = trainer.model(int(ntrials))
+    prediction = predict_state_voteshare(state_input, int(ntrials), gdf=df, model=model)
     
     d_dists_on_map = 0
     r_dists_on_map = 0
@@ -157,6 +209,7 @@ def run(state_input=None):
         fp = plot_dissolved_map(df_dists, state_input)
         print(f"Map saved to filepath \"/{fp}\". Go open that file to look at your map!")
 
+    remove_checkpoint(checkpoint_fp)
     print("Goodbye for now!")
 
 
@@ -0,0 +1,336 @@
+'''
+Non-interactive counterpart to app.run(), for running many maps from a job
+scheduler. Draws one map per (state, seed), optionally balances it, and writes
+one JSON record per map (NDJSON) so results can be streamed and concatenated.
+
+Usage:
+    python redistricting_redux batch --states NV GA --seeds 1-100 \
+        --deviation 5000 --swap-steps 5 --ntrials 0 --output results.ndjson
+'''
+import contextlib
+import json
+import sys
+import time
+import numpy as np
+
+from app import SUPPORTED_STATES
+from load_state_data import load_state, make_adjacency_matrix
+from draw_random_maps import draw_dart_throw_map, repeated_pop_swap, population_deviation, district_pops, target_dist_pop
+from stats import population_sum
+from regression import create_linear_model, predict_state_voteshare
+from multilevel import draw_multilevel_map
+from graph_maps import assignment_from_df
+from flow_balance import flow_balance
+from milp_balance import milp_balance
+from plan_store import PlanStore
+from compactness import load_geometry_features, polsby_popper, cut_edges
+from partisan_metrics import ensemble_metrics
+from tally import TallyMatrix, election_pairs
+from emulator import SeatShareEmulator
+from checkpoint import checkpoint_filepath, load_checkpoint, save_df_checkpoint, restore_df_dist_ids
+
+METHODS = ['dart', 'multilevel']
+BALANCERS = ['swap', 'flow']
+
+
+def parse_seeds(seed_spec):
+    '''
+    Expands a seed specification like "1-5,10,20-22" into a list of ints.
+
+    Inputs:
+        -seed_spec (str): comma-separated seeds and inclusive ranges
+
+    Returns (list of ints)
+    '''
+    seeds = []
+    for part in seed_spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, stop = part.split('-', 1)
+            seeds.extend(range(int(start), int(stop) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+
+def district_results(df, dcol="G20PREDBID", rcol="G20PRERTRU", tally=None):
+    '''
+    Per-district population and vote margin of the current map, without
+    dissolving geometry (which isn't needed for headless output).
+
+    Inputs:
+        -df (geopandas GeoDataFrame): state data by precinct/VTD, with every
+        precinct assigned a dist_id
+        -tally (tally.TallyMatrix): the state's tally matrix, with POP100,
+        dcol and rcol among its columns. Built for just those if None
+
+    Returns (pandas DataFrame): indexed by dist_id, with POP100, dcol, rcol
+    and point_swing columns (point_swing > 0 means a Democratic win)
+    '''
+    if tally is None:
+        tally = TallyMatrix(df, ['POP100', dcol, rcol])
+    assignment = assignment_from_df(df)
+    df_dists = tally.totals_frame(assignment, int(assignment.max()))[['POP100', dcol, rcol]]
+    df_dists['point_swing'] = round((df_dists[dcol] - df_dists[rcol]) /
+                                    (df_dists[dcol] + df_dists[rcol]) * 100, 2)
+    return df_dists
+
+
+def plan_stage(method, balancer, allowed_deviation, swap_steps, milp_seconds=0):
+    '''
+    The checkpoint stage name for a plan drawn and balanced with these
+    settings, so a run with other settings doesn't resume from its map.
+
+    Returns (str): e.g. "dart_swap_dev5000_steps5"
+    '''
+    stage = f"{method}_{balancer}_dev{allowed_deviation}_steps{swap_steps}"
+    if milp_seconds > 0:
+        stage += f"_milp{milp_seconds:g}"
+    return stage
+
+
+def run_plan(df, state_input, seed, allowed_deviation=None, swap_steps=0,
+             method='dart', adjacency=None, checkpoint_dir=None, balancer='swap',
+             milp_seconds=0, features=None, tally=None, dcol="G20PREDBID",
+             rcol="G20PRERTRU"):
+    '''
+    Draws, and optionally balances, a single map and summarizes it.
+
+    Inputs:
+        -df (geopandas GeoDataFrame): state data by precinct/VTD, as returned
+        by load_state. dist_ids are overwritten.
+        -state_input (str): 2-letter state postal code
+        -seed (int): seed for draw_dart_throw_map
+        -allowed_deviation (int): population deviation to balance down to.
+        If None, uses a tenth of the target district population, like app.run
+        -swap_steps (int): largest number of repeated_pop_swap cycles (or
+        flow balancing passes) to run. 0 skips balancing.
+        -method (str): 'dart' for draw_dart_throw_map, or 'multilevel' for
+        multilevel.draw_multilevel_map, which balances as it draws
+        -adjacency (scipy sparse csr_matrix): unit adjacency for the
+        multilevel method, flow balancer and MILP finishing stage. Built from
+        df's neighbors if None
+        -checkpoint_dir (str): if given, the drawn map and balancing progress
+        are checkpointed there, and a map with a checkpoint is resumed
+        instead of drawn again. Checkpoints are kept apart by method,
+        balancer, allowed_deviation, swap_steps and milp_seconds, and a
+        finished map's checkpoint is returned as is, without balancing again
+        -balancer (str): 'swap' for repeated_pop_swap, or 'flow' for
+        flow_balance.flow_balance, which moves population between all
+        districts at once by min-cost flow (not checkpointed)
+        -milp_seconds (float): if above 0, after balancing, milp_balance gets
+        up to this many seconds to bring the deviation down the rest of the
+        way to allowed_deviation
+        -features (dict): the state's geometric features, from
+        compactness.load_geometry_features. If given, the record includes
+        each district's Polsby-Popper score and the plan's cut edges
+        -tally (tally.TallyMatrix): the state's tally matrix. If it has more
+        than one race's vote columns, the record has seats and partisan
+        metrics for each race under 'elections'
+        -dcol, rcol (str): Democratic and Republican vote columns the seats,
+        point_swing and partisan metrics come from
+
+    Returns (dict): JSON-serializable record describing the map
+    '''
+    start = time.perf_counter()
+    num_districts = SUPPORTED_STATES[state_input]['num_districts']
+    target_pop = target_dist_pop(df, num_districts)
+    if allowed_deviation is None:
+        allowed_deviation = target_pop // 10
+
+    checkpoint_fp = None
+    saved = None
+    if checkpoint_dir is not None:
+        checkpoint_fp = checkpoint_filepath(state_input, seed,
+                                            plan_stage(method, balancer, allowed_deviation,
+                                                       swap_steps, milp_seconds),
+                                            checkpoint_dir)
+        saved = load_checkpoint(checkpoint_fp, num_units=len(df), restore_rng=False)
+    finished = saved is not None and saved['counters'].get('plan_finished', False)
+    if saved is not None:
+        restore_df_dist_ids(df, saved['assignment'])
+    elif method == 'multilevel':
+        if adjacency is None:
+            adjacency = make_adjacency_matrix(df)
+        draw_multilevel_map(df, adjacency, num_districts, seed=seed,
+                            allowed_deviation=allowed_deviation)
+    else:
+        draw_dart_throw_map(df, num_districts, seed=seed)
+    if checkpoint_fp is not None and saved is None:
+        save_df_checkpoint(checkpoint_fp, df)
+    #a finished plan's checkpoint is its result, so rerunning it changes nothing
+    if not finished and swap_steps > 0 and population_deviation(df) > allowed_deviation:
+        if balancer == 'flow':
+            flow_balance(df, adjacency, allowed_deviation=allowed_deviation,
+                         max_passes=swap_steps)
+        else:
+            repeated_pop_swap(df, allowed_deviation=allowed_deviation,
+                              plot_each_step=False, stop_after=swap_steps,
+                              checkpoint_fp=checkpoint_fp)
+    if not finished and milp_seconds > 0 and population_deviation(df) > allowed_deviation:
+        milp_balance(df, adjacency, allowed_deviation=allowed_deviation,
+                     time_limit=milp_seconds)
+    if checkpoint_fp is not None and not finished:
+        last = load_checkpoint(checkpoint_fp, restore_rng=False)
+        save_df_checkpoint(checkpoint_fp, df, last['deviations'],
+                           {**last['counters'], 'finished': True, 'plan_finished': True})
+
+    df_dists = district_results(df, dcol=dcol, rcol=rcol, tally=tally)
+    deviation = population_deviation(df)
+    d_seats = int((df_dists['point_swing'] > 0).sum())
+    record = {'type': 'plan',
+              'state': state_input,
+              'seed': seed,
+              'method': method,
+              'balancer': balancer,
+              'num_districts': num_districts,
+              'target_pop': target_pop,
+              'allowed_deviation': allowed_deviation,
+              'pop_deviation': deviation,
+              'balanced': deviation <= allowed_deviation,
+              'district_pops': [int(p) for p in district_pops(df).values()],
+              'point_swing': [float(s) for s in df_dists['point_swing']],
+              'd_seats': d_seats,
+              'r_seats': num_districts - d_seats}
+    metrics = ensemble_metrics(df_dists[dcol].to_numpy(), df_dists[rcol].to_numpy())
+    for name in ['efficiency_gap', 'mean_median', 'partisan_bias', 'declination']:
+        #declination is nan when one party wins every district
+        record[name] = None if np.isnan(metrics[name]) else round(float(metrics[name]), 4)
+    if tally is not None and len(election_pairs(tally.columns)) > 1:
+        totals = tally.district_totals(assignment_from_df(df), num_districts)
+        record['elections'] = {}
+        for race, race_metrics in tally.election_metrics(totals).items():
+            record['elections'][race] = {'d_seats': int(race_metrics['seats'])}
+            for name in ['efficiency_gap', 'mean_median', 'partisan_bias', 'declination']:
+                value = race_metrics[name]
+                record['elections'][race][name] = None if np.isnan(value) else round(float(value), 4)
+    if features is not None:
+        assignment = assignment_from_df(df)
+        record['polsby_popper'] = [round(float(pp), 4) for pp in
+                                   polsby_popper(features, assignment, num_districts)]
+        record['cut_edges'] = cut_edges(features, assignment)
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_batch(states, seeds, allowed_deviation=None, swap_steps=0, ntrials=0,
+              out=None, quiet=True, method='dart', checkpoint_dir=None,
+              plan_store_dir=None, balancer='swap', milp_seconds=0, compactness=False,
+              lean=False, emulator=False):
+    '''
+    Runs run_plan for every combination of state and seed, loading each state
+    once, and writes one JSON record per line to out. If ntrials > 0, the
+    regression model is trained once and a 'state' record with its predicted
+    seat share is written for each state. A state that fails to load or set
+    up gets one 'error' record, with the step it failed at, and the batch
+    goes on to the next state.
+
+    Inputs:
+        -states (list of str): 2-letter postal codes from SUPPORTED_STATES
+        -seeds (list of ints): seeds to draw a map with, for each state
+        -allowed_deviation (int): see run_plan
+        -swap_steps (int): see run_plan
+        -ntrials (int): trials for the regression model; 0 skips prediction
+        -out (file-like): where to write records. Defaults to sys.stdout
+        -quiet (boolean): if True, the progress messages the mapping
+        functions print go to stderr so they don't mix with the records
+        -method (str): see run_plan
+        -checkpoint_dir (str): see run_plan
+        -balancer (str): see run_plan
+        -milp_seconds (float): see run_plan
+        -compactness (boolean): add compactness metrics to each plan's
+        record (see run_plan). The first time, each state's geometric
+        features are measured and cached
+        -lean (boolean): load each state with load_state(lean=True)
+        -emulator (boolean): predict each state's seat share from the
+        precomputed emulator.SeatShareEmulator table instead of training
+        the regression model (ntrials is then ignored)
+        -plan_store_dir (str): if given, every plan is also saved to a
+        plan_store.PlanStore in {plan_store_dir}/{state}, and each record
+        gets the plan's row there and whether it was a duplicate
+
+    Returns (list of dicts): every record written
+    '''
+    if out is None:
+        out = sys.stdout
+    chatter = contextlib.redirect_stdout(sys.stderr) if quiet else contextlib.nullcontext()
+    records = []
+
+    def emit(record):
+        records.append(record)
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+
+    model = SeatShareEmulator() if emulator else None
+    for state_input in states:
+        state_input = state_input.upper()
+        if state_input not in SUPPORTED_STATES:
+            emit({'type': 'error', 'state': state_input,
+                  'error': "not a supported state"})
+            continue
+        #a state that can't be set up gets an error record, like a failed seed
+        stage = None
+        try:
+            with chatter:
+                stage = 'load'
+                df = load_state(state_input, lean=lean)
+                stage = 'adjacency'
+                adjacency = None
+                if method == 'multilevel' or balancer == 'flow' or milp_seconds > 0:
+                    adjacency = make_adjacency_matrix(df)
+                stage = 'tally'
+                tally = TallyMatrix(df)
+                features = None
+                if compactness:
+                    stage = 'features'
+                    features = load_geometry_features(state_input, df, adjacency)
+                if ntrials > 0 or emulator:
+                    stage = 'predict'
+                    if model is None:
+                        model = create_linear_model(ntrials)
+                    prediction = predict_state_voteshare(state_input, ntrials,
+                                                         gdf=df, model=model)
+        except Exception as e:
+            emit({'type': 'error', 'state': state_input, 'failed_stage': stage,
+                  'error': repr(e)})
+            continue
+        if ntrials > 0 or emulator:
+            record = {'type': 'state', 'state': state_input, 'ntrials': ntrials,
+                      'population': population_sum(df),
+                      'predicted_majority_seatshare': float(prediction)}
+            if emulator:
+                record['emulator_error_bound'] = model.error_bound
+            emit(record)
+        store = None
+        if plan_store_dir is not None:
+            store = PlanStore(f"{plan_store_dir}/{state_input}", num_units=len(df),
+                              geoids=df['GEOID20'])
+        try:
+            for seed in seeds:
+                try:
+                    with chatter:
+                        record = run_plan(df, state_input, seed,
+                                          allowed_deviation=allowed_deviation,
+                                          swap_steps=swap_steps,
+                                          method=method, adjacency=adjacency,
+                                          checkpoint_dir=checkpoint_dir,
+                                          balancer=balancer,
+                                          milp_seconds=milp_seconds,
+                                          features=features,
+                                          tally=tally)
+                    if store is not None:
+                        row, is_new = store.add_df(df)
+                        record['plan_row'] = row
+                        record['duplicate'] = not is_new
+                except Exception as e:
+                    record = {'type': 'error', 'state': state_input, 'seed': seed,
+                              'error': repr(e)}
+                emit(record)
+        finally:
+            #so counts are saved even if the run is interrupted
+            if store is not None:
+                store.close()
+
+    return records
@@ -0,0 +1,250 @@
+'''
+Benchmark suite for the map-drawing pipeline.
+
+Times each stage of the pipeline on each bundled state with fixed seeds:
+    load (load_state without neighbors), neighbors (affix_neighbors_list),
+    draw (draw_dart_throw_map, including hole filling), fill_holes (the
+    fill_district_holes part of draw), pop_swap (repeated_pop_swap),
+    ethan_batch / ethan_single (Ethan's balancers), dissolve (dissolve_map)
+
+Every run is appended as one JSON line to a history file, together with the
+git commit and Python version, so timings can be compared across commits.
+
+measure_startup times how long `python redistricting_redux list` takes, to
+keep heavy imports (geopandas, pandas, scikit-learn...) off the startup path.
+
+Usage:
+    python redistricting_redux bench --states NV AZ --seeds 1,2
+    python redistricting_redux bench --compare
+    python redistricting_redux bench --startup
+'''
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import instrumentation
+from app import SUPPORTED_STATES
+
+#Bundled states, smallest to largest
+BENCH_STATES = ['NV', 'AZ', 'NC', 'GA', 'OH', 'TX']
+BENCH_SEEDS = [2023]
+HISTORY_FP = "redistricting_redux/benchmarks/history.jsonl"
+STAGES = ['load', 'neighbors', 'draw', 'fill_holes', 'pop_swap',
+          'ethan_batch', 'ethan_single', 'dissolve']
+#Most seconds `python redistricting_redux list` should take
+STARTUP_TARGET_S = 0.5
+
+
+def git_commit():
+    '''
+    Short hash of the current git commit, or None outside a git checkout.
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_startup(runs=5, argv=('list',)):
+    '''
+    Median wall time of running the CLI in a fresh interpreter, including
+    interpreter startup.
+
+    Inputs:
+        -runs (int): number of times to run it
+        -argv (tuple of str): CLI arguments; the default only lists states
+
+    Returns (float): seconds
+    '''
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, package_dir, *argv], check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def _timed(results, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        value = func(*args, **kwargs)
+    except Exception as e:
+        results['errors'][stage] = repr(e)
+        return None
+    results['seconds'][stage] = round(time.perf_counter() - start, 4)
+    return value
+
+
+def bench_state(state_input, seed, swap_steps=3, ethan_steps=10):
+    '''
+    Times every pipeline stage once on one state with one seed. Balancers
+    each start from a copy of the same freshly drawn map.
+
+    Inputs:
+        -state_input (str): 2-letter postal code of a bundled state
+        -seed (int): seed for draw_dart_throw_map
+        -swap_steps (int): stop_after for repeated_pop_swap
+        -ethan_steps (int): stop_after for each of Ethan's balancers
+
+    Returns (dict): {'state', 'seed', 'precincts', 'seconds': {stage: s},
+    'errors': {stage: message}}
+    '''
+    from load_state_data import load_state, affix_neighbors_list
+    from draw_random_maps import draw_dart_throw_map, repeated_pop_swap, dissolve_map, target_dist_pop
+    from ethan_balance import batch_balance_transfer, single_balance_transfer
+
+    results = {'state': state_input, 'seed': seed, 'seconds': {}, 'errors': {}}
+    num_districts = SUPPORTED_STATES[state_input]['num_districts']
+
+    df = _timed(results, 'load', load_state, state_input, affix_neighbors=False)
+    if df is None:
+        return results
+    results['precincts'] = len(df)
+    neighbor_fp = f'redistricting_redux/merged_shps/{state_input}_2020_neighbors.csv'
+    _timed(results, 'neighbors', affix_neighbors_list, df, neighbor_fp)
+    allowed_deviation = target_dist_pop(df, num_districts) // 10
+
+    #read fill_district_holes' share of the draw off its instrumentation phase
+    was_enabled = instrumentation.is_enabled()
+    if not was_enabled:
+        instrumentation.enable(track_memory=False)
+    instrumentation.reset()
+    _timed(results, 'draw', draw_dart_throw_map, df, num_districts, seed=seed)
+    fill = instrumentation.report()['phases'].get('hole filling')
+    results['seconds']['fill_holes'] = round(fill['total_s'], 4) if fill else 0.0
+    if not was_enabled:
+        instrumentation.disable()
+    if 'draw' in results['errors']:
+        return results
+
+    drawn = df['dist_id'].copy()
+    _timed(results, 'pop_swap', repeated_pop_swap, df,
+           allowed_deviation=allowed_deviation, stop_after=swap_steps)
+    balanced = df['dist_id'].copy()
+
+    df['dist_id'] = drawn.copy()
+    _timed(results, 'ethan_batch', batch_balance_transfer, df, run=0,
+           run_dict={}, allowed_deviation=allowed_deviation, stop_after=ethan_steps)
+    df['dist_id'] = drawn.copy()
+    _timed(results, 'ethan_single', single_balance_transfer, df, run=0,
+           run_dict={}, allowed_deviation=allowed_deviation, stop_after=ethan_steps)
+
+    df['dist_id'] = balanced
+    _timed(results, 'dissolve', dissolve_map, df)
+
+    return results
+
+
+def run_benchmarks(states=None, seeds=None, swap_steps=3, ethan_steps=10,
+                   history_fp=HISTORY_FP, quiet=True):
+    '''
+    Runs bench_state for every state and seed and appends the run to the
+    history file.
+
+    Inputs:
+        -states (list of str): defaults to BENCH_STATES
+        -seeds (list of ints): defaults to BENCH_SEEDS
+        -swap_steps, ethan_steps (int): see bench_state
+        -history_fp (str): JSON-lines file to append the run to. None to
+        skip recording
+        -quiet (boolean): send the pipeline's progress messages to stderr
+
+    Returns (dict): the run record, including each stage's median time per
+    state under 'medians'
+    '''
+    states = [s.upper() for s in (states or BENCH_STATES)]
+    seeds = seeds or BENCH_SEEDS
+    chatter = contextlib.redirect_stdout(sys.stderr) if quiet else contextlib.nullcontext()
+
+    results = []
+    for state_input in states:
+        for seed in seeds:
+            with chatter:
+                results.append(bench_state(state_input, seed, swap_steps, ethan_steps))
+
+    medians = {}
+    for state_input in states:
+        by_stage = {}
+        for res in results:
+            if res['state'] != state_input:
+                continue
+            for stage, seconds in res['seconds'].items():
+                by_stage.setdefault(stage, []).append(seconds)
+        medians[state_input] = {stage: statistics.median(times)
+                                for stage, times in by_stage.items()}
+
+    run = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+           'commit': git_commit(),
+           'python': platform.python_version(),
+           'machine': platform.machine(),
+           'swap_steps': swap_steps,
+           'ethan_steps': ethan_steps,
+           'seeds': seeds,
+           'results': results,
+           'medians': medians}
+
+    if history_fp is not None:
+        os.makedirs(os.path.dirname(history_fp), exist_ok=True)
+        with open(history_fp, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+    return run
+
+
+def load_history(history_fp=HISTORY_FP):
+    '''
+    Reads every run recorded in the history file, oldest first.
+    '''
+    if not os.path.exists(history_fp):
+        return []
+    with open(history_fp) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_runs(baseline, current, threshold=0.2):
+    '''
+    Compares the median stage times of two runs.
+
+    Inputs:
+        -baseline, current (dicts): runs as returned by run_benchmarks
+        -threshold (float): relative slowdown above which a stage counts as
+        a regression (0.2 = 20% slower)
+
+    Returns (list of dicts): one per (state, stage) present in both runs, with
+    baseline and current seconds, their ratio, and a 'regression' flag
+    '''
+    rows = []
+    for state_input, stages in current['medians'].items():
+        base_stages = baseline['medians'].get(state_input, {})
+        for stage in STAGES:
+            if stage not in stages or stage not in base_stages:
+                continue
+            base, curr = base_stages[stage], stages[stage]
+            ratio = curr / base if base > 0 else float('inf')
+            rows.append({'state': state_input, 'stage': stage,
+                         'baseline_s': base, 'current_s': curr,
+                         'ratio': round(ratio, 3),
+                         'regression': ratio > 1 + threshold})
+    return rows
+
+
+def format_comparison(rows):
+    '''
+    Human-readable table of compare_runs output.
+    '''
+    lines = [f"{'state':<6}{'stage':<14}{'before s':>10}{'after s':>10}{'ratio':>8}"]
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        lines.append(f"{row['state']:<6}{row['stage']:<14}{row['baseline_s']:>10.3f}"
+                     f"{row['current_s']:>10.3f}{row['ratio']:>8.2f}{flag}")
+    return '\n'.join(lines)
@@ -0,0 +1,164 @@
+'''
+Checkpoints for long balancing runs, so a killed run can pick up where it
+left off instead of starting over from the dart throw.
+
+A checkpoint is a single compressed .npz file holding:
+    -assignment: int16 array of each unit's district, in row order (0 means
+    unassigned), like the assignment arrays in graph_maps
+    -deviations: the population deviation history so far
+    -counters: JSON of the balancer's loop counters and any other small
+    state it needs to continue (e.g. recent transfers). A balancer that ran
+    to the end marks them 'finished', and resuming from that checkpoint
+    returns its map unchanged instead of balancing it further
+    -rng_state: JSON of the random and numpy.random module states
+
+Files are written to a temporary file in the same directory and then moved
+into place with os.replace, so a checkpoint on disk is always complete: a run
+killed mid-write leaves the previous checkpoint intact.
+'''
+import json
+import os
+import random
+import tempfile
+import numpy as np
+import pandas as pd
+
+CHECKPOINT_DIR = "redistricting_redux/checkpoints"
+
+
+def checkpoint_filepath(state_postal, seed, stage="balance", checkpoint_dir=CHECKPOINT_DIR):
+    '''
+    Where the checkpoint for one state, seed and balancing stage is kept.
+
+    Inputs:
+        -state_postal (str): 2-letter state postal code
+        -seed (int): seed the map was drawn with
+        -stage (str): which balancer is writing, e.g. "balance", "ethan_batch"
+
+    Returns (str): filepath
+    '''
+    return os.path.join(checkpoint_dir, f"{state_postal}_{seed}_{stage}.npz")
+
+
+def get_rng_state():
+    '''
+    JSON-serializable state of the random and numpy.random modules.
+    '''
+    version, internal, gauss = random.getstate()
+    name, keys, pos, has_gauss, cached = np.random.get_state()
+    return {'random': [version, list(internal), gauss],
+            'numpy': [name, keys.tolist(), pos, has_gauss, cached]}
+
+
+def set_rng_state(state):
+    '''
+    Restores the random and numpy.random module states saved by
+    get_rng_state.
+    '''
+    version, internal, gauss = state['random']
+    random.setstate((version, tuple(internal), gauss))
+    name, keys, pos, has_gauss, cached = state['numpy']
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached))
+
+
+def save_checkpoint(fp, assignment, deviations=(), counters=None):
+    '''
+    Atomically writes a checkpoint.
+
+    Inputs:
+        -fp (str): checkpoint filepath (.npz)
+        -assignment (NumPy array): district of each unit, 0 = unassigned
+        -deviations (list of ints): population deviation history
+        -counters (dict): JSON-serializable loop state of the balancer
+
+    Returns: None, writes fp
+    '''
+    directory = os.path.dirname(fp) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_fp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f,
+                                assignment=np.asarray(assignment, dtype=np.int16),
+                                deviations=np.asarray(deviations, dtype=np.int64),
+                                counters=np.array(json.dumps(counters or {})),
+                                rng_state=np.array(json.dumps(get_rng_state())))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fp, fp)
+    except BaseException:
+        if os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+        raise
+
+
+def load_checkpoint(fp, num_units=None, restore_rng=True):
+    '''
+    Reads a checkpoint written by save_checkpoint.
+
+    Inputs:
+        -fp (str): checkpoint filepath
+        -num_units (int): if given, a checkpoint for a different number of
+        units is treated as missing
+        -restore_rng (boolean): also restore the random module states
+
+    Returns (dict or None): {'assignment', 'deviations' (list), 'counters'
+    (dict)}, or None if there is no usable checkpoint
+    '''
+    if fp is None or not os.path.exists(fp):
+        return None
+    with np.load(fp) as data:
+        assignment = data['assignment']
+        deviations = data['deviations'].tolist()
+        counters = json.loads(str(data['counters']))
+        rng_state = json.loads(str(data['rng_state']))
+    if num_units is not None and len(assignment) != num_units:
+        print(f"Checkpoint {fp} is for a different map. Ignoring it")
+        return None
+    if restore_rng:
+        set_rng_state(rng_state)
+    return {'assignment': assignment, 'deviations': deviations, 'counters': counters}
+
+
+def reopen_checkpoint(fp):
+    '''
+    Clears a checkpoint's finished marker, keeping its map and deviation
+    history, so the next balancing run continues from that map instead of
+    returning it as is.
+    '''
+    saved = load_checkpoint(fp, restore_rng=False)
+    if saved is not None and saved['counters'].get('finished', False):
+        save_checkpoint(fp, saved['assignment'], saved['deviations'])
+
+
+def remove_checkpoint(fp):
+    '''
+    Deletes a checkpoint, if there is one.
+    '''
+    if fp is not None and os.path.exists(fp):
+        os.remove(fp)
+
+
+def save_df_checkpoint(fp, df, deviations=(), counters=None):
+    '''
+    save_checkpoint for the dist_id column of a precinct GeoDataFrame.
+    '''
+    assignment = pd.to_numeric(df['dist_id'], errors='coerce').fillna(0).to_numpy()
+    save_checkpoint(fp, assignment, deviations, counters)
+
+
+def restore_df_dist_ids(df, assignment):
+    '''
+    Writes a checkpointed assignment back to df's dist_id column, as ints
+    with None for unassigned precincts, the way draw_random_maps sets it (or
+    as a nullable integer with <NA>, if that's what the column already is,
+    as with load_state(lean=True)).
+
+    Returns: None, modifies df in-place
+    '''
+    if 'dist_id' in df.columns and pd.api.types.is_extension_array_dtype(df['dist_id']):
+        from graph_maps import set_dist_ids
+        set_dist_ids(df, np.asarray(assignment))
+        return
+    df['dist_id'] = pd.Series([int(id) if id > 0 else None for id in assignment.tolist()],
+                              index=df.index, dtype=object)
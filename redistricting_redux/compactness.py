@@ -0,0 +1,195 @@
+'''
+Compactness metrics from precomputed geometric features.
+
+Measuring a plan's compactness from dissolve_map output means a full polygon
+union for every plan. But a district's area is just the sum of its units'
+areas, and its perimeter is the sum of its units' perimeters minus twice the
+length of every border shared by two of its units. So the geometry is
+measured once per state, in an equal-area projection:
+    -the area and perimeter of each unit
+    -the length of the border each pair of neighboring units share
+and cached next to the adjacency matrix. After that, district area,
+perimeter, Polsby-Popper score and cut edges for any assignment (or a whole
+plans x units matrix of them, e.g. from a plan_store.PlanStore) are
+bincounts over those arrays, with no shapely calls.
+
+Features are in meters and square meters. Shared border lengths come from
+intersecting unit boundaries, so gaps or overlaps between precinct polygons
+make district perimeters slightly too long.
+'''
+import numpy as np
+import shapely
+from scipy import sparse
+
+from plan_store import geoid_digest
+
+#CONUS Albers, in meters (the projection synthetic states are drawn in too)
+EQUAL_AREA_CRS = "EPSG:5070"
+#Neighboring pairs measured at a time, to bound memory at block level
+EDGE_CHUNK_SIZE = 100000
+
+
+def features_filepath(state_input, level="vtd"):
+    return f"redistricting_redux/merged_shps/{state_input}_2020_{level}_geometry.npz"
+
+
+def compute_geometry_features(df, adjacency=None):
+    '''
+    Measures each unit's area and perimeter, and the length of each shared
+    border, in EQUAL_AREA_CRS.
+
+    Inputs:
+        -df (geopandas GeoDataFrame): state data with geometry. If it has no
+        CRS, its coordinates are taken to be equal-area meters already
+        -adjacency (scipy sparse csr_matrix): unit adjacency in df's row
+        order. Built from the geometry if None
+
+    Returns (dict of NumPy arrays): 'area' and 'perimeter' per unit, and
+    'edge_i', 'edge_j', 'edge_length' per pair of neighbors (i < j), plus
+    'geoid_digest' of df's unit order
+    '''
+    geometry = df.geometry
+    if geometry.crs is not None:
+        geometry = geometry.to_crs(EQUAL_AREA_CRS)
+    geoms = geometry.values
+    if adjacency is None:
+        from load_state_data import build_adjacency_matrix
+        adjacency = build_adjacency_matrix(df)
+
+    pairs = sparse.triu(adjacency, k=1).tocoo()
+    edge_i, edge_j = pairs.row.astype(np.int32), pairs.col.astype(np.int32)
+    boundaries = shapely.boundary(geoms)
+    edge_length = np.empty(len(edge_i))
+    for start in range(0, len(edge_i), EDGE_CHUNK_SIZE):
+        i = edge_i[start:start + EDGE_CHUNK_SIZE]
+        j = edge_j[start:start + EDGE_CHUNK_SIZE]
+        edge_length[start:start + len(i)] = shapely.length(
+            shapely.intersection(boundaries[i], boundaries[j]))
+
+    digest = geoid_digest(df['GEOID20']) if 'GEOID20' in df.columns else ''
+    return {'area': shapely.area(geoms),
+            'perimeter': shapely.length(geoms),
+            'edge_i': edge_i,
+            'edge_j': edge_j,
+            'edge_length': edge_length,
+            'geoid_digest': np.array(digest)}
+
+
+def save_geometry_features(features, filepath):
+    np.savez_compressed(filepath, **features)
+
+
+def load_geometry_features(state_input, df=None, adjacency=None, level="vtd"):
+    '''
+    Loads a state's geometric features from the cache written by
+    save_geometry_features. If there's no cache yet, or it was built for a
+    different unit order than df's, they are computed from df and cached for
+    next time.
+
+    Inputs:
+        -state_input (str): 2-letter state postal code abbreviation
+        -df (geopandas GeoDataFrame): the state's data, needed to build the
+        cache and to check it matches
+        -adjacency (scipy sparse csr_matrix): see compute_geometry_features
+        -level (str): "vtd" or "block"
+
+    Returns (dict of NumPy arrays): see compute_geometry_features
+    '''
+    fp = features_filepath(state_input, level)
+    try:
+        with np.load(fp) as arrays:
+            features = {key: arrays[key] for key in arrays.files}
+        if df is None or str(features['geoid_digest']) == geoid_digest(df['GEOID20']):
+            return features
+    except FileNotFoundError:
+        if df is None:
+            raise FileNotFoundError(f"No geometry cache at {fp}. Pass the state's "
+                                    "GeoDataFrame to build one")
+    features = compute_geometry_features(df, adjacency)
+    save_geometry_features(features, fp)
+    return features
+
+
+def _by_district(assignments, weights, num_districts):
+    '''
+    Sums weights by district for each row of a (plans x items) matrix of
+    district numbers, in one bincount.
+
+    Returns (NumPy array): plans x num_districts
+    '''
+    num_plans = assignments.shape[0]
+    offsets = np.arange(num_plans)[:, None] * (num_districts + 1)
+    totals = np.bincount((assignments + offsets).ravel(),
+                         weights=np.broadcast_to(weights, assignments.shape).ravel(),
+                         minlength=num_plans * (num_districts + 1))
+    return totals.reshape(num_plans, num_districts + 1)[:, 1:]
+
+
+def _as_plans(assignments):
+    assignments = np.asarray(assignments)
+    return np.atleast_2d(assignments).astype(np.int64), assignments.ndim == 1
+
+
+def district_areas(features, assignments, num_districts):
+    '''
+    Area of each district, in square meters.
+
+    Inputs:
+        -features (dict): from load_geometry_features
+        -assignments (NumPy array): district (1 to num_districts) of each
+        unit, or a plans x units matrix of them
+        -num_districts (int)
+
+    Returns (NumPy array): area of district i at index i-1, one row per plan
+    if assignments is a matrix
+    '''
+    plans, single = _as_plans(assignments)
+    areas = _by_district(plans, features['area'], num_districts)
+    return areas[0] if single else areas
+
+
+def district_perimeters(features, assignments, num_districts):
+    '''
+    Perimeter of each district, in meters: its units' perimeters, less
+    every border shared by two of its units (counted once for each unit).
+
+    Inputs and Returns: like district_areas
+    '''
+    plans, single = _as_plans(assignments)
+    perimeters = _by_district(plans, features['perimeter'], num_districts)
+    from_i = plans[:, features['edge_i']]
+    inside = from_i == plans[:, features['edge_j']]
+    #edges between districts go to the 0 column, which is dropped
+    perimeters -= 2 * _by_district(np.where(inside, from_i, 0),
+                                   features['edge_length'], num_districts)
+    return perimeters[0] if single else perimeters
+
+
+def polsby_popper(features, assignments, num_districts):
+    '''
+    Polsby-Popper score of each district: 4 pi area / perimeter^2, 1 for a
+    circle and near 0 for long, thin or very jagged districts.
+
+    Inputs and Returns: like district_areas
+    '''
+    areas = district_areas(features, assignments, num_districts)
+    perimeters = district_perimeters(features, assignments, num_districts)
+    return 4 * np.pi * areas / perimeters ** 2
+
+
+def cut_edges(features, assignments):
+    '''
+    Number of pairs of neighboring units in different districts, a
+    compactness measure that doesn't depend on how jagged precinct
+    boundaries are.
+
+    Inputs:
+        -features (dict): from load_geometry_features
+        -assignments (NumPy array): district of each unit, or a plans x units
+        matrix of them
+
+    Returns (int, or NumPy array with one count per plan)
+    '''
+    plans, single = _as_plans(assignments)
+    cut = (plans[:, features['edge_i']] != plans[:, features['edge_j']]).sum(axis=1)
+    return int(cut[0]) if single else cut
@@ -7,10 +7,12 @@ import geopandas as gpd
 import numpy as np
 import random 
 import re
-import time
 from datetime import datetime
 import matplotlib as plt
 from stats import population_sum, blue_red_margin, target_dist_pop, set_blue_red_diff #not sure i did this relative directory right
+from instrumentation import phase, timed
+from checkpoint import load_checkpoint, save_df_checkpoint, restore_df_dist_ids
+from simplified_geometry import resolution_geometry, with_resolution, DISPLAY_RESOLUTION
 
 
 def clear_dist_ids(df):
@@ -22,9 +24,14 @@ def clear_dist_ids(df):
 
     Returns: None, modifies GeoDataFrame in-place
     '''
-    df['dist_id'] = None
+    if 'dist_id' in df.columns and pd.api.types.is_extension_array_dtype(df['dist_id']):
+        #keep load_state(lean=True)'s nullable integer column nullable
+        df['dist_id'] = pd.Series(pd.NA, index=df.index, dtype=df['dist_id'].dtype)
+    else:
+        df['dist_id'] = None
 
 
+@timed
 def draw_into_district(df, precinct, id):
     '''
     Assigns a subunit of the state (currently, voting precinct; ideally, census
@@ -42,6 +49,7 @@ def draw_into_district(df, precinct, id):
     df.loc[df['GEOID20'] == precinct, 'dist_id'] = id
 
 
+@timed
 def all_allowed_neighbors_of_district(df, id):
     '''
     Ascertain if there are any precincts bordering an in-progress district
@@ -95,20 +103,20 @@ def draw_dart_throw_map(df, num_districts, seed=2023, clear_first=True):
     if clear_first:
         print("Clearing off previous district drawings, if any...")
         clear_dist_ids(df)
-        time.sleep(0.1)
 
     random.seed(seed) 
     
     target_pop = target_dist_pop(df, num_districts)
 
     #throw darts
-    for id in range(1, num_districts+1):
-        curr_index = random.randint(0, len(df)-1)
-        while df.loc[curr_index, 'dist_id'] is not None:
+    with phase("dart throw"):
+        for id in range(1, num_districts+1):
             curr_index = random.randint(0, len(df)-1)
-        curr_precinct = df.loc[curr_index, 'GEOID20']
-        print(f"Throwing dart for district {id} at precinct {curr_precinct}...")
-        draw_into_district(df, curr_precinct, id)
+            while pd.notna(df.loc[curr_index, 'dist_id']):
+                curr_index = random.randint(0, len(df)-1)
+            curr_precinct = df.loc[curr_index, 'GEOID20']
+            print(f"Throwing dart for district {id} at precinct {curr_precinct}...")
+            draw_into_district(df, curr_precinct, id)
 
     #expand into area around darts
     holes_left = len(df.loc[df['dist_id'].isnull()])
@@ -126,21 +134,23 @@ def draw_dart_throw_map(df, num_districts, seed=2023, clear_first=True):
             break
         #randomize the order in which districts expand each go-round
         random.shuffle(expand_order) 
-        for id in expand_order:
-            allowed = all_allowed_neighbors_of_district(df, id)
-            for neighbor in allowed:
-                if population_sum(df, district=id) <= target_pop:
-                    draw_into_district(df, neighbor, id)
-                else:
-                    print(f"District {id} has hit its target population size")
-                    if id in expand_order:
-                        expand_order.remove(id)
-                    break
+        with phase("district expansion"):
+            for id in expand_order:
+                allowed = all_allowed_neighbors_of_district(df, id)
+                for neighbor in allowed:
+                    if population_sum(df, district=id) <= target_pop:
+                        draw_into_district(df, neighbor, id)
+                    else:
+                        print(f"District {id} has hit its target population size")
+                        if id in expand_order:
+                            expand_order.remove(id)
+                        break
 
 
 ### MAP CLEANUP FUNCTIONS ###
 
 
+@phase("hole filling")
 def fill_district_holes(df):
     '''
     Helper function for draw_chaos_state_map. Determine where the remaining 
@@ -159,7 +169,6 @@ def fill_district_holes(df):
         go_rounds += 1
         holes = df.loc[df['dist_id'].isnull()]
         print(f"{holes.shape[0]} unfilled precincts remaining")
-        time.sleep(1)
         for index, hole in holes.iterrows():
             real_dists_ard_hole = find_neighboring_districts(df, hole['neighbors'], include_None=False)
             if len(real_dists_ard_hole) == 1:
@@ -171,6 +180,7 @@ def fill_district_holes(df):
     print("Cleanup complete. All holes in districts filled. Districts expanded to fill empty space.")
 
 
+@phase("swap cycle")
 def mapwide_pop_swap(df, allowed_deviation=70000):
     '''
     Iterates through the precincts in a state with a drawn district map and 
@@ -191,7 +201,7 @@ def mapwide_pop_swap(df, allowed_deviation=70000):
 
     Returns: None, modifies df in-place
     '''
-    target_pop = target_dist_pop(df, n=max(df['dist_id']))
+    target_pop = target_dist_pop(df, n=int(df['dist_id'].max()))
     draws_to_do = []
     print("Checking for precincts to move from overpopulated districts to underpopulated neighbors.")
     print("This could take up to a minute...")
@@ -238,7 +248,8 @@ def population_deviation(df):
     return pop_dev
 
 
-def repeated_pop_swap(df, allowed_deviation=70000, plot_each_step=False, stop_after=20):
+def repeated_pop_swap(df, allowed_deviation=70000, plot_each_step=False, stop_after=20,
+                      checkpoint_fp=None, checkpoint_every=1):
     '''
     Repeatedly calls mapwide_pop_swap() until populations of districts are 
     within allowable deviation range. Terminates early if the procedure is 
@@ -255,12 +266,31 @@ def repeated_pop_swap(df, allowed_deviation=70000, plot_each_step=False, stop_af
         fragmentation and/or inspect progress or cycles visually.
         -stop_after (int): manual number of steps to stop after if procedure
         hasn't yet terminated.
+        -checkpoint_fp (str): if given, the map and swap progress are saved
+        here (see checkpoint.py), and if a checkpoint is already there, the
+        run picks up from it instead of starting over. A checkpoint left by a
+        run that finished is its result: the map is restored and not swapped
+        further (see checkpoint.reopen_checkpoint to swap more).
+        -checkpoint_every (int): save a checkpoint every this many cycles
 
     Returns: None, modifies df in place
     '''
     count = 0
 
     pop_devs_so_far = []
+    saved = load_checkpoint(checkpoint_fp, num_units=len(df))
+    if saved is not None:
+        restore_df_dist_ids(df, saved['assignment'])
+        pop_devs_so_far = saved['deviations']
+        if saved['counters'].get('finished', False):
+            #a finished run's map is its result, not a place to swap more from
+            print(f"This map's swapping already finished after {len(pop_devs_so_far)} swap cycles")
+            return
+        if saved['counters'].get('in_progress', False):
+            count = saved['counters']['count']
+            stop_after = saved['counters']['stop_after']
+        print(f"Resuming from checkpoint after {len(pop_devs_so_far)} swap cycles")
+
     while population_deviation(df) >= allowed_deviation:
         #check whether method is repeatedly swapping same districts back & forth
         if len(pop_devs_so_far) > 5 and pop_devs_so_far[-4:-2] == pop_devs_so_far[-2::]:
@@ -277,10 +307,17 @@ def repeated_pop_swap(df, allowed_deviation=70000, plot_each_step=False, stop_af
             plot_dissolved_map(df, "test")
         dist_pops = district_pops(df)
         print(f"The most and least populous district differ by: {population_deviation(df)}")
+        if checkpoint_fp is not None and count % checkpoint_every == 0:
+            save_df_checkpoint(checkpoint_fp, df, pop_devs_so_far,
+                               {'count': count, 'stop_after': stop_after, 'in_progress': True})
+    if checkpoint_fp is not None:
+        save_df_checkpoint(checkpoint_fp, df, pop_devs_so_far,
+                           {'count': count, 'stop_after': stop_after, 'finished': True})
     if population_deviation(df) <= allowed_deviation:
         print("You've reached your population balance target. Hooray!")
 
 
+@timed
 def find_neighboring_districts(df, lst, include_None=True):
     '''
     Takes in a list of precinct names, and outputs a set of all districts 
@@ -302,9 +339,10 @@ def find_neighboring_districts(df, lst, include_None=True):
     if include_None:
         return dists_theyre_in
     else:
-        return {i for i in dists_theyre_in if i is not None}
+        return {i for i in dists_theyre_in if pd.notna(i)}
 
 
+@timed
 def smallest_neighbor_district(df, neighbor_districts):
     '''
     Finds the least populous district among those in a given set of districts
@@ -321,6 +359,7 @@ def smallest_neighbor_district(df, neighbor_districts):
     return smallest_neighbor
 
 
+@phase("orphan recapture")
 def recapture_orphan_precincts(df, idx):
     '''
     Finds precincts that are entirely disconnected from the bulk of their 
@@ -340,20 +379,30 @@ def recapture_orphan_precincts(df, idx):
             draw_into_district(df, row[idx['GEOID20']], smallest_neighbor_district(df, neighboring_districts))
 
 
-def dissolve_map(df):
+@phase("dissolve")
+def dissolve_map(df, resolution=None):
     '''
     Dissolves a precinct-level map into districts. To be used only after
     district assignment is finalized (i.e. after any population balancing
-    or modification you want to do).
+    or modification you want to do). Numeric columns are summed by district;
+    other columns (GEOID20, neighbors) are dropped.
 
     Inputs:
         -df (geopandas GeoDataFrame): state preinct/VTD-level data, with 
         polygons. 
+        -resolution (str): dissolve the simplified polygons at this
+        resolution (see simplified_geometry.RESOLUTIONS) instead of the
+        exact ones, for a map that's only going to be drawn. Totals are the
+        same either way
     
     Returns (geopandas GeoDataFrame): state district-level data, by custom
     disttricts we drew.
     '''
-    df_dists = df.dissolve(by='dist_id', aggfunc=sum)
+    numeric = [col for col in df.columns if col != 'dist_id'
+               and pd.api.types.is_numeric_dtype(df[col])]
+    df = gpd.GeoDataFrame(df[numeric + ['dist_id']],
+                          geometry=resolution_geometry(df, resolution))
+    df_dists = df.dissolve(by='dist_id', aggfunc='sum')
     df_dists.reset_index(drop=True)
 
     #may cause ZeroDivisionError in the edge case where a district is exactly tied
@@ -364,6 +413,7 @@ def dissolve_map(df):
     return df_dists
 
 
+@phase("plotting")
 def plot_dissolved_map(df_dists, state_postal, dcol="G20PREDBID", rcol="G20PRERTRU"):
     '''
     Plot a map that dissolves precinct boundaries to show districts as solid
@@ -373,7 +423,8 @@ def plot_dissolved_map(df_dists, state_postal, dcol="G20PREDBID", rcol="G20PRERT
     Inputs:
         -df (geopandas GeoDataFrame): state DISTRICT-level data, with 
         polygons (you should call dissolve_map(df) first if you are trying to 
-        call this on a precinct-level map)
+        call this on a precinct-level map; dissolve at DISPLAY_RESOLUTION
+        for a faster plot)
         -state_postal (str of length 2)
         -dcol (str): Name of column that contains Democratic voteshare data
         (i.e. estimated number of votes cast for Joe Biden in the precinct in
@@ -403,6 +454,7 @@ def plot_dissolved_map(df_dists, state_postal, dcol="G20PREDBID", rcol="G20PRERT
     return filepath
 
 
+@timed
 def district_pops(df):
     '''
     Outputs the population of each district drawn so far.
@@ -414,22 +466,25 @@ def district_pops(df):
     as values
     '''
     pops_dict = {}
-    for i in range(1, max([id for id in df.dist_id if id is not None])+1):
+    for i in range(1, int(df['dist_id'].max())+1):
         pops_dict[i] = population_sum(df, district=i)
     return pops_dict
 
 
 ### DEBUGGING FUNCTIONS ###
 
-def plot_GEOID20s(df):
+def plot_GEOID20s(df, resolution=DISPLAY_RESOLUTION):
     '''
     Creates a giant blank map of every precinct with its GEOID20 on it for debugging
     purposes. That map can then be eyeballed to see if neighbors functions are
     working accurately.
     Inputs:
         -df(geopandas GeoDataFrame)
+        -resolution (str): simplified polygons to draw (see
+        simplified_geometry.RESOLUTIONS), or None for the exact ones
     Returns: None, outputs plot to file
     '''
+    df = with_resolution(df, resolution)
     df['center'] = df['geometry'].centroid #these points have a .x and .y attribute
 
     df.plot(edgecolor="black", linewidth=0.1)
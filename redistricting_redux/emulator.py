@@ -0,0 +1,185 @@
+'''
+Precomputed emulator for the seat-share model.
+
+predict_state_voteshare has to simulate ntrials grids and fit a regression
+before it can answer, but the simulation only depends on a state's mean
+voteshare, voteshare variance and how clustered its voters are. So the
+simulation is run once, offline, with many trials at every point of a grid
+of mean voteshares and variances, for both clustered and random grids
+(the two kinds proportionality.simulate_data draws), and the averages are
+shipped in EMULATOR_FILEPATH. A prediction is then a bilinear interpolation
+in (mean voteshare, variance) on each kind of grid, and a linear
+interpolation between the two by clustering score.
+
+Simulation settings match create_linear_model's training data (2x2
+districts, 49 of them). The table also keeps the standard error of every
+grid point, and how far its predictions were from direct simulation at
+random points between grid points when it was built (see
+validate_emulator), so every prediction comes with an error bound.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import os
+import random
+import numpy as np
+
+import proportionality
+
+EMULATOR_FILEPATH = "redistricting_redux/models/seat_share_emulator.npz"
+#Grid the table is built on: the majority party's mean voteshare, and the
+#variance of voteshares across VTDs (regression's MIN_VOTESHARE to
+#MAX_VOTESHARE and MIN_VAR to MAX_VAR)
+VOTESHARE_GRID = np.round(np.linspace(0.5, 0.7, 11), 3)
+VAR_GRID = np.round(np.linspace(0.01, 0.1, 10), 3)
+#Clustered grids first, then random ones
+CLUSTER_KINDS = (True, False)
+EMULATOR_TRIALS = 500
+VALIDATION_POINTS = 40
+#create_linear_model's settings
+DISTRICT_SIZE = 2
+NUM_DISTRICTS = 49
+
+
+def simulate_point(mean_voteshare, var, cluster, ntrials, seed):
+    '''
+    Runs proportionality.simulate_data ntrials times at one setting.
+
+    Returns (tuple of 2 NumPy arrays): per_districts_won and clustering
+    score of each trial
+    '''
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    results = np.array([proportionality.simulate_data(mean_voteshare, var, DISTRICT_SIZE,
+                                                      NUM_DISTRICTS, cluster=cluster)
+                        for _ in range(ntrials)])
+    return results[:, 0], results[:, 1]
+
+
+def _simulate_points(points, ntrials, seed, max_workers):
+    seeds = np.random.SeedSequence(seed).generate_state(len(points), dtype=np.uint64)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(simulate_point, m, v, c, ntrials, int(s))
+                   for (m, v, c), s in zip(points, seeds)]
+        return [future.result() for future in futures]
+
+
+def build_emulator_table(ntrials=EMULATOR_TRIALS, seed=0, max_workers=None):
+    '''
+    Simulates every point of the VOTESHARE_GRID x VAR_GRID grid, for both
+    kinds of grid, in parallel.
+
+    Inputs:
+        -ntrials (int): simulations at each point
+        -seed (int): seed for the whole table
+        -max_workers (int): worker processes (defaults to the number of CPUs)
+
+    Returns (dict of NumPy arrays): 'seat_share', 'seat_share_se' (its
+    standard error) and 'cluster_score', each indexed by (kind, voteshare,
+    variance), plus the grids and 'ntrials'
+    '''
+    points = [(float(m), float(v), c) for c in CLUSTER_KINDS
+              for m in VOTESHARE_GRID for v in VAR_GRID]
+    results = _simulate_points(points, ntrials, seed, max_workers)
+    shape = (len(CLUSTER_KINDS), len(VOTESHARE_GRID), len(VAR_GRID))
+    seats = np.array([r[0] for r in results])
+    return {'seat_share': seats.mean(axis=1).reshape(shape),
+            'seat_share_se': (seats.std(axis=1, ddof=1) / np.sqrt(ntrials)).reshape(shape),
+            'cluster_score': np.array([r[1].mean() for r in results]).reshape(shape),
+            'voteshare_grid': VOTESHARE_GRID,
+            'var_grid': VAR_GRID,
+            'ntrials': np.array(ntrials)}
+
+
+def validate_emulator(table, num_points=VALIDATION_POINTS, ntrials=EMULATOR_TRIALS,
+                      seed=1, max_workers=None):
+    '''
+    Compares the emulator with direct simulation at random settings between
+    grid points (half clustered, half random grids), each simulated ntrials
+    times and predicted at its own mean clustering score.
+
+    Returns (dict): 'max_error' and 'rms_error' of the emulator's seat
+    shares against the simulated ones, and 'simulation_se', the largest
+    standard error of those simulated means (some of the error is theirs)
+    '''
+    rng = np.random.default_rng(seed)
+    points = [(float(rng.uniform(VOTESHARE_GRID[0], VOTESHARE_GRID[-1])),
+               float(rng.uniform(VAR_GRID[0], VAR_GRID[-1])), i % 2 == 0)
+              for i in range(num_points)]
+    results = _simulate_points(points, ntrials, seed, max_workers)
+    emulator = SeatShareEmulator(table)
+    predicted = emulator.predict([[m, v, r[1].mean()] for (m, v, c), r in zip(points, results)])
+    errors = predicted[:, 0] - np.array([r[0].mean() for r in results])
+    return {'max_error': float(np.abs(errors).max()),
+            'rms_error': float(np.sqrt(np.mean(errors ** 2))),
+            'simulation_se': float(max(r[0].std(ddof=1) for r in results) / np.sqrt(ntrials))}
+
+
+def save_emulator_table(table, filepath=EMULATOR_FILEPATH):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    np.savez_compressed(filepath, **table)
+
+
+def load_emulator_table(filepath=EMULATOR_FILEPATH):
+    with np.load(filepath) as arrays:
+        return {key: arrays[key] for key in arrays.files}
+
+
+def _bracket(grid, values):
+    #index of the grid point below each value, and how far it is to the next
+    values = np.clip(values, grid[0], grid[-1])
+    below = np.clip(np.searchsorted(grid, values, side='right') - 1, 0, len(grid) - 2)
+    return below, (values - grid[below]) / (grid[below + 1] - grid[below])
+
+
+class SeatShareEmulator:
+    '''
+    Seat-share predictions from an emulator table. Has the same predict()
+    as the LinearRegression model create_linear_model returns, so it can be
+    passed to predict_state_voteshare as its model.
+
+    Inputs:
+        -table (dict): from build_emulator_table (with validate_emulator's
+        errors added), or None to load EMULATOR_FILEPATH
+    '''
+
+    def __init__(self, table=None):
+        if table is None:
+            table = load_emulator_table()
+        self.table = table
+        self.voteshare_grid = table['voteshare_grid']
+        self.var_grid = table['var_grid']
+
+    @property
+    def error_bound(self):
+        '''
+        Largest difference from direct simulation seen when the table was
+        validated, or None if it wasn't.
+        '''
+        return float(self.table['max_error']) if 'max_error' in self.table else None
+
+    def _surface(self, name, i, j, s, t):
+        #bilinear interpolation of one table, for both kinds of grid
+        values = self.table[name]
+        return ((1 - s) * (1 - t) * values[:, i, j] + (1 - s) * t * values[:, i, j + 1]
+                + s * (1 - t) * values[:, i + 1, j] + s * t * values[:, i + 1, j + 1])
+
+    def predict(self, X):
+        '''
+        Predicted share of seats won by the majority party. Settings outside
+        the grid are clamped to its edges; clustering scores are clamped to
+        between the clustered and random grids' scores at that setting.
+
+        Inputs:
+            -X (array-like): rows of (mean voteshare, variance, clustering
+            score), like the model's training columns
+
+        Returns (NumPy array): one prediction per row, as a column
+        '''
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        i, s = _bracket(self.voteshare_grid, X[:, 0])
+        j, t = _bracket(self.var_grid, X[:, 1])
+        clustered, scattered = self._surface('seat_share', i, j, s, t)
+        clustered_score, scattered_score = self._surface('cluster_score', i, j, s, t)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = np.clip((X[:, 2] - clustered_score) / (scattered_score - clustered_score), 0, 1)
+        u = np.nan_to_num(u)
+        return (clustered + u * (scattered - clustered))[:, None]
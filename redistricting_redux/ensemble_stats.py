@@ -0,0 +1,329 @@
+'''
+Streaming summary statistics for ensembles of district maps.
+
+Instead of keeping every drawn plan in memory, each plan is folded into a set
+of fixed-size, mergeable sketches as soon as it's drawn:
+    -a histogram of Democratic seat counts
+    -a voteshare histogram and running moments for each district *rank*
+    (districts sorted from least to most Democratic, i.e. "boxplot by rank")
+    -running moments and a histogram of population deviation, measured
+    relative to the target district population
+
+Sketches built by different workers can be merged with merge() and written to
+or read from JSON with save()/load(). Quantiles are read off the fixed-width
+histograms, so they are exact to within one bin width.
+'''
+import json
+import numpy as np
+
+
+class RunningMoments:
+    '''
+    Count, mean, variance, min and max of a stream of arrays of a fixed shape,
+    updated elementwise (Welford's method) and mergeable across workers
+    (Chan et al.'s pairwise update).
+    '''
+
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+    def update(self, values):
+        '''
+        Folds one observation (array of the sketch's shape) into the moments.
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+        delta = values - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (values - self.mean)
+        self.min = np.minimum(self.min, values)
+        self.max = np.maximum(self.max, values)
+
+    def merge(self, other):
+        '''
+        Combines another RunningMoments of the same shape into this one.
+        '''
+        if other.count == 0:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / total)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * (self.count * other.count / total)
+        self.count = total
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        return self
+
+    def variance(self):
+        '''
+        Sample variance (ddof=1); NaN with fewer than two observations.
+        '''
+        if self.count < 2:
+            return np.full(np.shape(self.mean), np.nan)
+        return self.m2 / (self.count - 1)
+
+    def to_dict(self):
+        '''
+        Serializes the moments to a JSON-friendly dict. With no observations
+        yet, min and max are None (null) rather than infinities, which aren't
+        valid JSON.
+        '''
+        empty = self.count == 0
+        return {'count': self.count, 'mean': np.asarray(self.mean).tolist(),
+                'm2': np.asarray(self.m2).tolist(),
+                'min': None if empty else np.asarray(self.min).tolist(),
+                'max': None if empty else np.asarray(self.max).tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        moments = cls(np.shape(d['mean']))
+        moments.count = d['count']
+        for attr in ('mean', 'm2', 'min', 'max'):
+            if d[attr] is not None:
+                setattr(moments, attr, np.asarray(d[attr], dtype=np.float64))
+        return moments
+
+
+def histogram_quantiles(counts, edges, qs):
+    '''
+    Estimates quantiles from a fixed-bin histogram, interpolating linearly
+    within the bin each quantile falls into.
+
+    Inputs:
+        -counts (NumPy array): count in each bin, along the last axis
+        -edges (NumPy array): bin edges, one longer than the last axis of counts
+        -qs (list of floats): quantiles to estimate, between 0 and 1
+
+    Returns (NumPy array): quantiles, shape counts.shape[:-1] + (len(qs),).
+    NaN where a histogram is empty.
+    '''
+    counts = np.atleast_2d(np.asarray(counts, dtype=np.float64))
+    cum = np.cumsum(counts, axis=-1)
+    totals = cum[:, -1]
+    out = np.full((counts.shape[0], len(qs)), np.nan)
+    for row in range(counts.shape[0]):
+        if totals[row] == 0:
+            continue
+        for j, q in enumerate(qs):
+            rank = q * totals[row]
+            b = min(np.searchsorted(cum[row], rank), counts.shape[1] - 1)
+            below = cum[row, b] - counts[row, b]
+            frac = (rank - below) / counts[row, b] if counts[row, b] else 0.0
+            out[row, j] = edges[b] + frac * (edges[b + 1] - edges[b])
+    return out
+
+
+class EnsembleAggregator:
+    '''
+    Bounded-memory accumulator for an ensemble of plans with a fixed number of
+    districts. Memory use depends only on num_districts and the bin counts,
+    never on the number of plans fed in.
+    '''
+
+    QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+    def __init__(self, num_districts, target_pop=None, voteshare_bins=200,
+                 deviation_bins=1000, max_rel_deviation=1.0):
+        '''
+        Inputs:
+            -num_districts (int): number of districts in every plan
+            -target_pop (int): target district population that deviations
+            are measured against. If None, taken from the first plan added
+            (mean district population)
+            -voteshare_bins (int): number of bins between 0 and 1 for each
+            district rank's voteshare histogram
+            -deviation_bins (int): number of bins for population deviation
+            -max_rel_deviation (float): largest deviation, as a fraction of
+            target_pop, with its own bin; anything larger lands in the last bin
+        '''
+        self.num_districts = num_districts
+        self.target_pop = target_pop
+        self.num_plans = 0
+        self.seat_counts = np.zeros(num_districts + 1, dtype=np.int64)
+        self.voteshare_edges = np.linspace(0, 1, voteshare_bins + 1)
+        self.rank_hist = np.zeros((num_districts, voteshare_bins), dtype=np.int64)
+        self.rank_moments = RunningMoments((num_districts,))
+        self.deviation_edges = np.linspace(0, max_rel_deviation, deviation_bins + 1)
+        self.deviation_hist = np.zeros(deviation_bins, dtype=np.int64)
+        self.deviation_moments = RunningMoments()
+
+    def add_plan(self, dist_pops, d_votes, r_votes):
+        '''
+        Folds one plan into the sketches.
+
+        Inputs:
+            -dist_pops (array-like of ints): population of each district, e.g.
+            the values of district_pops(df)
+            -d_votes, r_votes (array-like of numbers): Democratic and
+            Republican votes in each district, in the same order as dist_pops
+
+        Returns: None, updates the aggregator in-place
+        '''
+        dist_pops = np.asarray(dist_pops, dtype=np.float64)
+        d_votes = np.asarray(d_votes, dtype=np.float64)
+        r_votes = np.asarray(r_votes, dtype=np.float64)
+        assert len(dist_pops) == self.num_districts, \
+            f"Expected {self.num_districts} districts, got {len(dist_pops)}"
+        if self.target_pop is None:
+            self.target_pop = int(dist_pops.sum() // self.num_districts)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            voteshares = np.sort(np.nan_to_num(d_votes / (d_votes + r_votes), nan=0.5))
+        self.num_plans += 1
+        self.seat_counts[int((voteshares > 0.5).sum())] += 1
+
+        bins = np.clip(np.searchsorted(self.voteshare_edges, voteshares, side='right') - 1,
+                       0, self.rank_hist.shape[1] - 1)
+        self.rank_hist[np.arange(self.num_districts), bins] += 1
+        self.rank_moments.update(voteshares)
+
+        deviation = dist_pops.max() - dist_pops.min()
+        rel_dev = deviation / self.target_pop
+        b = min(np.searchsorted(self.deviation_edges, rel_dev, side='right') - 1,
+                len(self.deviation_hist) - 1)
+        self.deviation_hist[b] += 1
+        self.deviation_moments.update(deviation)
+
+    def add_dissolved_map(self, df_dists, dcol="G20PREDBID", rcol="G20PRERTRU"):
+        '''
+        Folds in one plan given as the output of dissolve_map().
+
+        Inputs:
+            -df_dists (geopandas GeoDataFrame): district-level data
+            -dcol, rcol (str): names of Democratic and Republican vote columns
+
+        Returns: None, updates the aggregator in-place
+        '''
+        self.add_plan(df_dists['POP100'], df_dists[dcol], df_dists[rcol])
+
+    def merge(self, other):
+        '''
+        Combines the sketches of another aggregator (e.g. from another worker)
+        into this one. Both must have been built with the same settings.
+
+        Returns (EnsembleAggregator): self, for chaining
+        '''
+        assert self.num_districts == other.num_districts, "Number of districts differs"
+        assert self.rank_hist.shape == other.rank_hist.shape, "Voteshare bins differ"
+        assert np.array_equal(self.deviation_edges, other.deviation_edges), \
+            "Deviation bins differ"
+        if self.target_pop is None:
+            self.target_pop = other.target_pop
+        assert other.target_pop is None or self.target_pop == other.target_pop, \
+            "Target populations differ, so deviation histograms can't be merged"
+
+        self.num_plans += other.num_plans
+        self.seat_counts += other.seat_counts
+        self.rank_hist += other.rank_hist
+        self.rank_moments.merge(other.rank_moments)
+        self.deviation_hist += other.deviation_hist
+        self.deviation_moments.merge(other.deviation_moments)
+        return self
+
+    def summary(self):
+        '''
+        Summarizes the ensemble seen so far.
+
+        Returns (dict): with keys
+            -num_plans (int)
+            -seat_distribution (dict): Democratic seat count -> share of plans
+            -mean_seats (float)
+            -rank_voteshares (list of dicts): for each district rank, from
+            least to most Democratic, the mean and quantiles of its voteshare
+            -pop_deviation (dict): mean, std, min, max and quantiles of the
+            population deviation between largest and smallest district
+        '''
+        if self.num_plans == 0:
+            return {'num_plans': 0}
+        seats = np.arange(self.num_districts + 1)
+        qs = list(self.QUANTILES)
+
+        rank_q = histogram_quantiles(self.rank_hist, self.voteshare_edges, qs)
+        rank_voteshares = []
+        for rank in range(self.num_districts):
+            entry = {'rank': rank + 1, 'mean': float(self.rank_moments.mean[rank])}
+            entry.update({f"q{int(q * 100):02d}": float(v) for q, v in zip(qs, rank_q[rank])})
+            rank_voteshares.append(entry)
+
+        dev_q = histogram_quantiles(self.deviation_hist,
+                                    self.deviation_edges * self.target_pop, qs)[0]
+        pop_deviation = {'mean': float(self.deviation_moments.mean),
+                         'std': float(np.sqrt(self.deviation_moments.variance())),
+                         'min': float(self.deviation_moments.min),
+                         'max': float(self.deviation_moments.max)}
+        pop_deviation.update({f"q{int(q * 100):02d}": float(v) for q, v in zip(qs, dev_q)})
+
+        return {'num_plans': self.num_plans,
+                'seat_distribution': {int(s): float(c / self.num_plans)
+                                      for s, c in zip(seats, self.seat_counts) if c},
+                'mean_seats': float((seats * self.seat_counts).sum() / self.num_plans),
+                'rank_voteshares': rank_voteshares,
+                'pop_deviation': pop_deviation}
+
+    def to_dict(self):
+        '''
+        Serializes the aggregator to a JSON-friendly dict.
+        '''
+        return {'num_districts': self.num_districts,
+                'target_pop': self.target_pop,
+                'num_plans': self.num_plans,
+                'seat_counts': self.seat_counts.tolist(),
+                'voteshare_bins': self.rank_hist.shape[1],
+                'rank_hist': self.rank_hist.tolist(),
+                'rank_moments': self.rank_moments.to_dict(),
+                'deviation_bins': len(self.deviation_hist),
+                'max_rel_deviation': float(self.deviation_edges[-1]),
+                'deviation_hist': self.deviation_hist.tolist(),
+                'deviation_moments': self.deviation_moments.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d):
+        '''
+        Rebuilds an aggregator from the output of to_dict().
+        '''
+        agg = cls(d['num_districts'], target_pop=d['target_pop'],
+                  voteshare_bins=d['voteshare_bins'],
+                  deviation_bins=d['deviation_bins'],
+                  max_rel_deviation=d['max_rel_deviation'])
+        agg.num_plans = d['num_plans']
+        agg.seat_counts = np.asarray(d['seat_counts'], dtype=np.int64)
+        agg.rank_hist = np.asarray(d['rank_hist'], dtype=np.int64)
+        agg.rank_moments = RunningMoments.from_dict(d['rank_moments'])
+        agg.deviation_hist = np.asarray(d['deviation_hist'], dtype=np.int64)
+        agg.deviation_moments = RunningMoments.from_dict(d['deviation_moments'])
+        return agg
+
+    def save(self, filepath):
+        '''
+        Writes the aggregator to a JSON file.
+        '''
+        with open(filepath, 'w') as f:
+            json.dump(self.to_dict(), f, allow_nan=False)
+
+    @classmethod
+    def load(cls, filepath):
+        '''
+        Reads an aggregator previously written with save().
+        '''
+        with open(filepath) as f:
+            return cls.from_dict(json.load(f))
+
+
+def merge_aggregators(aggregators):
+    '''
+    Merges a list of aggregators (e.g. one per worker) into a new one.
+
+    Inputs:
+        -aggregators (list of EnsembleAggregators): all built with the same
+        settings
+
+    Returns (EnsembleAggregator)
+    '''
+    merged = EnsembleAggregator.from_dict(aggregators[0].to_dict())
+    for agg in aggregators[1:]:
+        merged.merge(agg)
+    return merged
@@ -11,8 +11,9 @@ import re
 import time
 from datetime import datetime
 import matplotlib as plt
-from stats import population_sum, blue_red_margin, target_dist_pop, metric_area, population_density, set_blue_red_diff #not sure i did this relative directory right
+from stats import population_sum, blue_red_margin, target_dist_pop, set_blue_red_diff #not sure i did this relative directory right
 from draw_random_maps import * #i know this is bad practice but idk where he used it and not
+from checkpoint import load_checkpoint, save_df_checkpoint, restore_df_dist_ids
 
 run = 0
 run_dict = {}
@@ -23,7 +24,8 @@ run_dict = {}
 import warnings
 warnings.filterwarnings("ignore")
 
-def batch_balance_transfer(df, neighbor_dict=None, run=run, run_dict=run_dict, allowed_deviation=70000):
+def batch_balance_transfer(df, neighbor_dict=None, run=run, run_dict=None, allowed_deviation=70000, stop_after=None,
+                           checkpoint_fp=None, checkpoint_every=1):
     '''
     Identifies the border between the smallest population and its largest
     neighbor and trade all precincts on that border from the larger district
@@ -33,12 +35,22 @@ def batch_balance_transfer(df, neighbor_dict=None, run=run, run_dict=run_dict, a
     Inputs:
         -df (geopandas GeoDataFrame): state data by precinct/VTD. Every precinct 
         should have a dist_id assigned before calling this function.
+        -run_dict (dict): transfer number -> population deviation after it,
+        filled in as transfers are made. A new dict if None.
         -allowed_deviation (int): Largest allowable difference between the 
         population of the most populous district and the population of the 
         least populous district.
+        -stop_after (int): manual number of transfers to stop after if the
+        procedure hasn't yet terminated. None means no limit.
+        -checkpoint_fp (str): if given, the map and transfer progress are
+        saved here (see checkpoint.py), and an existing checkpoint there is
+        resumed from instead of starting over.
+        -checkpoint_every (int): save a checkpoint every this many transfers
     
     Returns: none, modifies df in-place.
     '''
+    if run_dict is None:
+        run_dict = {}
     neighbor_dict = {
         id: n for (id, n) in zip(df.GEOID20, df.neighbors)
     }
@@ -47,8 +59,22 @@ def batch_balance_transfer(df, neighbor_dict=None, run=run, run_dict=run_dict, a
     df_trade_pop = district_pops(df) #swapping in preexisting function
     #df_trade_pop = df_trade.groupby('dist_id').sum()[['POP100']].reset_index()
     recent_transfer = []
+    transfers = 0
+    saved = load_checkpoint(checkpoint_fp, num_units=len(df))
+    if saved is not None:
+        restore_df_dist_ids(df, saved['assignment'])
+        transfers = saved['counters']['transfers']
+        recent_transfer = saved['counters']['recent_transfer']
+        run = saved['counters']['run']
+        run_dict.update({int(k): v for k, v in saved['counters']['run_dict']})
+        df_trade = pd.DataFrame(df)
+        print(f"Resuming from checkpoint after {transfers} transfers")
     while (population_deviation(df_trade) > allowed_deviation):
     #while (df_trade_pop.POP100.max() - df_trade_pop.POP100.min()) > allowed_deviation:
+        if stop_after is not None and transfers >= stop_after:
+            print(f"You've now transferred {transfers} times. Stopping")
+            break
+        transfers += 1
     #small districts take
         df_trade = pd.DataFrame(df)
         df_trade_pop = district_pops(df)
@@ -115,9 +141,14 @@ def batch_balance_transfer(df, neighbor_dict=None, run=run, run_dict=run_dict, a
         run+=1
         run_dict[run] = (population_deviation(df_trade))
         print(run, run_dict)
+        if checkpoint_fp is not None and transfers % checkpoint_every == 0:
+            save_df_checkpoint(checkpoint_fp, df, list(run_dict.values()),
+                               {'transfers': transfers, 'recent_transfer': recent_transfer,
+                                'run': run, 'run_dict': [[k, int(v)] for k, v in run_dict.items()]})
         #run_dict[run] = df_trade_pop.POP100.max() - df_trade_pop.POP100.min()
 
-def single_balance_transfer(df, neighbor_dict=None, run=run, run_dict=run_dict, allowed_deviation=70000):
+def single_balance_transfer(df, neighbor_dict=None, run=run, run_dict=None, allowed_deviation=70000, stop_after=None,
+                            checkpoint_fp=None, checkpoint_every=1):
     '''
     Identifies the border between the smallest population and its largest
     neighbor and trade all precincts on that border from the larger district
@@ -127,25 +158,51 @@ def single_balance_transfer(df, neighbor_dict=None, run=run, run_dict=run_dict,
     Inputs:
         -df (geopandas GeoDataFrame): state data by precinct/VTD. Every precinct 
         should have a dist_id assigned before calling this function.
+        -run_dict (dict): transfer number -> population deviation after it,
+        filled in as transfers are made. A new dict if None.
         -allowed_deviation (int): Largest allowable difference between the 
         population of the most populous district and the population of the 
         least populous district.
+        -stop_after (int): manual number of transfers to stop after if the
+        procedure hasn't yet terminated. None means no limit.
+        -checkpoint_fp (str): if given, the map and transfer progress are
+        saved here (see checkpoint.py), and an existing checkpoint there is
+        resumed from instead of starting over.
+        -checkpoint_every (int): save a checkpoint every this many transfers
     
     Returns: none, modifies df in-place.
     '''
+    if run_dict is None:
+        run_dict = {}
     neighbor_dict = {
         id: n for (id, n) in zip(df.GEOID20, df.neighbors)
     }
 
     df_trade = pd.DataFrame(df)
-    df_trade_pop = df_trade.groupby('dist_id').sum()[['POP100']].reset_index()
+    df_trade_pop = df_trade.groupby('dist_id')[['POP100']].sum().reset_index()
     recent_transfer = []
+    transfers = 0
 
     second_choice = False
+    saved = load_checkpoint(checkpoint_fp, num_units=len(df))
+    if saved is not None:
+        restore_df_dist_ids(df, saved['assignment'])
+        transfers = saved['counters']['transfers']
+        recent_transfer = saved['counters']['recent_transfer']
+        second_choice = saved['counters']['second_choice']
+        run = saved['counters']['run']
+        run_dict.update({int(k): v for k, v in saved['counters']['run_dict']})
+        df_trade = pd.DataFrame(df)
+        df_trade_pop = df_trade.groupby('dist_id')[['POP100']].sum().reset_index()
+        print(f"Resuming from checkpoint after {transfers} transfers")
     while (df_trade_pop.POP100.max() - df_trade_pop.POP100.min()) > allowed_deviation:
+        if stop_after is not None and transfers >= stop_after:
+            print(f"You've now transferred {transfers} times. Stopping")
+            break
+        transfers += 1
     #small districts take
         df_trade = pd.DataFrame(df)
-        df_trade_pop = df_trade.groupby('dist_id').sum()[['POP100']].reset_index()
+        df_trade_pop = df_trade.groupby('dist_id')[['POP100']].sum().reset_index()
 
         smallest = df_trade_pop[df_trade_pop.POP100 == min(df_trade_pop.POP100)]
 
@@ -222,14 +279,18 @@ def single_balance_transfer(df, neighbor_dict=None, run=run, run_dict=run_dict,
                     second_choice = True
                 else:
                     second_choice = False
+        run+=1
+        run_dict[run] = population_deviation(df)
+        if checkpoint_fp is not None and transfers % checkpoint_every == 0:
+            save_df_checkpoint(checkpoint_fp, df, list(run_dict.values()),
+                               {'transfers': transfers, 'recent_transfer': recent_transfer,
+                                'second_choice': second_choice,
+                                'run': run, 'run_dict': [[k, int(v)] for k, v in run_dict.items()]})
     
     idx = {name: i for i, name in enumerate(list(df), start=1)}
     recapture_orphan_precincts(df, idx)
-    
-    run+=1
-    run_dict[run] = df_trade_pop.POP100.max() - df_trade_pop.POP100.min()
 
-def balance_ethan_style(df, run=0, run_dict={}, allowed_deviation=70000):
+def balance_ethan_style(df, run=0, run_dict=None, allowed_deviation=70000):
     '''
     Ethan had this code at the end of a Jupyter notebook. Turned into a function
     by Matt Jackson.
@@ -0,0 +1,265 @@
+'''
+Population balancing by min-cost flow.
+
+mapwide_pop_swap and the Ethan balancers decide one district pair at a time
+which way precincts should go, so they overshoot, swap back, and stall. Here
+each pass first decides, for the whole map at once, how many people have to
+cross each district border: a min-cost flow on the district adjacency graph,
+where every district with too many people is a source of its surplus and
+every district with too few is a sink for its shortfall. Moving a person
+across one border costs 1, so the solution moves as few people as possible
+and routes them through as few districts as possible. It's a linear program
+with one variable per (district, neighboring district) pair, solved with
+scipy's HiGHS solver, so it takes milliseconds even for Texas.
+
+Each flow is then realized by peeling units off the donor district starting
+from its border with the acceptor and working inward, breadth first, until
+about that many people have moved. Units whose move would split their old
+district's neighborhood in two are skipped. Moves use whole units, so a few
+passes are made until the deviation is allowed.
+
+Works on the same positional arrays as graph_maps (adjacency matrix,
+populations, int16 assignment with districts 1 to num_districts).
+'''
+from collections import deque
+import numpy as np
+from scipy.optimize import linprog
+
+import graph_maps
+from instrumentation import phase
+
+
+def district_graph(adjacency, assignment):
+    '''
+    Pairs of districts that share a border.
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix): unit adjacency
+        -assignment (NumPy array): district of each unit
+
+    Returns (NumPy array): E x 2 array of (district, neighboring district),
+    listing each bordering pair in both directions
+    '''
+    edges = adjacency.tocoo()
+    a, b = assignment[edges.row], assignment[edges.col]
+    cross = (a != b) & (a > 0) & (b > 0)
+    return np.unique(np.column_stack([a[cross], b[cross]]), axis=0)
+
+
+def solve_flows(pairs, surplus, capacity=None):
+    '''
+    Min-cost flow of population between districts.
+
+    Every person moved across a border costs 1. A district can also be left
+    off target, at a cost higher than routing anyone across every other
+    district, so there's always a solution: when capacities or the shape of
+    the district graph keep some population from reaching where it's needed,
+    it stays put and the rest still moves.
+
+    Inputs:
+        -pairs (NumPy array): E x 2 bordering district pairs, from
+        district_graph
+        -surplus (NumPy array): population above target of each district
+        (negative if below), indexed by dist_id - 1. Sums to 0
+        -capacity (NumPy array): most people that can cross each pair, or
+        None for no limit (np.inf for no limit on a pair)
+
+    Returns (NumPy array): people to move across each pair, from the first
+    district to the second
+    '''
+    num_districts = len(surplus)
+    num_pairs = len(pairs)
+    #flow conservation: what leaves a district minus what enters is its
+    #surplus, less whatever it's left off target by (over and under)
+    conservation = np.zeros((num_districts, num_pairs + 2 * num_districts))
+    conservation[pairs[:, 0] - 1, np.arange(num_pairs)] = 1
+    conservation[pairs[:, 1] - 1, np.arange(num_pairs)] = -1
+    conservation[:, num_pairs:num_pairs + num_districts] = np.eye(num_districts)
+    conservation[:, num_pairs + num_districts:] = -np.eye(num_districts)
+    costs = np.concatenate([np.ones(num_pairs),
+                            np.full(2 * num_districts, num_districts)])
+    if capacity is None:
+        capacity = np.full(num_pairs, np.inf)
+    bounds = [(0, None if np.isinf(c) else c) for c in capacity] \
+        + [(0, None)] * (2 * num_districts)
+    result = linprog(costs, A_eq=conservation, b_eq=surplus, bounds=bounds,
+                     method='highs')
+    return result.x[:num_pairs]
+
+
+def flow_order(pairs, flows, num_districts):
+    '''
+    Order to realize flows in: a district's outgoing flows come after all of
+    its incoming ones, so population routed through a district arrives there
+    before it's passed on. A min-cost flow has no cycles, but if rounding
+    leaves one, the district with the least still to receive goes next.
+
+    Returns (list of ints): indices into pairs, biggest flows first among a
+    district's outgoing ones
+    '''
+    used = np.flatnonzero(flows >= 1)
+    incoming = np.zeros(num_districts + 1)
+    np.add.at(incoming, pairs[used, 1], flows[used])
+    outgoing = {d: [] for d in range(1, num_districts + 1)}
+    for i in used[np.argsort(-flows[used])]:
+        outgoing[int(pairs[i, 0])].append(i)
+    order = []
+    while outgoing:
+        d = min(outgoing, key=lambda d: incoming[d])
+        for i in outgoing.pop(d):
+            order.append(i)
+            incoming[pairs[i, 1]] -= flows[i]
+    return order
+
+
+def safe_to_move(adjacency, assignment, unit):
+    '''
+    Whether moving a unit out of its district keeps that district's units
+    around it connected to each other, going only through the district's
+    units within two steps of it. A cheap local stand-in for a full
+    contiguity check.
+    '''
+    indptr, indices = adjacency.indptr, adjacency.indices
+    own = assignment[unit]
+    nabes = indices[indptr[unit]:indptr[unit + 1]]
+    same = nabes[assignment[nabes] == own]
+    if len(same) <= 1:
+        return len(same) == 1
+    #the district's units within two steps, other than unit itself
+    second = indices[np.concatenate([np.arange(indptr[n], indptr[n + 1]) for n in same])]
+    area = set(second[assignment[second] == own].tolist()) | set(same.tolist())
+    area.discard(unit)
+    unreached = set(same.tolist())
+    start = unreached.pop()
+    area.discard(start)
+    stack = [start]
+    while stack and unreached:
+        current = stack.pop()
+        for n in indices[indptr[current]:indptr[current + 1]].tolist():
+            if n in area:
+                area.discard(n)
+                unreached.discard(n)
+                stack.append(n)
+    return not unreached
+
+
+def realize_flow(adjacency, pops, assignment, dist_sizes, donor, acceptor, amount):
+    '''
+    Moves about amount people from donor to acceptor, peeling units off
+    donor breadth first from their shared border. A unit moves only if at
+    least half of its population is still owed, so the result is within half
+    a unit of amount.
+
+    Returns (int, boolean): people moved, and whether donor ran out of units
+    it could give acceptor before moving that many (rather than only having
+    units too big for what was left). Modifies assignment and dist_sizes
+    in-place
+    '''
+    indptr, indices = adjacency.indptr, adjacency.indices
+    edges_from = np.flatnonzero(assignment == donor)
+    sub = adjacency[edges_from].tocoo()
+    border = np.unique(edges_from[sub.row[assignment[sub.col] == acceptor]])
+    frontier = deque(border.tolist())
+    queued = set(frontier)
+    moved = 0
+    too_big = False
+    while frontier and amount - moved > 0 and dist_sizes[donor] > 1:
+        unit = frontier.popleft()
+        if assignment[unit] != donor:
+            continue
+        if pops[unit] > 2 * (amount - moved):
+            too_big = True
+            continue
+        if not safe_to_move(adjacency, assignment, unit):
+            continue
+        assignment[unit] = acceptor
+        dist_sizes[donor] -= 1
+        dist_sizes[acceptor] += 1
+        moved += int(pops[unit])
+        for n in indices[indptr[unit]:indptr[unit + 1]].tolist():
+            if assignment[n] == donor and n not in queued:
+                queued.add(n)
+                frontier.append(n)
+    return moved, moved < amount and not frontier and not too_big
+
+
+@phase("flow balancing")
+def flow_balance_assignment(adjacency, pops, assignment, num_districts,
+                            allowed_deviation=70000, max_passes=10):
+    '''
+    Balances district populations with min-cost flow passes: solve for the
+    flow across every district border, realize it by moving boundary units,
+    and repeat until the deviation is allowed, nothing moves, or max_passes
+    passes have run. A border that couldn't carry its flow (the donor's side
+    of it is too thin to peel without splitting the donor) is capped at what
+    it did carry for the rest of the passes, so the next flows go around it.
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix): unit adjacency
+        -pops (NumPy array): population of each unit
+        -assignment (NumPy array): district of each unit, all assigned
+        -num_districts (int)
+        -allowed_deviation (int): target population deviation
+        -max_passes (int): most passes to make
+
+    Returns (list of ints): population deviation before each pass, then after
+    the last one. Modifies assignment in-place
+    '''
+    pops = np.asarray(pops)
+    target_pop = pops.sum() / num_districts
+    pop_devs_so_far = []
+    #(donor, acceptor): most people that border has been able to carry
+    stuck = {}
+    for count in range(1, max_passes + 1):
+        dist_pops = graph_maps.district_pops_array(assignment, pops, num_districts)
+        pop_devs_so_far.append(int(dist_pops.max() - dist_pops.min()))
+        if pop_devs_so_far[-1] <= allowed_deviation:
+            break
+        pairs = district_graph(adjacency, assignment)
+        capacity = np.array([stuck.get((a, b), np.inf) for a, b in pairs.tolist()])
+        flows = solve_flows(pairs, dist_pops - target_pop, capacity)
+
+        dist_sizes = np.bincount(assignment, minlength=num_districts + 1)
+        moved = 0
+        for i in flow_order(pairs, flows, num_districts):
+            donor, acceptor = pairs[i].tolist()
+            carried, ran_out = realize_flow(adjacency, pops, assignment, dist_sizes,
+                                            donor, acceptor, flows[i])
+            if ran_out:
+                stuck[(donor, acceptor)] = carried
+            moved += carried
+        graph_maps.recapture_orphans_assignment(adjacency, pops, assignment, num_districts)
+        print(f"Flow pass #{count}: moved {moved} people; the most and least populous "
+              f"district differ by: {graph_maps.deviation_array(assignment, pops, num_districts)}")
+        if moved == 0:
+            break
+    else:
+        pop_devs_so_far.append(graph_maps.deviation_array(assignment, pops, num_districts))
+    return pop_devs_so_far
+
+
+def flow_balance(df, adjacency=None, allowed_deviation=70000, max_passes=10):
+    '''
+    Min-cost flow balancing for a GeoDataFrame with every precinct assigned
+    a dist_id, like repeated_pop_swap.
+
+    Inputs:
+        -df (geopandas GeoDataFrame): state data by precinct/VTD
+        -adjacency (scipy sparse csr_matrix): unit adjacency in df's row
+        order. Built from df's neighbors if None
+        -allowed_deviation (int)
+        -max_passes (int)
+
+    Returns: None, modifies df's dist_id column in-place
+    '''
+    if adjacency is None:
+        from load_state_data import make_adjacency_matrix
+        adjacency = make_adjacency_matrix(df)
+    pops = df['POP100'].to_numpy()
+    assignment = graph_maps.assignment_from_df(df)
+    num_districts = int(assignment.max())
+    flow_balance_assignment(adjacency, pops, assignment, num_districts,
+                            allowed_deviation, max_passes)
+    graph_maps.set_dist_ids(df, assignment)
+    if graph_maps.deviation_array(assignment, pops, num_districts) <= allowed_deviation:
+        print("You've reached your population balance target. Hooray!")
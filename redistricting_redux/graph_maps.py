@@ -0,0 +1,336 @@
+'''
+Array-based versions of the map-drawing and balancing procedures in
+draw_random_maps, for data too large for row-by-row GeoDataFrame lookups
+(census blocks: hundreds of thousands to millions of units).
+
+Instead of GEOID strings and an object dist_id column, everything here works
+on positional indices:
+    -adjacency: scipy sparse CSR matrix with int32 indices (from
+    load_state_data.load_adjacency or make_adjacency_matrix)
+    -pops: population of each unit, in row order
+    -assignment: int16 array of district IDs, 1 to num_districts, with 0
+    meaning "not drawn into a district yet"
+
+The procedures follow draw_random_maps: throw darts, grow each district out
+to its target population, fill leftover holes into the smallest neighboring
+district, then repeatedly move units from overpopulated districts into
+their smallest underpopulated neighbor and recapture orphaned units.
+Memory use is a few arrays of length n plus the adjacency matrix.
+'''
+import numpy as np
+import pandas as pd
+from instrumentation import phase
+from checkpoint import load_checkpoint, save_checkpoint
+
+ASSIGNMENT_DTYPE = np.int16
+
+
+def district_pops_array(assignment, pops, num_districts):
+    '''
+    Population of each district.
+
+    Inputs:
+        -assignment (NumPy array): district of each unit (0 = unassigned)
+        -pops (NumPy array): population of each unit
+        -num_districts (int)
+
+    Returns (NumPy array of int64): population of district i at index i-1
+    '''
+    return np.bincount(assignment, weights=pops,
+                       minlength=num_districts + 1)[1:].round().astype(np.int64)
+
+
+def deviation_array(assignment, pops, num_districts):
+    '''
+    Difference between the most and least populous district.
+    '''
+    dist_pops = district_pops_array(assignment, pops, num_districts)
+    return int(dist_pops.max() - dist_pops.min())
+
+
+def smallest_neighboring_district(adjacency, assignment, dist_pops, units,
+                                  exclude_own=True):
+    '''
+    For each of the given units, finds the least populous district among the
+    districts its neighbors are drawn into.
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix)
+        -assignment (NumPy array)
+        -dist_pops (NumPy array): population of each district, indexed by
+        dist_id - 1
+        -units (NumPy array of ints): positions of the units to look at
+        -exclude_own (boolean): ignore neighbors in the unit's own district
+
+    Returns (NumPy array): smallest neighboring district of each unit, 0 where
+    a unit has no qualifying neighbor
+    '''
+    sub = adjacency[units].tocoo()
+    local, nbr_dist = sub.row, assignment[sub.col]
+    keep = nbr_dist > 0
+    if exclude_own:
+        keep &= nbr_dist != assignment[units][local]
+    local, nbr_dist = local[keep], nbr_dist[keep]
+
+    result = np.zeros(len(units), dtype=ASSIGNMENT_DTYPE)
+    if len(local) == 0:
+        return result
+    order = np.lexsort((dist_pops[nbr_dist - 1], local))
+    first = np.unique(local[order], return_index=True)[1]
+    result[local[order][first]] = nbr_dist[order][first]
+    return result
+
+
+def dart_throw_assignment(adjacency, pops, num_districts, seed=2023):
+    '''
+    Array version of draw_dart_throw_map: picks a random starting unit for
+    each district, then grows districts in random order, each round adding
+    the unassigned neighbors of the units it added last round until it passes
+    the target population. Whatever can't be reached that way is filled in
+    with fill_holes_assignment.
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix): unit adjacency
+        -pops (NumPy array): population of each unit
+        -num_districts (int)
+        -seed (int): seed for random number generation, for replicability
+
+    Returns (NumPy array of int16): assignment
+    '''
+    rng = np.random.default_rng(seed)
+    num_units = adjacency.shape[0]
+    pops = np.asarray(pops)
+    target_pop = int(pops.sum()) // num_districts
+    assignment = np.zeros(num_units, dtype=ASSIGNMENT_DTYPE)
+
+    with phase("dart throw"):
+        darts = rng.choice(num_units, size=num_districts, replace=False)
+        assignment[darts] = np.arange(1, num_districts + 1)
+        dist_pops = pops[darts].astype(np.int64)
+        frontiers = {id: darts[id - 1:id] for id in range(1, num_districts + 1)}
+
+    with phase("district expansion"):
+        growing = list(range(1, num_districts + 1))
+        while growing:
+            rng.shuffle(growing)
+            for id in list(growing):
+                nabes = np.unique(adjacency[frontiers[id]].indices)
+                allowed = rng.permutation(nabes[assignment[nabes] == 0])
+                if len(allowed) == 0:
+                    #trapped: can't grow any more this way
+                    growing.remove(id)
+                    continue
+                #like draw_dart_throw_map, keep adding while still at or under target
+                pop_before = dist_pops[id - 1] + np.concatenate(([0], np.cumsum(pops[allowed])[:-1]))
+                num_added = int(np.searchsorted(pop_before, target_pop, side='right'))
+                added = allowed[:num_added]
+                assignment[added] = id
+                dist_pops[id - 1] += pops[added].sum()
+                frontiers[id] = added
+                if num_added < len(allowed) or num_added == 0:
+                    growing.remove(id)
+        print(f"{(assignment == 0).sum()} unfilled units remain")
+
+    if (assignment == 0).any():
+        fill_holes_assignment(adjacency, pops, assignment, num_districts)
+    return assignment
+
+
+@phase("hole filling")
+def fill_holes_assignment(adjacency, pops, assignment, num_districts):
+    '''
+    Array version of fill_district_holes: repeatedly assigns every unassigned
+    unit that borders a district to its least populous neighboring district.
+    Units that can never be reached (islands with no drawn neighbors) go to
+    the least populous district overall.
+
+    Returns: None, modifies assignment in-place
+    '''
+    while True:
+        holes = np.flatnonzero(assignment == 0)
+        if len(holes) == 0:
+            break
+        dist_pops = district_pops_array(assignment, pops, num_districts)
+        choice = smallest_neighboring_district(adjacency, assignment, dist_pops, holes,
+                                               exclude_own=False)
+        if not choice.any():
+            print(f"{len(holes)} units can't be reached from any district")
+            assignment[holes] = np.argmin(dist_pops) + 1
+            break
+        assignment[holes] = choice
+    print("Cleanup complete. All holes in districts filled.")
+
+
+@phase("swap cycle")
+def pop_swap_assignment(adjacency, pops, assignment, num_districts,
+                        allowed_deviation=70000):
+    '''
+    Array version of mapwide_pop_swap: every unit in an overpopulated
+    district whose smallest neighboring district is underpopulated is queued
+    to move there; moves are then made in order as long as they keep the
+    acceptor below and the donor above the target by allowed_deviation / 2.
+    Finishes by recapturing orphaned units.
+
+    Returns (int): number of units moved. Modifies assignment in-place
+    '''
+    target_pop = int(pops.sum()) // num_districts
+    dist_pops = district_pops_array(assignment, pops, num_districts)
+
+    #only units with a neighbor in another district can move
+    edges = adjacency.tocoo()
+    on_border = np.unique(edges.row[assignment[edges.row] != assignment[edges.col]])
+    donors = on_border[dist_pops[assignment[on_border] - 1] > target_pop]
+    acceptors = smallest_neighboring_district(adjacency, assignment, dist_pops, donors)
+    ok = (acceptors > 0) & (dist_pops[np.maximum(acceptors, 1) - 1] < target_pop)
+    donors, acceptors = donors[ok], acceptors[ok]
+
+    moved = 0
+    half_dev = allowed_deviation / 2
+    for unit, acceptor in zip(donors.tolist(), acceptors.tolist()):
+        donor = assignment[unit]
+        if dist_pops[acceptor - 1] >= target_pop + half_dev:
+            continue
+        if dist_pops[donor - 1] <= target_pop - half_dev:
+            continue
+        assignment[unit] = acceptor
+        dist_pops[acceptor - 1] += pops[unit]
+        dist_pops[donor - 1] -= pops[unit]
+        moved += 1
+
+    recapture_orphans_assignment(adjacency, pops, assignment, num_districts)
+    return moved
+
+
+@phase("orphan recapture")
+def recapture_orphans_assignment(adjacency, pops, assignment, num_districts):
+    '''
+    Array version of recapture_orphan_precincts: units with no neighbor in
+    their own district go to their least populous neighboring district.
+    A unit that is its district's only unit is left alone, so no district
+    gets erased.
+
+    Returns (int): number of units reassigned. Modifies assignment in-place
+    '''
+    edges = adjacency.tocoo()
+    same = np.bincount(edges.row, weights=assignment[edges.row] == assignment[edges.col],
+                       minlength=len(assignment))
+    degree = np.diff(adjacency.indptr)
+    dist_sizes = np.bincount(assignment, minlength=num_districts + 1)
+    orphans = np.flatnonzero((same == 0) & (degree > 0) & (dist_sizes[assignment] > 1))
+    if len(orphans) == 0:
+        return 0
+    dist_pops = district_pops_array(assignment, pops, num_districts)
+    choice = smallest_neighboring_district(adjacency, assignment, dist_pops, orphans)
+    assignment[orphans[choice > 0]] = choice[choice > 0]
+    return int((choice > 0).sum())
+
+
+def repeated_pop_swap_assignment(adjacency, pops, assignment, num_districts,
+                                 allowed_deviation=70000, stop_after=20,
+                                 checkpoint_fp=None, checkpoint_every=1):
+    '''
+    Array version of repeated_pop_swap: calls pop_swap_assignment until the
+    districts are within allowed_deviation, the process gets stuck in a
+    cycle, or stop_after cycles have run. With checkpoint_fp, progress is
+    saved every checkpoint_every cycles and an existing checkpoint there is
+    resumed from (see checkpoint.py); if that run had finished, its
+    assignment is restored as is.
+
+    Returns (list of ints): population deviation before each cycle, then
+    after the last one. Modifies assignment in-place
+    '''
+    pops = np.asarray(pops)
+    pop_devs_so_far = []
+    count = 0
+    saved = load_checkpoint(checkpoint_fp, num_units=len(assignment))
+    if saved is not None:
+        assignment[:] = saved['assignment']
+        pop_devs_so_far = saved['deviations']
+        if saved['counters'].get('finished', False):
+            print(f"This map's swapping already finished after {len(pop_devs_so_far)} swap cycles")
+            return pop_devs_so_far + [deviation_array(assignment, pops, num_districts)]
+        if saved['counters'].get('in_progress', False):
+            count = saved['counters']['count']
+            stop_after = saved['counters']['stop_after']
+        print(f"Resuming from checkpoint after {len(pop_devs_so_far)} swap cycles")
+
+    while deviation_array(assignment, pops, num_districts) > allowed_deviation:
+        if len(pop_devs_so_far) > 5 and pop_devs_so_far[-4:-2] == pop_devs_so_far[-2:]:
+            print("It looks like this swapping process is trapped in a cycle. Stopping")
+            break
+        count += 1
+        if count > stop_after:
+            print(f"You've now swapped {count-1} times. Stopping")
+            break
+        pop_devs_so_far.append(deviation_array(assignment, pops, num_districts))
+        pop_swap_assignment(adjacency, pops, assignment, num_districts, allowed_deviation)
+        print(f"Swap cycle #{count}: the most and least populous district differ by: "
+              f"{deviation_array(assignment, pops, num_districts)}")
+        if checkpoint_fp is not None and count % checkpoint_every == 0:
+            save_checkpoint(checkpoint_fp, assignment, pop_devs_so_far,
+                            {'count': count, 'stop_after': stop_after, 'in_progress': True})
+    if checkpoint_fp is not None:
+        save_checkpoint(checkpoint_fp, assignment, pop_devs_so_far,
+                        {'count': count, 'stop_after': stop_after, 'finished': True})
+    pop_devs_so_far.append(deviation_array(assignment, pops, num_districts))
+    return pop_devs_so_far
+
+
+### GeoDataFrame wrappers ###
+
+
+def assignment_from_df(df):
+    '''
+    Reads df's dist_id column (object with None, or nullable integer) into an
+    assignment array.
+    '''
+    return pd.to_numeric(df['dist_id'], errors='coerce').fillna(0) \
+        .to_numpy().astype(ASSIGNMENT_DTYPE)
+
+
+def set_dist_ids(df, assignment):
+    '''
+    Writes an assignment array to df's dist_id column as a nullable small
+    integer, with <NA> for unassigned units.
+
+    Returns: None, modifies df in-place
+    '''
+    dtype = "Int8" if assignment.max(initial=0) < 128 else "Int16"
+    df['dist_id'] = pd.arrays.IntegerArray(assignment.astype(dtype.lower()),
+                                           mask=assignment == 0)
+
+
+def draw_dart_throw_map(df, adjacency, num_districts, seed=2023):
+    '''
+    draw_random_maps.draw_dart_throw_map for large data: draws a map using
+    an adjacency matrix instead of a neighbors column.
+
+    Inputs:
+        -df (geopandas GeoDataFrame): state data by unit, with POP100
+        -adjacency (scipy sparse csr_matrix): unit adjacency in df's row order
+        -num_districts (int)
+        -seed (int)
+
+    Returns: None, sets df's dist_id column
+    '''
+    pops = df['POP100'].to_numpy()
+    set_dist_ids(df, dart_throw_assignment(adjacency, pops, num_districts, seed))
+
+
+def repeated_pop_swap(df, adjacency, allowed_deviation=70000, stop_after=20,
+                      checkpoint_fp=None, checkpoint_every=1):
+    '''
+    draw_random_maps.repeated_pop_swap for large data, with the same
+    checkpoint options.
+
+    Returns: None, modifies df's dist_id column in-place
+    '''
+    pops = df['POP100'].to_numpy()
+    assignment = assignment_from_df(df)
+    num_districts = int(assignment.max())
+    repeated_pop_swap_assignment(adjacency, pops, assignment, num_districts,
+                                 allowed_deviation, stop_after,
+                                 checkpoint_fp, checkpoint_every)
+    set_dist_ids(df, assignment)
+    if deviation_array(assignment, pops, num_districts) <= allowed_deviation:
+        print("You've reached your population balance target. Hooray!")
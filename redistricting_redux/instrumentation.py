@@ -0,0 +1,174 @@
+'''
+Opt-in timing and memory instrumentation for the mapping pipeline.
+
+Two kinds of measurements are recorded once enable() has been called:
+    -phases (load, dart throw, hole filling, swap cycle, dissolve, ...):
+    wall time, call count and peak memory allocated while the phase ran
+    (via tracemalloc, which is only started if track_memory=True)
+    -hot functions decorated with @timed (population_sum,
+    find_neighboring_districts, ...): wall time and call count
+
+Times are inclusive, so a phase's time includes the hot functions it calls.
+While disabled (the default), a phase costs one generator setup and a timed
+function one extra Python call plus a flag check.
+
+Usage:
+    instrumentation.enable()
+    ... run the pipeline ...
+    print(instrumentation.format_report())
+'''
+import functools
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_enabled = False
+_track_memory = False
+_phases = {}
+_functions = {}
+#running peak of each phase currently open, innermost last
+_peak_stack = []
+
+
+def enable(track_memory=True):
+    '''
+    Starts recording. Clears anything recorded before.
+
+    Inputs:
+        -track_memory (boolean): also record peak memory per phase. Slows
+        down allocation-heavy code noticeably while on.
+
+    Returns: None
+    '''
+    global _enabled, _track_memory
+    reset()
+    _enabled = True
+    _track_memory = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    '''
+    Stops recording. Anything recorded so far stays available to report().
+    '''
+    global _enabled, _track_memory
+    _enabled = False
+    if _track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _track_memory = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    '''
+    Throws away everything recorded so far.
+    '''
+    _phases.clear()
+    _functions.clear()
+    _peak_stack.clear()
+
+
+def _record(table, name, elapsed):
+    entry = table.get(name)
+    if entry is None:
+        entry = table[name] = {'calls': 0, 'total_s': 0.0, 'max_s': 0.0}
+    entry['calls'] += 1
+    entry['total_s'] += elapsed
+    entry['max_s'] = max(entry['max_s'], elapsed)
+    return entry
+
+
+@contextmanager
+def phase(name):
+    '''
+    Context manager (or decorator) marking a named phase of the pipeline.
+    Phases can nest; an outer phase's peak memory includes its inner phases.
+
+    Inputs:
+        -name (str): name of the phase in the report, e.g. "dissolve"
+    '''
+    if not _enabled:
+        yield
+        return
+
+    memory = _track_memory and tracemalloc.is_tracing()
+    if memory:
+        if _peak_stack:
+            _peak_stack[-1] = max(_peak_stack[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        start_mem = tracemalloc.get_traced_memory()[0]
+        _peak_stack.append(start_mem)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = _record(_phases, name, time.perf_counter() - start)
+        if memory:
+            peak = max(_peak_stack.pop(), tracemalloc.get_traced_memory()[1])
+            entry['peak_mem_bytes'] = max(entry.get('peak_mem_bytes', 0),
+                                          peak - start_mem)
+            if _peak_stack:
+                _peak_stack[-1] = max(_peak_stack[-1], peak)
+
+
+def timed(func):
+    '''
+    Decorator recording call count and wall time of a hot function under its
+    qualified name.
+    '''
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(_functions, name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def report():
+    '''
+    Structured snapshot of everything recorded.
+
+    Returns (dict): {'phases': {name: stats}, 'functions': {name: stats}},
+    where stats has calls, total_s, mean_s and max_s, and phases also have
+    peak_mem_bytes when memory tracking is on. Entries are sorted by total
+    time, largest first.
+    '''
+    def finish(table):
+        out = {}
+        for name, entry in sorted(table.items(), key=lambda kv: -kv[1]['total_s']):
+            entry = dict(entry)
+            entry['mean_s'] = entry['total_s'] / entry['calls']
+            out[name] = entry
+        return out
+
+    return {'phases': finish(_phases), 'functions': finish(_functions)}
+
+
+def format_report():
+    '''
+    Human-readable table of report().
+
+    Returns (str)
+    '''
+    rep = report()
+    lines = []
+    for section in ('phases', 'functions'):
+        lines.append(f"{section.upper():<36}{'calls':>9}{'total s':>11}{'mean s':>11}{'peak MB':>10}")
+        for name, entry in rep[section].items():
+            peak = entry.get('peak_mem_bytes')
+            peak = f"{peak / 2**20:.1f}" if peak is not None else '-'
+            lines.append(f"{name:<36}{entry['calls']:>9}{entry['total_s']:>11.3f}"
+                         f"{entry['mean_s']:>11.5f}{peak:>10}")
+        lines.append('')
+    return '\n'.join(lines)
@@ -6,21 +6,53 @@ import pandas as pd
 import geopandas as gpd
 import numpy as np
 import math
+import os
+from scipy import sparse
 from collections import OrderedDict
 from ast import literal_eval
+from instrumentation import phase
 
 
-def load_state(state_input, init_neighbors=False, affix_neighbors=True):
+#Columns kept when loading census-block data, which is far too big to keep
+#every column of, or precinct data with lean=True
+BLOCK_COLUMNS = ["GEOID20", "POP100", "G20PREDBID", "G20PRERTRU"]
+BLOCK_CHUNK_SIZE = 100000
+
+
+@phase("load")
+def load_state(state_input, init_neighbors=False, affix_neighbors=True,
+               level="vtd", with_geometry=True, chunk_size=BLOCK_CHUNK_SIZE,
+               lean=False):
     '''
     Helper function that actually imports the state after selecting it.
 
     Inputs:
         -state_input (str): 2-letter state postal code abbreviation
+        -lean (boolean): keep only BLOCK_COLUMNS (plus geometry and
+        neighbors), with GEOID20 as a categorical, compact_columns dtypes,
+        neighbor GEOIDs sharing one string object per precinct, and dist_id a
+        nullable small integer (<NA> = unassigned) instead of object with
+        None. Prints the memory footprint. For holding several states in one
+        process
+        -level (str): "vtd" for precinct/VTD data, or "block" for census
+        block data (see load_block_state; the other neighbor flags are
+        ignored for blocks)
+        -with_geometry (boolean): block level only; skip reading polygons
+        -chunk_size (int): block level only; rows read at a time
     Returns (geopandas GeoDataFrame)
     '''
+    if level == "block":
+        return load_block_state(state_input, with_geometry, chunk_size)
+    assert level == "vtd", f"level must be 'vtd' or 'block', not {level!r}"
 
-    fp = f"redistricting_redux/merged_shps/{state_input}_VTD_merged.shp"
-    state_data = gpd.read_file(fp)
+    #states merged by rdh_2020/join_data_to_shp.py are GeoParquet, which
+    #reads much faster than the older shapefiles
+    fp = f"redistricting_redux/merged_shps/{state_input}_VTD_merged.parquet"
+    if os.path.exists(fp):
+        state_data = gpd.read_parquet(fp, columns=BLOCK_COLUMNS + ["geometry"] if lean else None)
+    else:
+        fp = f"redistricting_redux/merged_shps/{state_input}_VTD_merged.shp"
+        state_data = gpd.read_file(fp, columns=BLOCK_COLUMNS if lean else None)
     if "Tot_2020_t" in state_data.columns:
         state_data.rename(columns={"Tot_2020_t","POP100"})
         print("Renamed population column to POP100")
@@ -30,13 +62,37 @@ def load_state(state_input, init_neighbors=False, affix_neighbors=True):
         print("Precinct neighbors calculated")
     if affix_neighbors:
         neighbor_fp = f'redistricting_redux/merged_shps/{state_input}_2020_neighbors.csv'
-        affix_neighbors_list(state_data, neighbor_fp)
+        affix_neighbors_list(state_data, neighbor_fp,
+                             geoids=state_data['GEOID20'].tolist() if lean else None)
         print("Neighbors list initialized")
-    state_data['dist_id'] = None
+    #so simplified_geometry can find this state's cached shapes
+    state_data.attrs['state'] = state_input
+    if lean:
+        compact_columns(state_data)
+        state_data['GEOID20'] = state_data['GEOID20'].astype("category")
+        state_data['dist_id'] = pd.Series(pd.NA, index=state_data.index, dtype="Int8")
+        print(f"{state_input} data takes {memory_footprint(state_data) / 2**20:.1f} MB in memory")
+    else:
+        state_data['dist_id'] = None
 
     return state_data   
 
 
+def memory_footprint(df):
+    '''
+    Bytes a GeoDataFrame takes in memory, by pandas' deep count: strings in
+    object columns are included, but shapely geometries count only their
+    pointers, and neighbors arrays only their own size, not the strings
+    they point to.
+
+    Inputs:
+        -df (pandas DataFrame or geopandas GeoDataFrame)
+
+    Returns (int)
+    '''
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
 def set_precinct_neighbors(df, state_postal):
     '''
     Creates a list of neighbors (adjacency list) for each precinct/VTD whose 
@@ -68,18 +124,29 @@ def set_precinct_neighbors(df, state_postal):
     df['neighbors'].to_csv(f'redistricting_redux/merged_shps/{state_postal}_2020_neighbors.csv')
 
 
-def affix_neighbors_list(df, neighbor_filename):
+@phase("neighbor parsing")
+def affix_neighbors_list(df, neighbor_filename, geoids=None):
     '''
     Affix an adjacency list of neighbors to the appropriate csv.
 
     Input:
         -df(geopandas GeoDataFrame): precinct/VTD-level data for a state
         -neighbor_filename (str): name of file where neighbors list is
+        -geoids (list of str): if given, every neighbor GEOID equal to one of
+        these is stored as that same string object, rather than a new copy
+        each time it's listed as someone's neighbor
 
     Returns: None, modifies df in-place
     '''
     neighbor_csv = pd.read_csv(neighbor_filename)
     neighbor_list = neighbor_csv['neighbors']
+    if geoids is not None:
+        shared = {geoid: geoid for geoid in geoids}
+        df['neighbors'] = [np.array([shared.get(n, n) for n in
+                                     literal_eval(x.replace("\n", "").replace("' '", "', '"))],
+                                    dtype=object)
+                           for x in neighbor_list]
+        return
     #deserialize 
     df['neighbors'] = neighbor_list
     df['neighbors'] = df['neighbors'].apply(lambda x: 
@@ -121,4 +188,220 @@ def make_neighbors_dict(df, neighbors_as_lists=True):
             if voteshare_neighbs:
                 neighbors_dict[voteshare] = voteshare_neighbs
             
-    return neighbors_dict
\ No newline at end of file
+    return neighbors_dict
+
+
+def make_adjacency_matrix(df):
+    '''
+    Converts the neighbors list of each precinct into a sparse adjacency
+    matrix, where entry (i, j) is 1 if the precinct in row i of the df lists
+    the precinct in row j as a neighbor. Rows and columns follow the
+    positional order of df. Neighbor GEOIDs that aren't in df are dropped.
+
+    Inputs:
+        -df(geopandas GeoDataFrame): state data by precinct/VTD. MUST HAVE
+        NEIGHBORS LIST INSTANTIATED CORRECTLY
+
+    Returns (scipy sparse csr_matrix): n x n adjacency matrix, n = len(df)
+    '''
+    assert 'neighbors' in df.columns, "This dataframe doesn't have neighbors instantiated yet!"
+
+    num_neighbors = df['neighbors'].map(len).to_numpy()
+    rows = np.repeat(np.arange(len(df), dtype=np.int32), num_neighbors)
+    if num_neighbors.sum() > 0:
+        all_neighbors = np.concatenate(df['neighbors'].to_numpy())
+    else:
+        all_neighbors = np.array([], dtype=object)
+    cols = pd.Index(df['GEOID20']).get_indexer(all_neighbors).astype(np.int32)
+
+    #get_indexer returns -1 for neighbors that aren't rows of the df
+    found = cols >= 0
+    adjacency = sparse.csr_matrix((np.ones(found.sum(), dtype=np.int8),
+                                   (rows[found], cols[found])),
+                                  shape=(len(df), len(df)))
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1
+    return adjacency
+
+
+def dem_voteshares(df, dcol="G20PREDBID", rcol="G20PRERTRU"):
+    '''
+    Two-party Democratic voteshare of each precinct, as a float array in the
+    positional order of df. Precincts with no major-party votes are NaN.
+
+    Inputs:
+        -df(geopandas GeoDataFrame): state data by precinct/VTD
+        -dcol (str): name of the column with Democratic votes
+        -rcol (str): name of the column with Republican votes
+
+    Returns (NumPy array of floats)
+    '''
+    d_votes = df[dcol].to_numpy(dtype=np.float64)
+    r_votes = df[rcol].to_numpy(dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return d_votes / (d_votes + r_votes)
+
+
+def compact_columns(df):
+    '''
+    Shrinks the numeric columns used by the drawing code to compact dtypes:
+    POP100 to int32, and vote columns to int32 when they hold whole numbers
+    (float32 otherwise, e.g. for votes disaggregated down to blocks).
+
+    Inputs:
+        -df (geopandas GeoDataFrame)
+
+    Returns: None, modifies df in-place
+    '''
+    if "POP100" in df.columns:
+        df["POP100"] = df["POP100"].fillna(0).astype(np.int32)
+    for col in ("G20PREDBID", "G20PRERTRU"):
+        if col not in df.columns:
+            continue
+        votes = df[col].fillna(0).to_numpy()
+        if np.all(np.mod(votes, 1) == 0):
+            df[col] = votes.astype(np.int32)
+        else:
+            df[col] = votes.astype(np.float32)
+
+
+def load_block_state(state_input, with_geometry=True, chunk_size=BLOCK_CHUNK_SIZE):
+    '''
+    Imports census-block data for a state, reading it chunk_size rows at a
+    time and keeping only BLOCK_COLUMNS (plus geometry), with compact dtypes.
+    There is no per-row neighbors column at this scale: get the adjacency
+    with load_adjacency(state_input, level="block") and use the functions in
+    graph_maps. dist_id is a nullable small integer (<NA> = unassigned).
+
+    Inputs:
+        -state_input (str): 2-letter state postal code abbreviation
+        -with_geometry (boolean): if False, skip reading polygons, which are
+        most of the memory at block level
+        -chunk_size (int): number of rows to read at a time
+
+    Returns (geopandas GeoDataFrame, or pandas DataFrame without geometry)
+    '''
+    fp = f"redistricting_redux/merged_shps/{state_input}_BLOCK_merged.shp"
+    chunks = []
+    start = 0
+    while True:
+        chunk = gpd.read_file(fp, rows=slice(start, start + chunk_size),
+                              ignore_geometry=not with_geometry)
+        if len(chunk) == 0:
+            break
+        keep = [col for col in BLOCK_COLUMNS if col in chunk.columns]
+        if with_geometry:
+            keep.append(chunk.geometry.name)
+        chunk = chunk[keep]
+        compact_columns(chunk)
+        chunks.append(chunk)
+        start += chunk_size
+        print(f"Read {start} blocks...")
+
+    state_data = pd.concat(chunks, ignore_index=True)
+    del chunks
+    state_data['dist_id'] = pd.Series(pd.NA, index=state_data.index, dtype="Int8")
+    state_data.attrs.update(state=state_input, level="block")
+    print(f"{state_input} 2020 census block data imported ({len(state_data)} blocks)")
+
+    return state_data
+
+
+def build_adjacency_matrix(df):
+    '''
+    Computes the adjacency matrix of a set of polygons directly from their
+    geometry, using a spatial index rather than comparing every pair like
+    set_precinct_neighbors does. Polygons that touch or overlap are neighbors.
+    Fast enough for census blocks.
+
+    Inputs:
+        -df (geopandas GeoDataFrame)
+
+    Returns (scipy sparse csr_matrix): symmetric n x n adjacency matrix in the
+    positional order of df
+    '''
+    rows, cols = df.sindex.query(df.geometry, predicate="intersects")
+    not_self = rows != cols
+    rows = rows[not_self].astype(np.int32)
+    cols = cols[not_self].astype(np.int32)
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                             shape=(len(df), len(df)))
+
+
+def adjacency_filepath(state_input, level="vtd"):
+    return f"redistricting_redux/merged_shps/{state_input}_2020_{level}_adjacency.npz"
+
+
+def save_adjacency(adjacency, filepath):
+    '''
+    Saves an adjacency matrix as compressed int32 CSR arrays.
+    '''
+    adjacency = adjacency.tocsr()
+    np.savez_compressed(filepath, indptr=adjacency.indptr.astype(np.int64),
+                        indices=adjacency.indices.astype(np.int32),
+                        shape=np.array(adjacency.shape))
+
+
+def read_neighbors_csv(neighbor_filename, geoids, chunk_size=BLOCK_CHUNK_SIZE):
+    '''
+    Builds an adjacency matrix straight from a neighbors csv (the format
+    written by set_precinct_neighbors), a chunk of rows at a time, without
+    keeping the per-row string arrays around.
+
+    Inputs:
+        -neighbor_filename (str): name of file where neighbors list is
+        -geoids (array-like of str): GEOID20 of each row, in row order
+
+    Returns (scipy sparse csr_matrix)
+    '''
+    geoid_index = pd.Index(geoids)
+    rows, cols = [], []
+    offset = 0
+    for chunk in pd.read_csv(neighbor_filename, chunksize=chunk_size):
+        parsed = [literal_eval(x.replace("\n", "").replace("' '", "', '"))
+                  for x in chunk['neighbors']]
+        counts = np.fromiter((len(p) for p in parsed), dtype=np.int64, count=len(parsed))
+        chunk_cols = geoid_index.get_indexer([g for p in parsed for g in p])
+        chunk_rows = np.repeat(np.arange(offset, offset + len(parsed), dtype=np.int32), counts)
+        found = chunk_cols >= 0
+        rows.append(chunk_rows[found])
+        cols.append(chunk_cols[found].astype(np.int32))
+        offset += len(parsed)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    n = len(geoid_index)
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+
+
+def load_adjacency(state_input, level="vtd", geoids=None):
+    '''
+    Loads the int32 CSR adjacency matrix of a state's precincts or blocks,
+    from the cache file written by save_adjacency. At VTD level, if there's
+    no cache yet, it is built from the neighbors csv (which needs geoids)
+    and cached for next time.
+
+    Inputs:
+        -state_input (str): 2-letter state postal code abbreviation
+        -level (str): "vtd" or "block"
+        -geoids (array-like of str): GEOID20 of each row of the state's
+        data, in row order. Only needed to build the VTD cache
+
+    Returns (scipy sparse csr_matrix)
+    '''
+    fp = adjacency_filepath(state_input, level)
+    try:
+        arrays = np.load(fp)
+    except FileNotFoundError:
+        if level != "vtd":
+            raise FileNotFoundError(f"No adjacency cache at {fp}. Build one with "
+                                    "save_adjacency(build_adjacency_matrix(df), "
+                                    "adjacency_filepath(state, level))")
+        assert geoids is not None, "Need the state's GEOID20s to build its adjacency cache"
+        adjacency = read_neighbors_csv(
+            f'redistricting_redux/merged_shps/{state_input}_2020_neighbors.csv', geoids)
+        save_adjacency(adjacency, fp)
+        return adjacency
+
+    shape = tuple(arrays['shape'])
+    indices = arrays['indices']
+    return sparse.csr_matrix((np.ones(len(indices), dtype=np.int8), indices,
+                              arrays['indptr']), shape=shape)
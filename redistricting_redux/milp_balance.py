@@ -0,0 +1,319 @@
+'''
+Exact final balancing with a mixed-integer program.
+
+The swap, Ethan and flow balancers all get stuck within a few precincts of
+balance, because at that point no single move, or pair of districts, helps.
+This finishing stage picks a whole set of moves at once instead: every unit
+within a few steps of a district border gets a 0/1 variable for each district
+it could move to, and scipy's HiGHS MILP solver looks for moves that bring
+the most and least populous districts within a goal of each other.
+Everything else stays put, so even Texas is a few thousand variables.
+
+Asking HiGHS for the smallest possible deviation outright doesn't work well:
+moving fractions of units balances perfectly, so it can never prove a plan
+is the best and spends its whole time limit looking. Finding a plan within a
+goal is much quicker, so the goal is halved after each plan found, and moved
+halfway back when no plan is found in time, until the allowed deviation is
+reached or the time limit runs out.
+
+Moves are limited so districts stay in one piece:
+    -a unit can only move to a district it borders, or to one a neighbor of
+    it that is closer to that district moves to as well, so what a district
+    gains is attached to it
+    -a unit only moves if, right now, its own district's units around it
+    stay connected without it (flow_balance.safe_to_move)
+    -if the moves chosen still split a district (one that loses units, or
+    one that gains them), those moves are ruled out together and the
+    program is solved again
+
+Works on the same positional arrays as graph_maps.
+'''
+import time
+import numpy as np
+from scipy import sparse
+from scipy.optimize import milp, LinearConstraint, Bounds
+from scipy.sparse.csgraph import connected_components
+
+import graph_maps
+from flow_balance import safe_to_move
+from instrumentation import phase
+
+#How far from the fewest moves a plan for a goal may be before the solver
+#stops looking (relative MILP gap)
+MOVES_GAP = 0.5
+#Share of the time limit one solve gets. The solver rarely proves it has
+#(nearly) the fewest moves, so it's stopped early with the best plan so far
+SOLVE_SHARE = 0.1
+
+def border_distance(adjacency, assignment, hops):
+    '''
+    How many steps each unit is from a unit in another district: 1 for units
+    on a district border, up to hops. Units further in are marked 0.
+
+    Returns (NumPy array)
+    '''
+    edges = adjacency.tocoo()
+    crossing = assignment[edges.row] != assignment[edges.col]
+    on_border = np.zeros(len(assignment), dtype=bool)
+    on_border[edges.row[crossing]] = True
+    #edges within a district, so distance is counted through a unit's own district
+    inside = sparse.csr_matrix((np.ones((~crossing).sum(), dtype=np.int8),
+                                (edges.row[~crossing], edges.col[~crossing])),
+                               shape=adjacency.shape)
+    distance = on_border.astype(np.int8)
+    reached = on_border
+    for step in range(2, hops + 1):
+        #units next to one reached so far, in the same district
+        nxt = (inside @ reached.astype(np.int8)) > 0
+        nxt &= ~reached
+        distance[nxt] = step
+        reached = reached | nxt
+    return distance
+
+
+def candidate_moves(adjacency, assignment, hops=2):
+    '''
+    Every (unit, district) move the program may choose: units within hops of
+    a border that are safe to move, to each district within hops - 1 steps
+    of them.
+
+    Returns (NumPy array, NumPy array, NumPy array): unit, district it would
+    move to, and how many steps the unit is from that district (1 if it
+    already borders it)
+    '''
+    indptr, indices = adjacency.indptr, adjacency.indices
+    distance = border_distance(adjacency, assignment, hops)
+    units, targets, steps = [], [], []
+    for unit in np.flatnonzero(distance).tolist():
+        if not safe_to_move(adjacency, assignment, unit):
+            continue
+        own = assignment[unit]
+        #districts reachable within distance[unit] steps through own's units,
+        #and the fewest steps to each
+        frontier = [unit]
+        seen = {unit}
+        near = {}
+        for step in range(1, distance[unit] + 1):
+            ring = []
+            for u in frontier:
+                for n in indices[indptr[u]:indptr[u + 1]].tolist():
+                    if assignment[n] != own:
+                        near.setdefault(int(assignment[n]), step)
+                    elif n not in seen:
+                        seen.add(n)
+                        ring.append(n)
+            frontier = ring
+        for d, step in near.items():
+            if d > 0:
+                units.append(unit)
+                targets.append(d)
+                steps.append(step)
+    return np.array(units, dtype=np.int64), np.array(targets, dtype=np.int64), \
+        np.array(steps, dtype=np.int64)
+
+
+def build_program(adjacency, pops, assignment, num_districts, units, targets, steps):
+    '''
+    The mixed-integer program over candidate moves, without a goal.
+    Variables are one 0/1 per move, then the largest and smallest district
+    population.
+
+    Returns (tuple): list of LinearConstraints, Bounds and integrality, for
+    scipy.optimize.milp
+    '''
+    num_moves = len(units)
+    num_vars = num_moves + 2
+    dist_pops = graph_maps.district_pops_array(assignment, pops, num_districts)
+    move_pops = pops[units].astype(float)
+    sources = assignment[units].astype(np.int64)
+    constraints = []
+
+    #district population after the moves, between lo and hi:
+    #dist_pop + gains - losses - hi <= 0 and dist_pop + gains - losses - lo >= 0
+    cols = np.arange(num_moves)
+    change = sparse.coo_matrix(
+        (np.concatenate([move_pops, -move_pops]),
+         (np.concatenate([targets - 1, sources - 1]), np.concatenate([cols, cols]))),
+        shape=(num_districts, num_moves)).tocsr()
+    ones = np.ones((num_districts, 1))
+    constraints.append(LinearConstraint(sparse.hstack([change, -ones, 0 * ones]),
+                                        -np.inf, -dist_pops))
+    constraints.append(LinearConstraint(sparse.hstack([change, 0 * ones, -ones]),
+                                        -dist_pops, np.inf))
+
+    #each unit moves to one district at most
+    unit_ids, unit_rows = np.unique(units, return_inverse=True)
+    one_move = sparse.coo_matrix((np.ones(num_moves), (unit_rows, cols)),
+                                 shape=(len(unit_ids), num_vars))
+    constraints.append(LinearConstraint(one_move, -np.inf, 1))
+
+    #a unit that doesn't border its new district needs a neighbor closer to
+    #it moving there too. Only counting closer neighbors means every chain of
+    #moves ends at a unit bordering the district, rather than a few units
+    #propping each other up as an island
+    move_index = {(u, d): i for i, (u, d) in enumerate(zip(units.tolist(), targets.tolist()))}
+    indptr, indices = adjacency.indptr, adjacency.indices
+    rows, cols_, vals = [], [], []
+    row = 0
+    for i in np.flatnonzero(steps > 1).tolist():
+        u, d = int(units[i]), int(targets[i])
+        rows.append(row)
+        cols_.append(i)
+        vals.append(1)
+        for n in indices[indptr[u]:indptr[u + 1]].tolist():
+            j = move_index.get((n, d))
+            if j is not None and steps[j] < steps[i]:
+                rows.append(row)
+                cols_.append(j)
+                vals.append(-1)
+        row += 1
+    if row:
+        attach = sparse.coo_matrix((vals, (rows, cols_)), shape=(row, num_vars))
+        constraints.append(LinearConstraint(attach, -np.inf, 0))
+
+    bounds = Bounds(np.concatenate([np.zeros(num_moves), [-np.inf, -np.inf]]),
+                    np.concatenate([np.ones(num_moves), [np.inf, np.inf]]))
+    integrality = np.concatenate([np.ones(num_moves), [0, 0]])
+    return constraints, bounds, integrality
+
+
+def splitting_moves(adjacency, trial, units, sources, chosen, components_before):
+    '''
+    For each district the chosen moves split into more pieces than
+    components_before says it was in, the moves to blame: moves into it of
+    units in a piece cut off from the rest (every piece but the largest),
+    and moves out of it whose units border such a piece. A district that
+    only gains units can be split too, e.g. when a unit moves in next to a
+    unit that moves out.
+
+    Returns (dict): district -> indices of those moves
+    '''
+    indptr, indices = adjacency.indptr, adjacency.indices
+    targets = trial[units]
+    splits = {}
+    for d in np.unique(np.concatenate([sources[chosen], targets[chosen]])).tolist():
+        members = np.flatnonzero(trial == d)
+        num_pieces, labels = connected_components(adjacency[members][:, members],
+                                                  directed=False)
+        if num_pieces <= components_before[d]:
+            continue
+        #the pieces that were there before are the biggest ones
+        keep = np.argsort(-np.bincount(labels))[:components_before[d]]
+        cut_off = set(members[~np.isin(labels, keep)].tolist())
+        into_d = [i for i in chosen[targets[chosen] == d].tolist() if units[i] in cut_off]
+        out_of_d = chosen[sources[chosen] == d]
+        blamed = into_d + [i for i in out_of_d.tolist()
+                           if cut_off.intersection(indices[indptr[units[i]]:indptr[units[i] + 1]].tolist())]
+        splits[d] = blamed or chosen[(sources[chosen] == d) | (targets[chosen] == d)].tolist()
+    return splits
+
+
+@phase("MILP balancing")
+def milp_balance_assignment(adjacency, pops, assignment, num_districts,
+                            allowed_deviation=0, hops=2, time_limit=60, max_rounds=10):
+    '''
+    Moves units near district borders to bring the population deviation down
+    to allowed_deviation, or as close as it can get in time_limit seconds,
+    by solving mixed-integer programs (see the module docstring).
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix): unit adjacency
+        -pops (NumPy array): population of each unit
+        -assignment (NumPy array): district of each unit, all assigned
+        -num_districts (int)
+        -allowed_deviation (int): stop once the deviation is this low. 0
+        keeps going for as long as the solver finds plans
+        -hops (int): how far from a district border units may move from
+        -time_limit (float): seconds the solver gets in all
+        -max_rounds (int): most times to solve again for one goal after
+        ruling out moves that split a district
+
+    Returns (list of ints): population deviation before, then after each
+    plan found. Modifies assignment in-place
+    '''
+    pops = np.asarray(pops)
+    deadline = time.perf_counter() + time_limit
+    pop_devs_so_far = [graph_maps.deviation_array(assignment, pops, num_districts)]
+    if pop_devs_so_far[-1] <= allowed_deviation:
+        return pop_devs_so_far
+    units, targets, steps = candidate_moves(adjacency, assignment, hops)
+    if len(units) == 0:
+        return pop_devs_so_far
+    constraints, bounds, integrality = build_program(
+        adjacency, pops, assignment, num_districts, units, targets, steps)
+    print(f"Choosing among {len(units)} moves of {len(np.unique(units))} units near district borders")
+
+    #every plan is moves from the starting map, so ruled-out moves stay ruled out
+    start = assignment.copy()
+    sources = start[units]
+    components_before = {d: connected_components(
+        adjacency[start == d][:, start == d], directed=False)[0]
+        for d in range(1, num_districts + 1)}
+    num_vars = len(units) + 2
+    #fewest moves, since every move risks splitting a district
+    objective = np.concatenate([np.ones(len(units)), [0, 0]])
+    spread = np.zeros(num_vars)
+    spread[-2:] = [1, -1]
+    goal = max(pop_devs_so_far[-1] // 2, allowed_deviation)
+    rounds = 0
+    while time.perf_counter() < deadline and rounds < max_rounds:
+        result = milp(objective,
+                      constraints=constraints + [LinearConstraint(spread, -np.inf, goal)],
+                      bounds=bounds, integrality=integrality,
+                      options={'time_limit': min(deadline - time.perf_counter(),
+                                                 SOLVE_SHARE * time_limit),
+                               'mip_rel_gap': MOVES_GAP, 'disp': False})
+        if result.x is None:
+            #aim halfway back to the best plan so far instead
+            print(f"No plan found within {goal}")
+            goal = (goal + pop_devs_so_far[-1]) // 2
+            if goal >= pop_devs_so_far[-1] - 1:
+                break
+            continue
+        chosen = np.flatnonzero(result.x[:len(units)] > 0.5)
+        trial = start.copy()
+        trial[units[chosen]] = targets[chosen]
+        splits = splitting_moves(adjacency, trial, units, sources, chosen, components_before)
+        if splits:
+            #those moves can't all be made together
+            for d, moves in splits.items():
+                cut = np.zeros(num_vars)
+                cut[moves] = 1
+                constraints.append(LinearConstraint(cut, -np.inf, len(moves) - 1))
+            rounds += 1
+            print(f"The moves split district(s) {list(splits)}; solving again without them")
+            continue
+        rounds = 0
+        assignment[:] = trial
+        pop_devs_so_far.append(graph_maps.deviation_array(trial, pops, num_districts))
+        print(f"Moved {len(chosen)} units; the most and least populous district differ by: {pop_devs_so_far[-1]}")
+        if pop_devs_so_far[-1] <= allowed_deviation:
+            break
+        goal = max(pop_devs_so_far[-1] // 2, allowed_deviation)
+    return pop_devs_so_far
+
+
+def milp_balance(df, adjacency=None, allowed_deviation=0, hops=2, time_limit=60):
+    '''
+    MILP finishing stage for a GeoDataFrame with every precinct assigned a
+    dist_id, e.g. after repeated_pop_swap or flow_balance.
+
+    Inputs:
+        -df (geopandas GeoDataFrame): state data by precinct/VTD
+        -adjacency (scipy sparse csr_matrix): unit adjacency in df's row
+        order. Built from df's neighbors if None
+        -allowed_deviation, hops, time_limit: see milp_balance_assignment
+
+    Returns (list of ints): population deviation before, then after each
+    plan found. Modifies df's dist_id column in-place
+    '''
+    if adjacency is None:
+        from load_state_data import make_adjacency_matrix
+        adjacency = make_adjacency_matrix(df)
+    pops = df['POP100'].to_numpy()
+    assignment = graph_maps.assignment_from_df(df)
+    num_districts = int(assignment.max())
+    deviations = milp_balance_assignment(adjacency, pops, assignment, num_districts,
+                                         allowed_deviation, hops, time_limit)
+    graph_maps.set_dist_ids(df, assignment)
+    return deviations
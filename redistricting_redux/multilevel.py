@@ -0,0 +1,291 @@
+'''
+Multilevel map drawing: coarsen the unit graph, draw and balance on the
+small graph, then project back down one level at a time, refining only at
+district boundaries on the way.
+
+Coarsening merges pairs of adjacent units (a randomized proposal matching,
+so each level is about half the size of the one below), optionally only
+pairing units in the same county, as read from the county FIPS code in
+characters 3-5 of GEOID20. On the coarsest graph, districts are grown
+smallest-first from random darts; on every level, boundary units move to a
+neighboring district only when that narrows the two districts' population
+gap without splitting the district it leaves. A move on a coarse level
+shifts a whole neighborhood at once, so only a few cheap passes are needed
+on the large fine levels.
+'''
+import heapq
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import flow_balance
+import graph_maps
+from instrumentation import phase
+
+
+def county_codes(geoids):
+    '''
+    Integer code for the county of each unit, from the state and county FIPS
+    codes at the start of GEOID20 (e.g. "32003" in "32003001234").
+
+    Inputs:
+        -geoids (array-like of str): GEOID20 of each unit
+
+    Returns (NumPy array of int32)
+    '''
+    return pd.factorize(pd.Series(geoids).astype(str).str[:5])[0].astype(np.int32)
+
+
+def match_units(adjacency, pops, max_unit_pop, rng, groups=None, rounds=4):
+    '''
+    Pairs up adjacent units. In each round, unmatched units are randomly
+    split into proposers and acceptors; every proposer picks a random
+    unmatched acceptor neighbor, and every acceptor takes one of the
+    proposals it got. Pairs whose combined population would exceed
+    max_unit_pop, or (when groups is given) that lie in different groups,
+    are never merged.
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix)
+        -pops (NumPy array): population of each unit
+        -max_unit_pop (int): largest population of a merged unit
+        -rng (NumPy Generator)
+        -groups (NumPy array of ints): e.g. county_codes; None to ignore
+        -rounds (int): proposal rounds to run
+
+    Returns (NumPy array of int32): coarse unit of each unit, 0 to m-1
+    '''
+    num_units = adjacency.shape[0]
+    edges = adjacency.tocoo()
+    u, v = edges.row, edges.col
+    ok = (u != v) & (pops[u] + pops[v] <= max_unit_pop)
+    if groups is not None:
+        ok &= groups[u] == groups[v]
+    u, v = u[ok], v[ok]
+
+    partner = np.full(num_units, -1, dtype=np.int64)
+    for _ in range(rounds):
+        proposer = rng.random(num_units) < 0.5
+        live = (partner[u] < 0) & (partner[v] < 0) & proposer[u] & ~proposer[v]
+        pu, pv = u[live], v[live]
+        if len(pu) == 0:
+            break
+        #each proposer picks one acceptor...
+        order = np.lexsort((rng.random(len(pu)), pu))
+        first = np.unique(pu[order], return_index=True)[1]
+        pu, pv = pu[order][first], pv[order][first]
+        #...and each acceptor keeps one proposal
+        order = np.lexsort((rng.random(len(pv)), pv))
+        first = np.unique(pv[order], return_index=True)[1]
+        pu, pv = pu[order][first], pv[order][first]
+        partner[pu] = pv
+        partner[pv] = pu
+
+    #each pair takes the label of its lower-numbered member
+    leader = np.where((partner >= 0) & (partner < np.arange(num_units)),
+                      partner, np.arange(num_units))
+    return pd.factorize(leader)[0].astype(np.int32)
+
+
+def contract(adjacency, pops, labels):
+    '''
+    Builds the coarse graph for a labelling of units into coarse units.
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix): fine adjacency
+        -pops (NumPy array): fine populations
+        -labels (NumPy array of ints): coarse unit of each fine unit
+
+    Returns (tuple): (coarse adjacency as csr_matrix, coarse populations)
+    '''
+    num_coarse = int(labels.max()) + 1
+    project = sparse.csr_matrix((np.ones(len(labels), dtype=np.int32),
+                                 (np.arange(len(labels)), labels)),
+                                shape=(len(labels), num_coarse))
+    coarse = (project.T @ adjacency.astype(np.int32) @ project).tocsr()
+    coarse.setdiag(0)
+    coarse.eliminate_zeros()
+    coarse.data[:] = 1
+    coarse = coarse.astype(np.int8)
+    coarse.indices = coarse.indices.astype(np.int32)
+    coarse_pops = np.bincount(labels, weights=pops, minlength=num_coarse).round().astype(np.int64)
+    return coarse, coarse_pops
+
+
+def grow_assignment(adjacency, pops, num_districts, rng):
+    '''
+    Draws a map on a (small, coarse) graph by throwing darts, then always
+    letting the least populous district that can still grow take one more
+    random unassigned neighbor. Growing smallest-first keeps districts close
+    in population, unlike growing every district a full ring at a time.
+    Leftover unreachable units are filled in like in graph_maps.
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix)
+        -pops (NumPy array): population of each unit
+        -num_districts (int)
+        -rng (NumPy Generator)
+
+    Returns (NumPy array of int16): assignment
+    '''
+    num_units = adjacency.shape[0]
+    indptr, indices = adjacency.indptr, adjacency.indices
+    assignment = np.zeros(num_units, dtype=graph_maps.ASSIGNMENT_DTYPE)
+    darts = rng.choice(num_units, size=num_districts, replace=False)
+    assignment[darts] = np.arange(1, num_districts + 1)
+    frontiers = {id: set(indices[indptr[d]:indptr[d + 1]].tolist())
+                 for id, d in zip(range(1, num_districts + 1), darts)}
+    heap = [(int(pops[d]), id) for id, d in zip(range(1, num_districts + 1), darts)]
+    heapq.heapify(heap)
+
+    while heap:
+        pop, id = heapq.heappop(heap)
+        frontier = frontiers[id]
+        frontier.difference_update([u for u in frontier if assignment[u] != 0])
+        if not frontier:
+            continue
+        unit = rng.choice(list(frontier))
+        frontier.discard(unit)
+        assignment[unit] = id
+        frontier.update(u for u in indices[indptr[unit]:indptr[unit + 1]].tolist()
+                        if assignment[u] == 0)
+        heapq.heappush(heap, (pop + int(pops[unit]), id))
+
+    if (assignment == 0).any():
+        graph_maps.fill_holes_assignment(adjacency, pops, assignment, num_districts)
+    return assignment
+
+
+@phase("boundary refinement")
+def refine_boundaries(adjacency, pops, assignment, num_districts,
+                      allowed_deviation=70000, max_passes=20):
+    '''
+    Balances populations by moving boundary units only. In each pass, every
+    unit on a district border is offered to its least populous neighboring
+    district, and moves are made (largest population gap first) whenever the
+    move narrows the gap between the two districts and (by
+    flow_balance.safe_to_move) leaves the donor district connected. Every
+    move lowers the spread of district populations, so unlike
+    pop_swap_assignment this can't cycle; it stops once nothing moves or the
+    deviation is allowed.
+
+    Returns (int): number of passes run. Modifies assignment in-place
+    '''
+    pops = np.asarray(pops)
+    passes = 0
+    for passes in range(1, max_passes + 1):
+        dist_pops = graph_maps.district_pops_array(assignment, pops, num_districts)
+        if dist_pops.max() - dist_pops.min() <= allowed_deviation:
+            return passes - 1
+        edges = adjacency.tocoo()
+        on_border = np.unique(edges.row[assignment[edges.row] != assignment[edges.col]])
+        acceptors = graph_maps.smallest_neighboring_district(adjacency, assignment,
+                                                             dist_pops, on_border)
+        donors = assignment[on_border]
+        gap = dist_pops[donors - 1] - dist_pops[np.maximum(acceptors, 1) - 1]
+        ok = (acceptors > 0) & (gap > pops[on_border])
+        order = np.argsort(-gap[ok], kind='stable')
+        units, acceptors = on_border[ok][order], acceptors[ok][order]
+
+        dist_sizes = np.bincount(assignment, minlength=num_districts + 1)
+        moved = 0
+        for unit, acceptor in zip(units.tolist(), acceptors.tolist()):
+            donor = assignment[unit]
+            if dist_pops[donor - 1] - dist_pops[acceptor - 1] <= pops[unit] or dist_sizes[donor] <= 1:
+                continue
+            if not flow_balance.safe_to_move(adjacency, assignment, unit):
+                continue
+            assignment[unit] = acceptor
+            dist_pops[donor - 1] -= pops[unit]
+            dist_pops[acceptor - 1] += pops[unit]
+            dist_sizes[donor] -= 1
+            dist_sizes[acceptor] += 1
+            moved += 1
+        graph_maps.recapture_orphans_assignment(adjacency, pops, assignment, num_districts)
+        if moved == 0:
+            break
+    return passes
+
+
+def multilevel_assignment(adjacency, pops, num_districts, seed=2023,
+                          allowed_deviation=70000, groups=None,
+                          coarsest_size=None, coarse_passes=200, refine_passes=10):
+    '''
+    Draws a balanced map by coarsening, drawing on the coarsest graph, and
+    refining district boundaries on the way back down.
+
+    Inputs:
+        -adjacency (scipy sparse csr_matrix): unit adjacency
+        -pops (NumPy array): population of each unit
+        -num_districts (int)
+        -seed (int): seed for random number generation, for replicability
+        -allowed_deviation (int): target population deviation
+        -groups (NumPy array of ints): if given (e.g. county_codes), units
+        are only merged with units in the same group
+        -coarsest_size (int): stop coarsening at about this many units.
+        Defaults to 40 units per district
+        -coarse_passes (int): max refine_boundaries passes on the coarsest
+        level, where passes are cheap
+        -refine_passes (int): max refine_boundaries passes on every other level
+
+    Returns (NumPy array of int16): assignment of the original units
+    '''
+    rng = np.random.default_rng(seed)
+    pops = np.asarray(pops)
+    if coarsest_size is None:
+        coarsest_size = 40 * num_districts
+    #keep coarse units small enough that districts can still be balanced
+    max_unit_pop = max(1, int(pops.sum()) // num_districts // 20)
+
+    levels = []
+    level_adj, level_pops, level_groups = adjacency, pops, groups
+    with phase("coarsening"):
+        while level_adj.shape[0] > coarsest_size:
+            labels = match_units(level_adj, level_pops, max_unit_pop, rng, level_groups)
+            if labels.max() + 1 > 0.9 * level_adj.shape[0]:
+                #matching has stalled, so more levels won't help
+                break
+            levels.append((level_adj, level_pops, labels))
+            if level_groups is not None:
+                coarse_groups = np.zeros(labels.max() + 1, dtype=level_groups.dtype)
+                coarse_groups[labels] = level_groups
+                level_groups = coarse_groups
+            level_adj, level_pops = contract(level_adj, level_pops, labels)
+    print(f"Coarsened {adjacency.shape[0]} units to {level_adj.shape[0]} in {len(levels)} levels")
+
+    with phase("dart throw"):
+        assignment = grow_assignment(level_adj, level_pops, num_districts, rng)
+    refine_boundaries(level_adj, level_pops, assignment, num_districts,
+                      allowed_deviation, max_passes=coarse_passes)
+
+    for fine_adj, fine_pops, labels in reversed(levels):
+        assignment = assignment[labels]
+        refine_boundaries(fine_adj, fine_pops, assignment, num_districts,
+                          allowed_deviation, max_passes=refine_passes)
+    return assignment
+
+
+def draw_multilevel_map(df, adjacency, num_districts, seed=2023,
+                        allowed_deviation=70000, by_county=False, **kwargs):
+    '''
+    Draws and balances a map with multilevel_assignment and stores it in df.
+
+    Inputs:
+        -df (geopandas GeoDataFrame): state data by unit, with POP100 (and
+        GEOID20 if by_county)
+        -adjacency (scipy sparse csr_matrix): unit adjacency in df's row order
+        -num_districts (int)
+        -seed (int)
+        -allowed_deviation (int)
+        -by_county (boolean): only merge units within the same county
+        -kwargs: passed on to multilevel_assignment
+
+    Returns: None, sets df's dist_id column
+    '''
+    groups = county_codes(df['GEOID20']) if by_county else None
+    assignment = multilevel_assignment(adjacency, df['POP100'].to_numpy(), num_districts,
+                                       seed=seed, allowed_deviation=allowed_deviation,
+                                       groups=groups, **kwargs)
+    graph_maps.set_dist_ids(df, assignment)
+    deviation = graph_maps.deviation_array(assignment, df['POP100'].to_numpy(), num_districts)
+    print(f"The most and least populous district differ by: {deviation}")
@@ -0,0 +1,173 @@
+'''
+Partisan fairness metrics for whole ensembles of plans at once.
+
+Every function takes two (plans x districts) matrices of Democratic and
+Republican votes, e.g. dissolve_map's G20PREDBID and G20PRERTRU columns for
+each plan stacked into rows, and returns one value per plan (or per plan and
+vote share, for seats-votes curves), computed with array operations across
+every plan at once. A single plan can be passed as 1-D arrays, and then
+single values come back.
+
+Like point_swing, every metric is signed so that positive values mean the
+map favors Democrats and negative values mean it favors Republicans:
+    -efficiency gap: Republican minus Democratic wasted votes (votes for a
+    loser, or for a winner past 50%), over all votes
+    -mean-median: median district's Democratic voteshare minus the mean
+    district's
+    -partisan bias: Democratic seat share above 50% when the statewide vote
+    is shifted to a 50-50 tie by uniform swing
+    -declination (Warrington's): the angle between the Republican-won and
+    Democratic-won districts' voteshares, scaled to -1 to 1, with the usual
+    sign flipped. Undefined (nan) when one party wins every seat
+'''
+import numpy as np
+
+#Statewide Democratic voteshares seats_votes_curve is evaluated at by default
+SWING_SHARES = np.linspace(0.3, 0.7, 41)
+
+
+def _as_plans(d_votes, r_votes):
+    d_votes = np.asarray(d_votes, dtype=np.float64)
+    r_votes = np.asarray(r_votes, dtype=np.float64)
+    assert d_votes.shape == r_votes.shape, "D and R vote matrices must be the same shape"
+    return np.atleast_2d(d_votes), np.atleast_2d(r_votes), d_votes.ndim == 1
+
+
+def _single(values, single):
+    return values[0] if single else values
+
+
+def district_voteshares(d_votes, r_votes):
+    '''
+    Democratic share of the two-party vote in every district of every plan,
+    mean_voteshare for a whole matrix of districts at once. Districts with no
+    votes count as tied.
+
+    Returns (NumPy array): same shape as d_votes
+    '''
+    d_votes, r_votes, single = _as_plans(d_votes, r_votes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.nan_to_num(d_votes / (d_votes + r_votes), nan=0.5)
+    return _single(shares, single)
+
+
+def statewide_voteshares(d_votes, r_votes):
+    '''
+    Democratic share of the two-party vote across all districts of each plan.
+
+    Returns (NumPy array): one share per plan
+    '''
+    d_votes, r_votes, single = _as_plans(d_votes, r_votes)
+    shares = d_votes.sum(axis=1) / (d_votes.sum(axis=1) + r_votes.sum(axis=1))
+    return _single(shares, single)
+
+
+def seats(d_votes, r_votes):
+    '''
+    Districts won by the Democratic candidate in each plan (positive
+    point_swing, as app.run counts them).
+
+    Returns (NumPy array of ints)
+    '''
+    d_votes, r_votes, single = _as_plans(d_votes, r_votes)
+    return _single((d_votes > r_votes).sum(axis=1), single)
+
+
+def efficiency_gap(d_votes, r_votes):
+    '''
+    Difference in wasted votes, Republican minus Democratic, as a share of
+    all votes cast.
+
+    Returns (NumPy array): one value per plan
+    '''
+    d_votes, r_votes, single = _as_plans(d_votes, r_votes)
+    totals = d_votes + r_votes
+    d_won = d_votes > r_votes
+    #the winner wastes what they got past half the votes; the loser wastes all
+    d_wasted = np.where(d_won, d_votes - totals / 2, d_votes)
+    r_wasted = np.where(d_won, r_votes, r_votes - totals / 2)
+    gap = (r_wasted - d_wasted).sum(axis=1) / totals.sum(axis=1)
+    return _single(gap, single)
+
+
+def mean_median(d_votes, r_votes):
+    '''
+    Median district Democratic voteshare minus the mean district's.
+
+    Returns (NumPy array): one value per plan
+    '''
+    shares = np.atleast_2d(district_voteshares(d_votes, r_votes))
+    difference = np.median(shares, axis=1) - shares.mean(axis=1)
+    return _single(difference, np.ndim(d_votes) == 1)
+
+
+def seats_votes_curve(d_votes, r_votes, statewide_shares=SWING_SHARES):
+    '''
+    Democratic seats each plan would give at each statewide voteshare, if
+    every district's Democratic voteshare moved by the same amount (uniform
+    swing).
+
+    Inputs:
+        -d_votes, r_votes (NumPy arrays): plans x districts votes
+        -statewide_shares (array-like of floats): statewide Democratic
+        voteshares to evaluate at
+
+    Returns (NumPy array of ints): plans x len(statewide_shares) seat counts
+    '''
+    shares = np.atleast_2d(district_voteshares(d_votes, r_votes))
+    statewide = np.atleast_1d(statewide_voteshares(d_votes, r_votes))
+    swing = np.asarray(statewide_shares)[None, :] - statewide[:, None]
+    #plans x shares x districts
+    curve = ((shares[:, None, :] + swing[:, :, None]) > 0.5).sum(axis=2)
+    return _single(curve, np.ndim(d_votes) == 1)
+
+
+def partisan_bias(d_votes, r_votes):
+    '''
+    Democratic seat share minus one half, at a 50-50 statewide vote under
+    uniform swing.
+
+    Returns (NumPy array): one value per plan
+    '''
+    num_districts = np.shape(d_votes)[-1]
+    tied_seats = seats_votes_curve(d_votes, r_votes, [0.5])[..., 0]
+    return tied_seats / num_districts - 0.5
+
+
+def declination(d_votes, r_votes):
+    '''
+    Declination: 2/pi times the angle between the line from the middle of the
+    Republican-won districts' voteshares to 50%, and the line from 50% to the
+    middle of the Democratic-won districts' voteshares (Warrington 2018),
+    signed so positive values favor Democrats.
+
+    Returns (NumPy array): one value per plan, nan where one party won every
+    district
+    '''
+    shares = np.atleast_2d(district_voteshares(d_votes, r_votes))
+    num_districts = shares.shape[1]
+    d_won = shares > 0.5
+    num_d = d_won.sum(axis=1)
+    num_r = num_districts - num_d
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_d = np.where(d_won, shares, 0).sum(axis=1) / num_d
+        mean_r = np.where(d_won, 0, shares).sum(axis=1) / num_r
+        theta_d = np.arctan((2 * mean_d - 1) * num_districts / num_d)
+        theta_r = np.arctan((1 - 2 * mean_r) * num_districts / num_r)
+    values = np.where((num_d > 0) & (num_r > 0), 2 * (theta_r - theta_d) / np.pi, np.nan)
+    return _single(values, np.ndim(d_votes) == 1)
+
+
+def ensemble_metrics(d_votes, r_votes):
+    '''
+    Every metric in this file for each plan.
+
+    Returns (dict of NumPy arrays): 'seats', 'statewide_voteshare',
+    'efficiency_gap', 'mean_median', 'partisan_bias', 'declination'
+    '''
+    return {'seats': seats(d_votes, r_votes),
+            'statewide_voteshare': statewide_voteshares(d_votes, r_votes),
+            'efficiency_gap': efficiency_gap(d_votes, r_votes),
+            'mean_median': mean_median(d_votes, r_votes),
+            'partisan_bias': partisan_bias(d_votes, r_votes),
+            'declination': declination(d_votes, r_votes)}
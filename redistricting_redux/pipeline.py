@@ -0,0 +1,302 @@
+'''
+Runs the whole pipeline (load -> draw -> balance -> dissolve -> predict) for
+several supported states at once, one state per worker process, and gathers
+the results into a single summary.
+
+States are started largest first (by the size of their merged data on disk),
+so the slowest state, usually Texas, starts right away instead of last.
+Each worker can be given a memory budget; a state that goes over it fails
+with a MemoryError in its own worker instead of taking down the machine.
+The budget is a cap on address space, not on memory actually used, and is
+only enforced on Linux (see set_memory_budget).
+
+Usage:
+    python redistricting_redux pipeline --states TX GA NV --workers 3 \
+        --memory-mb 4000 --swap-steps 5 --output summary.json
+'''
+import contextlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from app import SUPPORTED_STATES
+
+PIPELINE_STAGES = ['load', 'draw', 'balance', 'dissolve', 'predict']
+
+
+def state_size(state_input):
+    '''
+    Bytes of merged data on disk for a state, used as a stand-in for how long
+    it will take. 0 if the state has no merged data.
+    '''
+    prefix = f"redistricting_redux/merged_shps/{state_input}_VTD_merged"
+    for ext in ('.parquet', '.shp'):
+        if os.path.exists(prefix + ext):
+            size = os.path.getsize(prefix + ext)
+            if ext == '.shp' and os.path.exists(prefix + '.dbf'):
+                size += os.path.getsize(prefix + '.dbf')
+            return size
+    return 0
+
+
+def schedule(states):
+    '''
+    Orders states largest first.
+
+    Returns (list of str)
+    '''
+    return sorted(states, key=state_size, reverse=True)
+
+
+def set_memory_budget(memory_budget_mb):
+    '''
+    Caps this process's address space at memory_budget_mb (soft limit only,
+    so it can be raised again for the next state). Does nothing where the
+    resource module isn't available (Windows).
+
+    RLIMIT_AS is a rough budget. It counts address space reserved but never
+    touched, and NumPy's BLAS threads and Arrow's allocator reserve hundreds
+    of MB up front, so a small budget can fail a state that would fit in
+    memory; leave at least 1-2 GB over what the state needs. macOS accepts
+    the limit but doesn't enforce it, so there the budget does nothing.
+    '''
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if memory_budget_mb is None:
+        limit = hard
+    else:
+        limit = memory_budget_mb * 1024 * 1024
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def run_state(state_input, seed=2023, allowed_deviation=None, swap_steps=5,
+              method='dart', ntrials=0, model=None, memory_budget_mb=None, quiet=True,
+              balancer='swap', milp_seconds=0, lean=False):
+    '''
+    Runs every pipeline stage for one state. Meant to run in a worker process.
+
+    Inputs:
+        -state_input (str): 2-letter postal code of a supported state
+        -seed (int): seed for drawing the map
+        -allowed_deviation (int): population deviation to balance down to.
+        If None, a tenth of the target district population, like app.run
+        -swap_steps (int): most repeated_pop_swap cycles (or flow balancing
+        passes); 0 skips balancing
+        -method (str): 'dart' or 'multilevel', as in batch.run_plan
+        -ntrials (int): trials for the seat-share model; 0 skips prediction
+        -model: regression model trained once by the caller, if any
+        -memory_budget_mb (int): address space limit for this worker
+        -quiet (boolean): send the pipeline's progress messages to stderr
+        -balancer (str): 'swap' or 'flow', as in batch.run_plan
+        -milp_seconds (float): time for the MILP finishing stage, as in
+        batch.run_plan; 0 skips it
+        -lean (boolean): load the state with load_state(lean=True)
+
+    Returns (dict): JSON-serializable record with each stage's time, the
+    district results and the prediction, or the error that stopped it
+    '''
+    from load_state_data import load_state, make_adjacency_matrix, memory_footprint
+    from draw_random_maps import draw_dart_throw_map, repeated_pop_swap, population_deviation, target_dist_pop, dissolve_map
+    from simplified_geometry import DISPLAY_RESOLUTION
+    from multilevel import draw_multilevel_map
+    from flow_balance import flow_balance
+    from milp_balance import milp_balance
+    from regression import predict_state_voteshare
+
+    set_memory_budget(memory_budget_mb)
+    record = {'state': state_input, 'seed': seed, 'method': method, 'balancer': balancer,
+              'pid': os.getpid(), 'seconds': {}}
+    chatter = contextlib.redirect_stdout(sys.stderr) if quiet else contextlib.nullcontext()
+    stage = None
+    try:
+        with chatter:
+            stage = 'load'
+            start = time.perf_counter()
+            df = load_state(state_input, lean=lean)
+            record['seconds'][stage] = round(time.perf_counter() - start, 3)
+            record['precincts'] = len(df)
+            record['memory_mb'] = round(memory_footprint(df) / 2**20, 1)
+            num_districts = SUPPORTED_STATES[state_input]['num_districts']
+            target_pop = target_dist_pop(df, num_districts)
+            if allowed_deviation is None:
+                allowed_deviation = target_pop // 10
+
+            stage = 'draw'
+            start = time.perf_counter()
+            adjacency = None
+            if method == 'multilevel' or balancer == 'flow' or milp_seconds > 0:
+                adjacency = make_adjacency_matrix(df)
+            if method == 'multilevel':
+                draw_multilevel_map(df, adjacency, num_districts,
+                                    seed=seed, allowed_deviation=allowed_deviation)
+            else:
+                draw_dart_throw_map(df, num_districts, seed=seed)
+            record['seconds'][stage] = round(time.perf_counter() - start, 3)
+
+            stage = 'balance'
+            start = time.perf_counter()
+            if swap_steps > 0 and population_deviation(df) > allowed_deviation:
+                if balancer == 'flow':
+                    flow_balance(df, adjacency, allowed_deviation=allowed_deviation,
+                                 max_passes=swap_steps)
+                else:
+                    repeated_pop_swap(df, allowed_deviation=allowed_deviation,
+                                      plot_each_step=False, stop_after=swap_steps)
+            if milp_seconds > 0 and population_deviation(df) > allowed_deviation:
+                milp_balance(df, adjacency, allowed_deviation=allowed_deviation,
+                             time_limit=milp_seconds)
+            record['seconds'][stage] = round(time.perf_counter() - start, 3)
+            deviation = population_deviation(df)
+
+            stage = 'dissolve'
+            start = time.perf_counter()
+            df_dists = dissolve_map(df, resolution=DISPLAY_RESOLUTION)
+            record['seconds'][stage] = round(time.perf_counter() - start, 3)
+
+            prediction = None
+            if ntrials > 0:
+                stage = 'predict'
+                start = time.perf_counter()
+                prediction = float(predict_state_voteshare(state_input, ntrials,
+                                                           gdf=df, model=model))
+                record['seconds'][stage] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        #MemoryError included, when the state goes over its budget
+        record['error'] = repr(e)
+        record['failed_stage'] = stage
+        return record
+
+    d_seats = int((df_dists['point_swing'] > 0).sum())
+    record.update({'num_districts': num_districts,
+                   'target_pop': target_pop,
+                   'allowed_deviation': allowed_deviation,
+                   'pop_deviation': deviation,
+                   'balanced': deviation <= allowed_deviation,
+                   'district_pops': [int(p) for p in df_dists['POP100']],
+                   'point_swing': [float(s) for s in df_dists['point_swing']],
+                   'd_seats': d_seats,
+                   'r_seats': num_districts - d_seats,
+                   'predicted_majority_seatshare': prediction})
+    return record
+
+
+def run_pool(states, max_workers, state_args, results, total):
+    '''
+    Runs run_state for each state in one pool of worker processes.
+
+    Inputs:
+        -states (list of str): postal codes, in the order to start them
+        -max_workers (int): size of the pool
+        -state_args (tuple): run_state's arguments after state_input
+        -results (dict): records by state, filled in as states finish
+        -total (int): number of states in the whole run, for progress messages
+
+    Returns (list of str): states that didn't finish because the pool broke
+    '''
+    broken = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(run_state, state_input, *state_args): state_input
+                   for state_input in states}
+        for future in as_completed(futures):
+            state_input = futures[future]
+            try:
+                record = future.result()
+            except BrokenProcessPool:
+                broken.append(state_input)
+                continue
+            results[state_input] = record
+            status = 'failed' if 'error' in record else 'done'
+            print(f"{state_input} {status} ({len(results)} of {total})", file=sys.stderr)
+    return [s for s in states if s in broken]
+
+
+def run_pipeline(states=None, seed=2023, max_workers=None, memory_budget_mb=None,
+                 allowed_deviation=None, swap_steps=5, method='dart', ntrials=0,
+                 quiet=True, balancer='swap', milp_seconds=0, lean=False):
+    '''
+    Runs run_state for each state in a pool of worker processes, largest
+    state first.
+
+    Inputs:
+        -states (list of str): postal codes; defaults to every supported state
+        -seed (int): seed for every state's map
+        -max_workers (int): most states running at once. Defaults to the
+        number of CPUs, but never more than the number of states
+        -memory_budget_mb (int): per-state memory budget (see
+        set_memory_budget). None for no limit
+        -allowed_deviation, swap_steps, method, ntrials, balancer,
+        milp_seconds, lean: see run_state
+        -quiet (boolean): see run_state
+
+    Returns (dict): summary with one record per state (in the order they
+    were scheduled) plus totals. If a worker is killed outright, the states
+    that hadn't finished are rerun, each in its own pool, and a state whose
+    worker is killed again fails at 'worker killed'
+    '''
+    states = [s.upper() for s in (states or SUPPORTED_STATES)]
+    unknown = [s for s in states if s not in SUPPORTED_STATES]
+    states = schedule([s for s in states if s in SUPPORTED_STATES])
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(states)))
+
+    start = time.perf_counter()
+    model = None
+    if ntrials > 0:
+        from regression import create_linear_model
+        chatter = contextlib.redirect_stdout(sys.stderr) if quiet else contextlib.nullcontext()
+        with chatter:
+            model = create_linear_model(ntrials)
+
+    results = {}
+    state_args = (seed, allowed_deviation, swap_steps, method, ntrials, model,
+                  memory_budget_mb, quiet, balancer, milp_seconds, lean)
+    broken = run_pool(states, max_workers, state_args, results, len(states))
+    #a worker killed outright (e.g. by the OS for memory) breaks the whole
+    #pool, and every state it hadn't finished, started or not, fails with it.
+    #Rerun those one to a pool, so only a state whose own worker is killed fails
+    for state_input in broken:
+        if run_pool([state_input], 1, state_args, results, len(states)):
+            results[state_input] = {'state': state_input, 'seed': seed,
+                                    'error': "worker process was killed (e.g. by the OS for memory)",
+                                    'failed_stage': 'worker killed'}
+            print(f"{state_input} failed: its worker was killed", file=sys.stderr)
+
+    records = [results[s] for s in states]
+    records += [{'state': s, 'error': "not a supported state"} for s in unknown]
+    return {'seed': seed,
+            'method': method,
+            'balancer': balancer,
+            'max_workers': max_workers,
+            'memory_budget_mb': memory_budget_mb,
+            'schedule': states,
+            'wall_seconds': round(time.perf_counter() - start, 3),
+            'failed': [r['state'] for r in records if 'error' in r],
+            'states': records}
+
+
+def format_summary(summary):
+    '''
+    Human-readable table of run_pipeline output.
+    '''
+    lines = [f"{'state':<6}{'precincts':>10}{'MB':>8}{'deviation':>11}{'D':>4}{'R':>4}"
+             + ''.join(f"{stage:>10}" for stage in PIPELINE_STAGES)]
+    for record in summary['states']:
+        if 'error' in record:
+            lines.append(f"{record['state']:<6}  failed at {record.get('failed_stage')}: {record['error']}")
+            continue
+        lines.append(f"{record['state']:<6}{record['precincts']:>10}{record['memory_mb']:>8}"
+                     f"{record['pop_deviation']:>11}"
+                     f"{record['d_seats']:>4}{record['r_seats']:>4}"
+                     + ''.join(f"{record['seconds'].get(stage, float('nan')):>10.2f}"
+                               for stage in PIPELINE_STAGES))
+    lines.append(f"{len(summary['states'])} states in {summary['wall_seconds']:.1f}s "
+                 f"with {summary['max_workers']} workers")
+    return '\n'.join(lines)
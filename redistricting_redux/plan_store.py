@@ -0,0 +1,279 @@
+'''
+Compact on-disk storage for large ensembles of plans.
+
+A plan is stored as its assignment vector (district of each unit, in the
+unit order of the state's GeoDataFrame/adjacency), not as a GeoDataFrame.
+Before storing, district labels are renumbered in order of first appearance
+(canonical_labels), so two plans that only differ by which number each
+district got are the same vector, hash the same, and are stored once.
+
+A store is a directory holding:
+    -plans.bin: one row of uint8 (uint16 above 255 districts) per distinct
+    plan, back to back and uncompressed, so all of them can be memory-mapped
+    as a (plans x units) matrix without reading or copying
+    -hashes.bin: the sha256 digest of each row, 32 bytes per plan
+    -counts.npy: how many times each distinct plan was added
+    -meta.json: number of units, dtype, and a digest of the GEOID20 order
+
+pack() writes a store to a single compressed .npz for moving or archiving;
+unpack() turns one back into a store directory.
+'''
+import hashlib
+import json
+import os
+import numpy as np
+
+META_FILE = "meta.json"
+PLANS_FILE = "plans.bin"
+HASHES_FILE = "hashes.bin"
+COUNTS_FILE = "counts.npy"
+HASH_SIZE = 32
+
+
+def canonical_labels(assignment):
+    '''
+    Renumbers districts 1, 2, 3... in order of their first unit, leaving 0
+    (unassigned) as is. Plans that are the same up to district numbering
+    come out identical.
+
+    Inputs:
+        -assignment (NumPy array of ints): district of each unit
+
+    Returns (NumPy array): relabeled copy, same dtype
+    '''
+    assignment = np.asarray(assignment)
+    labels, first = np.unique(assignment, return_index=True)
+    mapping = np.zeros(int(labels.max(initial=0)) + 1, dtype=assignment.dtype)
+    drawn = labels > 0
+    by_first = labels[drawn][np.argsort(first[drawn])]
+    mapping[by_first] = np.arange(1, len(by_first) + 1)
+    return mapping[assignment]
+
+
+def plan_hash(canonical):
+    '''
+    sha256 digest of a canonical plan's bytes.
+    '''
+    return hashlib.sha256(np.ascontiguousarray(canonical).tobytes()).digest()
+
+
+def geoid_digest(geoids):
+    '''
+    Short digest of the unit order, so plans are never read against a
+    differently ordered GeoDataFrame.
+    '''
+    return hashlib.sha256('\n'.join(map(str, geoids)).encode()).hexdigest()[:16]
+
+
+class PlanStore:
+    '''
+    Append-only, deduplicated store of plans in a directory. Use as a
+    context manager, or call close() when done adding, so counts and
+    metadata are written.
+
+    Inputs:
+        -store_dir (str): directory of the store; created if missing
+        -num_units (int): units per plan. Required for a new store
+        -max_districts (int): largest number of districts a plan will have,
+        which picks uint8 or uint16 for a new store
+        -geoids (array-like of str): GEOID20 of each unit, in plan order. If
+        given, it's recorded for a new store and checked for an existing one
+    '''
+
+    def __init__(self, store_dir, num_units=None, max_districts=255, geoids=None):
+        self.store_dir = store_dir
+        meta_fp = os.path.join(store_dir, META_FILE)
+        digest = geoid_digest(geoids) if geoids is not None else None
+        if os.path.exists(meta_fp):
+            with open(meta_fp) as f:
+                meta = json.load(f)
+            assert num_units is None or num_units == meta['num_units'], \
+                f"Store {store_dir} holds plans of {meta['num_units']} units, not {num_units}"
+            assert digest is None or meta['geoids'] in (None, digest), \
+                f"Store {store_dir} was built with a different GEOID20 order"
+            self.num_units = meta['num_units']
+            self.dtype = np.dtype(meta['dtype'])
+            self.geoids = meta['geoids']
+        else:
+            assert num_units is not None, "num_units is required to create a new store"
+            os.makedirs(store_dir, exist_ok=True)
+            self.num_units = int(num_units)
+            self.dtype = np.dtype(np.uint8 if max_districts <= 255 else np.uint16)
+            self.geoids = digest
+
+        hashes_fp = os.path.join(store_dir, HASHES_FILE)
+        hashes = b''
+        if os.path.exists(hashes_fp):
+            with open(hashes_fp, 'rb') as f:
+                hashes = f.read()
+        self._index = {hashes[i:i + HASH_SIZE]: i // HASH_SIZE
+                       for i in range(0, len(hashes), HASH_SIZE)}
+        counts_fp = os.path.join(store_dir, COUNTS_FILE)
+        self.counts = list(np.load(counts_fp)) if os.path.exists(counts_fp) else []
+        #plans added since counts were last written have a count of 1
+        self.counts += [1] * (len(self._index) - len(self.counts))
+
+        self._plans = open(os.path.join(store_dir, PLANS_FILE), 'ab')
+        self._hashes = open(hashes_fp, 'ab')
+        self._write_meta()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_meta(self):
+        with open(os.path.join(self.store_dir, META_FILE), 'w') as f:
+            json.dump({'num_units': self.num_units, 'dtype': self.dtype.name,
+                       'geoids': self.geoids}, f)
+
+    def _canonical(self, assignment):
+        '''
+        canonical_labels of a plan, in the store's dtype. A plan with more
+        districts than that dtype holds fails rather than wrapping around.
+        '''
+        canonical = canonical_labels(assignment)
+        assert canonical.max(initial=0) <= np.iinfo(self.dtype).max, \
+            f"Plan has {canonical.max()} districts, more than a {self.dtype.name} store holds"
+        return canonical.astype(self.dtype)
+
+    def add(self, assignment):
+        '''
+        Adds a plan, unless the same plan (up to district numbering) is
+        already stored, in which case its count goes up.
+
+        Inputs:
+            -assignment (NumPy array of ints): district of each unit
+
+        Returns (tuple): (row of the plan in the store, True if it was new)
+        '''
+        assert len(assignment) == self.num_units, \
+            f"Plan has {len(assignment)} units, store expects {self.num_units}"
+        canonical = self._canonical(assignment)
+        digest = plan_hash(canonical)
+        row = self._index.get(digest)
+        if row is not None:
+            self.counts[row] += 1
+            return row, False
+        row = len(self._index)
+        self._plans.write(canonical.tobytes())
+        self._hashes.write(digest)
+        self._index[digest] = row
+        self.counts.append(1)
+        return row, True
+
+    def add_df(self, df):
+        '''
+        Adds the plan in a GeoDataFrame's dist_id column.
+        '''
+        from graph_maps import assignment_from_df
+        return self.add(assignment_from_df(df))
+
+    def find(self, assignment):
+        '''
+        Row of a plan in the store, or None if it isn't stored.
+        '''
+        return self._index.get(plan_hash(self._canonical(assignment)))
+
+    def flush(self):
+        '''
+        Writes buffered plans, hashes and the counts to disk.
+        '''
+        self._plans.flush()
+        self._hashes.flush()
+        np.save(os.path.join(self.store_dir, COUNTS_FILE),
+                np.asarray(self.counts, dtype=np.int64))
+
+    def close(self):
+        if self._plans.closed:
+            return
+        self.flush()
+        self._plans.close()
+        self._hashes.close()
+
+    def plans(self):
+        '''
+        Every stored plan as a read-only (plans x units) matrix, memory-mapped
+        from plans.bin: nothing is read until it's used.
+
+        Returns (NumPy memmap)
+        '''
+        self._plans.flush()
+        return read_plans(self.store_dir)
+
+    def hashes(self):
+        '''
+        sha256 digest of each stored plan, in row order.
+        '''
+        self._hashes.flush()
+        return list(self._index)
+
+
+def read_plans(store_dir):
+    '''
+    Memory-maps a store's plans as a read-only (plans x units) matrix, without
+    opening the store for writing.
+
+    Returns (NumPy memmap)
+    '''
+    with open(os.path.join(store_dir, META_FILE)) as f:
+        meta = json.load(f)
+    dtype = np.dtype(meta['dtype'])
+    fp = os.path.join(store_dir, PLANS_FILE)
+    num_plans = os.path.getsize(fp) // (meta['num_units'] * dtype.itemsize)
+    if num_plans == 0:
+        return np.empty((0, meta['num_units']), dtype=dtype)
+    return np.memmap(fp, dtype=dtype, mode='r', shape=(num_plans, meta['num_units']))
+
+
+def read_counts(store_dir):
+    '''
+    How many times each of a store's plans was added, in row order.
+    '''
+    fp = os.path.join(store_dir, COUNTS_FILE)
+    return np.load(fp) if os.path.exists(fp) else np.ones(len(read_plans(store_dir)), dtype=np.int64)
+
+
+def pack(store_dir, fp):
+    '''
+    Writes a whole store to one compressed .npz file.
+
+    Inputs:
+        -store_dir (str): store directory
+        -fp (str): output filepath
+
+    Returns: None, writes fp
+    '''
+    with open(os.path.join(store_dir, META_FILE)) as f:
+        meta = json.load(f)
+    with open(os.path.join(store_dir, HASHES_FILE), 'rb') as f:
+        hashes = np.frombuffer(f.read(), dtype=np.uint8).reshape(-1, HASH_SIZE)
+    np.savez_compressed(fp, plans=read_plans(store_dir), hashes=hashes,
+                        counts=read_counts(store_dir), meta=np.array(json.dumps(meta)))
+
+
+def unpack(fp, store_dir):
+    '''
+    Turns a file written by pack() back into a store directory, checking
+    every plan against its hash on the way.
+
+    Returns (str): store_dir
+    '''
+    with np.load(fp) as data:
+        plans, hashes, counts = data['plans'], data['hashes'], data['counts']
+        meta = json.loads(str(data['meta']))
+    for row, digest in zip(plans, hashes):
+        assert plan_hash(row) == digest.tobytes(), f"{fp} is corrupted"
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, PLANS_FILE), 'wb') as f:
+        f.write(np.ascontiguousarray(plans).tobytes())
+    with open(os.path.join(store_dir, HASHES_FILE), 'wb') as f:
+        f.write(hashes.tobytes())
+    np.save(os.path.join(store_dir, COUNTS_FILE), counts)
+    with open(os.path.join(store_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    return store_dir
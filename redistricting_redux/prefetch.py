@@ -0,0 +1,110 @@
+'''
+Background work for the interactive app, so the slow parts of a run overlap
+with the time the user spends reading and answering prompts.
+
+As soon as app.run knows the state, it starts:
+    -loading the state's data in a background thread (start_state_load)
+    -generating regression training data, speculatively, in worker
+    processes (TrainingPrefetcher), before the user has said how many trials
+    they want. When they do, the rows already generated are reused and only
+    the rest are generated (also in parallel) before the model is fit.
+'''
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+#Speculative training data: up to SPECULATIVE_CHUNKS chunks of CHUNK_TRIALS
+#trials each, which covers the app's suggested default of 50-100 trials
+CHUNK_TRIALS = 25
+SPECULATIVE_CHUNKS = 4
+
+
+def _training_chunk(ntrials, seed):
+    #runs in a worker, which imports scikit-learn itself so the app doesn't
+    #have to wait for that import
+    from regression import generate_training_chunk
+    return generate_training_chunk(ntrials, seed)
+
+
+def _load_state(state_input):
+    #geopandas is imported in the loading thread too, not before it starts
+    from load_state_data import load_state
+    return load_state(state_input)
+
+
+def start_state_load(state_input):
+    '''
+    Starts load_state for a state in a background thread.
+
+    Returns (concurrent.futures.Future): .result() is the GeoDataFrame
+    '''
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="load_state")
+    future = pool.submit(_load_state, state_input)
+    #no more work will go to this pool; its thread exits once the load is done
+    pool.shutdown(wait=False)
+    return future
+
+
+class TrainingPrefetcher:
+    '''
+    Generates regression training data in the background, in chunks of
+    chunk_trials trials, then fits the model once the number of trials is
+    known.
+
+    Inputs:
+        -chunk_trials (int): trials per chunk
+        -speculative_chunks (int): chunks to start before the number of
+        trials is known
+        -max_workers (int): worker processes. Defaults to one less than the
+        number of CPUs, leaving one for the app itself
+    '''
+
+    def __init__(self, chunk_trials=CHUNK_TRIALS, speculative_chunks=SPECULATIVE_CHUNKS,
+                 max_workers=None):
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 2) - 1)
+        self.chunk_trials = chunk_trials
+        self.pool = ProcessPoolExecutor(max_workers=max_workers)
+        self.futures = []
+        self._submit(speculative_chunks)
+
+    def _submit(self, num_chunks):
+        for _ in range(num_chunks):
+            seed = random.SystemRandom().randrange(2**63)
+            self.futures.append(self.pool.submit(_training_chunk, self.chunk_trials, seed))
+
+    def training_data(self, ntrials):
+        '''
+        ntrials rows of training data, reusing every chunk started so far
+        and generating more chunks only if they don't add up to ntrials.
+
+        Returns (Pandas dataframe)
+        '''
+        import pandas as pd
+        missing = -(-ntrials // self.chunk_trials) - len(self.futures)
+        if missing > 0:
+            self._submit(missing)
+        #chunks that haven't started yet aren't needed
+        num_needed = -(-ntrials // self.chunk_trials)
+        for future in self.futures[num_needed:]:
+            future.cancel()
+        chunks = [future.result() for future in self.futures[:num_needed]]
+        return pd.concat(chunks, ignore_index=True).iloc[:ntrials]
+
+    def model(self, ntrials):
+        '''
+        Fits the regression model on ntrials trials, like
+        regression.create_linear_model, and shuts down the worker processes.
+
+        Returns (LinearRegression object)
+        '''
+        from regression import fit_linear_model
+        df = self.training_data(ntrials)
+        self.shutdown()
+        return fit_linear_model(df)
+
+    def shutdown(self):
+        '''
+        Stops any chunks that haven't started and releases the workers.
+        '''
+        self.pool.shutdown(wait=False, cancel_futures=True)
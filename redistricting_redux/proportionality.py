@@ -6,6 +6,7 @@ import random
 import numpy as np
 import math
 from statistics import mean
+from scipy.special import betaincinv
 
 #CONSTANTS
 
@@ -16,7 +17,25 @@ MIN_MEAN = 0.3
 MAX_MEAN = 0.7
 MAX_VARIANCE = 0.1
 
-def generate_voteshares(mean_voteshare, var, district_size, num_districts):
+def beta_parameters(mean_voteshare, var):
+    '''
+    Computes the alpha and beta parameters of the beta distribution with the
+    given mean and variance.
+    Inputs:
+        mean_voteshare (float): the desired mean voteshare
+        var (float): the desired variance of the voteshares
+    Returns:
+        (alpha, beta) (tuple of floats)
+    '''
+    #The formulas to compute alpha and beta of the beta distribution were found
+    #here: https://stats.stackexchange.com/questions/12232/calculating-the-parameters-of-a-beta-distribution-using-the-mean-and-variance
+    alpha = ((1 - mean_voteshare) / var - 1 / mean_voteshare) * \
+        mean_voteshare ** 2
+    beta = alpha * (1 / mean_voteshare - 1)
+    return (alpha, beta)
+
+def generate_voteshares(mean_voteshare, var, district_size, num_districts, \
+        uniforms = None):
     '''
     Generate a list of voteshares which comprise a state. Each voteshare
     generated represents a VTD, or voting district. The voteshares are 
@@ -26,6 +45,11 @@ def generate_voteshares(mean_voteshare, var, district_size, num_districts):
         var (float): the desired variance of the voteshares
         district_size (int): the side length of a district
         num_districts (int): the number of districts (must be a perfect square)
+        uniforms (NumPy array of floats): if given, one uniform(0, 1) draw
+            per VTD, turned into voteshares by the beta distribution's
+            inverse CDF instead of drawing new ones. Grids made from the same
+            uniforms at different settings differ only because of the
+            settings
     Returns:
         voteshare_list (list of floats): a list of voteshares
     '''
@@ -38,11 +62,9 @@ def generate_voteshares(mean_voteshare, var, district_size, num_districts):
 
     num_vtds = (district_size ** 2) * num_districts
     voteshare_list = []
-    #The formulas to compute alpha and beta of the beta distribution were found
-    #here: https://stats.stackexchange.com/questions/12232/calculating-the-parameters-of-a-beta-distribution-using-the-mean-and-variance
-    alpha = ((1 - mean_voteshare) / var - 1 / mean_voteshare) * \
-        mean_voteshare ** 2
-    beta = alpha * (1 / mean_voteshare - 1)
+    alpha, beta = beta_parameters(mean_voteshare, var)
+    if uniforms is not None:
+        return list(betaincinv(alpha, beta, np.asarray(uniforms[:num_vtds])))
 
     for i in range(num_vtds):
         voteshare_list.append(random.betavariate(alpha, beta))
@@ -111,7 +133,8 @@ def mean_neighbor(cluster_dict, neighbors_index_dict, index):
         return mean(neighbors)
     return False
 
-def generate_clustered_grid(voteshare_list, district_size, num_districts):
+def generate_clustered_grid(voteshare_list, district_size, num_districts, \
+        rng = None):
     """
     Given a list of voteshares, generates a square grid that represents a state,
     where VTDs with similar voteshares are more likely to be neighbors. 
@@ -122,6 +145,9 @@ def generate_clustered_grid(voteshare_list, district_size, num_districts):
         voteshare_list (list of floats): a list of voteshares
         district_size (int): the side length of a district
         num_districts (int): the number of districts (must be a perfect square)
+        rng (NumPy Generator): if given, the order VTDs are filled in and
+            the voteshares of VTDs with no filled neighbors are drawn from
+            it, instead of from the global random number generators
     Returns:
         grid (2D NumPy array): a square grid of voteshares
     """
@@ -135,7 +161,10 @@ def generate_clustered_grid(voteshare_list, district_size, num_districts):
     cluster_dict = {x:[None, None] for x in index_list}
 
     #We randomize the order that we assign voteshares to indexes.
-    np.random.shuffle(index_list)
+    if rng is None:
+        np.random.shuffle(index_list)
+    else:
+        rng.shuffle(index_list)
     for i in index_list:
         mean_neighb = mean_neighbor(cluster_dict, neighbors_index_d, i)
         if mean_neighb:
@@ -145,7 +174,10 @@ def generate_clustered_grid(voteshare_list, district_size, num_districts):
             voteshare_index = round(mean_neighb * (remaining - 1))
         else:
             #If the index has no neighbors, we randomly choose a value.
-            voteshare_index = random.randint(0, remaining - 1)
+            if rng is None:
+                voteshare_index = random.randint(0, remaining - 1)
+            else:
+                voteshare_index = int(rng.integers(0, remaining))
         
         cluster_dict[i][0] = sorted_voteshares[voteshare_index]
         cluster_dict[i][1] = ranks[cluster_dict[i][0]] / len(voteshare_list)
@@ -195,9 +227,22 @@ def calculate_district_voteshares(grid, num_districts):
     return (district_voteshares, num_districts_won)
 
 def simulate_data(mean_voteshare, var, district_size, num_districts, \
-        cluster = True):
+        cluster = True, seed = None, antithetic = False, stratified = False):
     '''
     Generates a grid and counts the percentage of districts won.
+
+    With a seed, every random number the simulation uses comes from it: the
+    VTDs' voteshares are made from one uniform draw each (see
+    generate_voteshares), and the clustered grid's filling order from the
+    same generator. Simulating different settings with the same seed uses
+    common random numbers, so the results differ mostly because of the
+    settings and not because of chance. With antithetic, the grid is also
+    made a second time from the opposite uniforms (1 - u), which puts each
+    high voteshare where the first grid had a low one, and the results of
+    the two (negatively correlated) grids are averaged. With stratified,
+    the uniform draws are stratified: the i-th smallest of the n VTDs' draws
+    falls between (i - 1) / n and i / n, so the grid's voteshares follow the
+    beta distribution closely and its mean voteshare hardly varies by chance.
     Inputs:
         mean_voteshare (float): the desired mean voteshare
         var (float): the desired variance of the voteshares
@@ -205,16 +250,52 @@ def simulate_data(mean_voteshare, var, district_size, num_districts, \
         num_districts (int): the number of districts (must be a perfect square)
         cluster (bool): generates clustered grids if True, otherwise generates
             random grids
+        seed (int): seed for the simulation's own random number generator.
+            If None (and neither antithetic nor stratified), the global ones are
+            used
+        antithetic (bool): average over an antithetic pair of grids
+        stratified (bool): draw the voteshares stratified
     Returns:
         tuple of 2 values:
             per_districts_won (float): the percentage of districts won
             cluster_score (float): the clustering score for the grid
     '''
+    if seed is None and not antithetic and not stratified:
+        return simulate_grid(mean_voteshare, var, district_size, num_districts, \
+            cluster)
+
+    if seed is None:
+        seed = np.random.randint(2**32)
+    rng = np.random.default_rng(seed)
+    num_vtds = (district_size ** 2) * num_districts
+    uniforms = rng.random(num_vtds)
+    if stratified:
+        uniforms = (rng.permutation(num_vtds) + uniforms) / num_vtds
+    order_seed = int(rng.integers(2**63))
+    draws = [uniforms, 1 - uniforms] if antithetic else [uniforms]
+    results = [simulate_grid(mean_voteshare, var, district_size, num_districts, \
+        cluster, uniforms = draw, rng = np.random.default_rng(order_seed))
+        for draw in draws]
+    return (mean(r[0] for r in results), mean(r[1] for r in results))
+
+def simulate_grid(mean_voteshare, var, district_size, num_districts, \
+        cluster = True, uniforms = None, rng = None):
+    '''
+    Generates one grid and counts the percentage of districts won, for
+    simulate_data.
+    Inputs:
+        mean_voteshare, var, district_size, num_districts, cluster: see
+            simulate_data
+        uniforms (NumPy array of floats): see generate_voteshares
+        rng (NumPy Generator): see generate_clustered_grid
+    Returns:
+        tuple of 2 values: see simulate_data
+    '''
     voteshare_list = generate_voteshares(mean_voteshare, var, \
-        district_size, num_districts)
+        district_size, num_districts, uniforms)
     if cluster:
         grid = generate_clustered_grid(voteshare_list, district_size, \
-            num_districts)
+            num_districts, rng)
     else:
         grid = generate_random_grid(voteshare_list, district_size, \
             num_districts)
@@ -290,4 +371,39 @@ def clustering_score(neighbors_d):
 
         mean_deviations.append(mean(deviations))
 
-    return mean(mean_deviations)
\ No newline at end of file
+    return mean(mean_deviations)
+
+def sparse_clustering_score(adjacency, voteshares):
+    """
+    Same measure as clustering_score, but computed directly from a sparse
+    adjacency matrix instead of a dictionary keyed by voteshare, so VTDs with
+    identical voteshares don't collide. VTDs with a NaN voteshare are dropped,
+    along with any neighbor entries pointing at them; VTDs left with no
+    neighbors don't count towards the score.
+    Inputs:
+        adjacency (scipy sparse matrix): n x n matrix where entry (i, j) is
+            nonzero if VTD j is a neighbor of VTD i
+        voteshares (NumPy array of floats): voteshare of each of the n VTDs
+    Outputs:
+        clustering_score (float): a measure of how clustered voters are within
+            the state, or NaN if no VTD has a valid neighbor
+    """
+    voteshares = np.asarray(voteshares, dtype=np.float64)
+    edges = adjacency.tocoo()
+    rows, cols = edges.row, edges.col
+
+    valid = ~np.isnan(voteshares)
+    keep = valid[rows] & valid[cols]
+    rows, cols = rows[keep], cols[keep]
+
+    sq_deviations = (voteshares[cols] - voteshares[rows]) ** 2
+    num_vtds = len(voteshares)
+    deviation_sums = np.bincount(rows, weights=sq_deviations, minlength=num_vtds)
+    neighbor_counts = np.bincount(rows, minlength=num_vtds)
+
+    has_neighbors = neighbor_counts > 0
+    if not has_neighbors.any():
+        return float("nan")
+    mean_deviations = deviation_sums[has_neighbors] / neighbor_counts[has_neighbors]
+
+    return float(mean_deviations.mean())
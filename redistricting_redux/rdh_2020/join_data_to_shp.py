@@ -1,56 +1,123 @@
 # Author: Sarik Goyal
 
+import os
+import sys
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from zipfile import ZipFile
 import rdh_api
 
-def get_merged_data(states, username, password):
+#load_state_data lives one directory up, with the rest of the package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from load_state_data import build_adjacency_matrix, save_adjacency, adjacency_filepath
+from compactness import compute_geometry_features, save_geometry_features, features_filepath
+from simplified_geometry import simplify_geometries, save_simplified_geometries, simplified_filepath
+
+#Only these columns are read from each file; everything else is skipped
+#while parsing instead of being loaded and thrown away
+ELECTION_DTYPES = {"GEOID20": str, "G20PREDBID": np.float64, "G20PRERTRU": np.float64}
+CENSUS_DTYPES = {"GEOID20": str, "POP100": np.int32}
+SHP_COLUMNS = ["GEOID20"]
+OUTPUT_DIR = "redistricting_redux/merged_shps"
+
+def merged_filepath(state, output_dir=OUTPUT_DIR):
     """
-    Adds election and population data to a VTD boundaries shapefile. Adds the
-    new shapefile with the merged data to the working directory.
-    
+    Where the merged GeoParquet file for a state goes (load_state reads it
+    from here).
+    """
+    return f"{output_dir}/{state.upper()}_VTD_merged.parquet"
+
+def ingest_state(state, data_dir=".", output_dir=OUTPUT_DIR):
+    """
+    Joins one state's downloaded election and population data onto its VTD
+    boundaries, then writes, in one pass: the merged GeoParquet file, the
+    neighbors csv, the cached adjacency matrix, and the cached geometric
+    features used by compactness.py.
+
     Inputs:
-        states (list of strings): a list of state abbreviations for which we
-            would like to collect data - not case sensitive
-        username (str): the username of the API user
-        password (str): the password of the API user
+        state (str): state abbreviation - not case sensitive
+        data_dir (str): directory the RDH zip files were downloaded to
+        output_dir (str): directory to write the merged files to
+
+    Returns (str): path of the merged GeoParquet file
     """
-    rdh_api.run(states = states, username_or_email = username, password = password)
+    state = state.lower()
+    shp_filename = f"{data_dir}/{state}_vtd_2020_bound_shp.zip"
+    election_filekey = state + "_2020_2020_vtd"
+    election_zip = f"{data_dir}/{election_filekey}_csv.zip"
+    election_csv = election_filekey + "/" + election_filekey + ".csv"
+    census_filekey = state + "_pl2020_vtd"
+    census_zip = f"{data_dir}/{census_filekey}_csv.zip"
+    census_csv = census_filekey + ".csv"
 
-    for state in states:
+    gdf = gpd.read_file(shp_filename, columns=SHP_COLUMNS).set_index("GEOID20")
 
-        state = state.lower()
-        shp_filename = state + "_vtd_2020_bound_shp.zip"
-        election_filekey = state + "_2020_2020_vtd"
-        election_zip = election_filekey + "_csv.zip"
-        election_csv = election_filekey + "/" + election_filekey + ".csv"
-        census_filekey = state + "_pl2020_vtd"
-        census_zip = census_filekey + "_csv.zip"
-        census_csv = census_filekey + ".csv"
+    #stream the csvs straight out of the zips, parsing only the needed columns
+    with ZipFile(election_zip) as e_zipfile, e_zipfile.open(election_csv) as f:
+        election_data = pd.read_csv(f, usecols=list(ELECTION_DTYPES),
+                                    dtype=ELECTION_DTYPES, index_col="GEOID20")
+    with ZipFile(census_zip) as c_zipfile, c_zipfile.open(census_csv) as f:
+        census_data = pd.read_csv(f, usecols=list(CENSUS_DTYPES),
+                                  dtype=CENSUS_DTYPES, index_col="GEOID20")
 
-        gdf = gpd.read_file(shp_filename)
+    #one index join instead of two merges that each copy the whole frame
+    final_gdf = gdf.join([census_data, election_data], how="inner").reset_index()
+    final_gdf = final_gdf[["POP100", "GEOID20", "G20PREDBID", "G20PRERTRU", "geometry"]]
 
-        e_zipfile = ZipFile(election_zip)
-        election_data = pd.read_csv(e_zipfile.open(election_csv))
+    state = state.upper()
+    os.makedirs(output_dir, exist_ok=True)
+    merged_fp = merged_filepath(state, output_dir)
+    final_gdf.to_parquet(merged_fp)
 
-        c_zipfile = ZipFile(census_zip)
-        census_data = pd.read_csv(c_zipfile.open(census_csv))
-        census_data = census_data[["POP100", "GEOID20"]]
+    #neighbors, in the same row order as the parquet file
+    adjacency = build_adjacency_matrix(final_gdf)
+    save_adjacency(adjacency, adjacency_filepath(state, "vtd"))
+    save_geometry_features(compute_geometry_features(final_gdf, adjacency),
+                           features_filepath(state, "vtd"))
+    save_simplified_geometries(simplify_geometries(final_gdf),
+                               simplified_filepath(state, "vtd"))
+    geoids = final_gdf["GEOID20"].to_numpy().astype(str)
+    indptr, indices = adjacency.indptr, adjacency.indices
+    pd.Series([geoids[indices[indptr[i]:indptr[i + 1]]] for i in range(len(final_gdf))],
+              name="neighbors").to_csv(f"{output_dir}/{state}_2020_neighbors.csv")
 
-        add_election = gpd.GeoDataFrame(election_data.merge(gdf, on = "GEOID20"))
-        final_gdf = gpd.GeoDataFrame(census_data.merge(add_election, on = "GEOID20"))
+    print(f"{state}: {len(final_gdf)} VTDs merged and written to {merged_fp}")
+    return merged_fp
+
+def get_merged_data(states, username, password, max_workers=4, data_dir="."):
+    """
+    Adds election and population data to a VTD boundaries shapefile. Adds the
+    new GeoParquet file with the merged data, and its neighbors, to the
+    merged_shps directory. States are downloaded together and then merged in
+    parallel, up to max_workers at a time.
+
+    Inputs:
+        states (list of strings): a list of state abbreviations for which we
+            would like to collect data - not case sensitive
+        username (str): the username of the API user
+        password (str): the password of the API user
+        max_workers (int): states to merge at once
+        data_dir (str): directory to download the RDH files to
+
+    Returns (list of str): paths of the merged files
+    """
+    rdh_api.run(states = states, username_or_email = username, password = password,
+                max_workers = max_workers, out_dir = data_dir)
 
-        state = state.upper()
-        final_gdf.to_file(f"redistricting_redux/merged_shps/{state}_VTD_merged.shp")
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(states))) as pool:
+        merged = list(pool.map(ingest_state, states, [data_dir] * len(states)))
 
-        print("Data pulled and merged. Please check the merged_shps repository for the new shapefile")
+    print("Data pulled and merged. Please check the merged_shps repository for the new files")
+    return merged
 
 def run_api_pull():
-    state = input("Please enter a state's 2 letter abbreviation: ")
-    states = [state]
+    states = input("Please enter one or more states' 2 letter abbreviations, separated by commas: ")
+    states = [state.strip() for state in states.split(",") if state.strip()]
     username = input("Please enter the email account associated with the Redistricting Data Hub user: ")
     password = input("Please enter the user's password: ")
     get_merged_data(states, username, password)
 
-run_api_pull()
\ No newline at end of file
+if __name__ == "__main__":
+    run_api_pull()
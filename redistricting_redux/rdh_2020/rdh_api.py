@@ -24,31 +24,62 @@ states = None
 #'***Please note that if you would like to retrieve the official redistricting dataset for your state, please use "official" (no quotations) in your query. Not all states will produce an offical dataset.
 #You may search by file type as CSV or SHP.
 additional_filtering = None
-#Import the four libraries needed to run the script. If you do not have these, you may need to install.
+#Import the libraries needed to run the script. If you do not have these, you may need to install.
 import pandas as pd
 import requests
 import io
+import os
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 #Below is the baseurl used to retrieve the list of datasets on the website.
+#It can be pointed at a local server (e.g. for testing) by passing baseurl to run().
 baseurl = 'https://redistrictingdatahub.org/wp-json/download/list'
+#How many files/states are transferred at once, and how much of a file is held in memory at a time
+max_workers = 4
+chunk_size = 1024 * 1024
+"""This function makes one HTTP session to share across all requests, so connections are reused (and retried on
+transient server errors) instead of opening a new connection for every file.
+Optional Inputs: pool_size (int), the most connections kept open at once"""
+
+def make_session(pool_size=max_workers):
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 """This function retrieves a list of all datasets on the RDH site. In order to run, you must be an API user and registered with the RDH site.
+States are queried concurrently, up to max_workers at a time.
 Inputs: username (string), password (string)
-Optional Inputs: baseurl"""
+Optional Inputs: baseurl, session (requests.Session), max_workers (int)"""
 
-def get_list(username, password, states, baseurl=baseurl):
+def get_list(username, password, states, baseurl=baseurl, session=None, max_workers=max_workers):
     print('Retrieving list of datasets on RDH Website...')
     if type(states)!=type([]):
         states = [states]
-    dfs = []
-    for i in states:
+    #a session made here is closed here; a session passed in belongs to the caller
+    own_session = session is None
+    if own_session:
+        session = make_session(max_workers)
+    def get_state_list(i):
         params = {}
         params['username'] = username
         params['password'] = password
         params['format'] = 'csv'
         params['states'] = i
-        r = requests.get(baseurl, params=params)
-        data = r.content
+        r = session.get(baseurl, params=params)
+        return r.content
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            contents = list(pool.map(get_state_list, states))
+    finally:
+        if own_session:
+            session.close()
+    dfs = []
+    for data in contents:
         try:
             df = pd.read_csv(io.StringIO(data.decode('utf-8')))
         except:
@@ -107,11 +138,52 @@ def run_state_name(list_of_states):
         state = assign_fullname(i)
         new_list.append(state)
     return new_list
+"""This function streams one file to disk in chunks, so the whole file is never held in memory. Data goes to
+file_name + '.part' first and is renamed once complete; if a .part file is left over from an interrupted
+download, only the rest of the file is requested (if the server doesn't support that, it starts over).
+Inputs: session (requests.Session), url (string), params (dict), file_name (string)
+Output: file_name"""
+
+def download_file(session, url, params, file_name, chunk_size=chunk_size):
+    if os.path.exists(file_name):
+        print('Already have', file_name)
+        return file_name
+    part_name = file_name + '.part'
+    have = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+    headers = {'Range': f'bytes={have}-'} if have > 0 else {}
+    with session.get(url, params=params, headers=headers, stream=True) as response:
+        if response.status_code == 416:
+            #the partial file is already complete
+            os.replace(part_name, file_name)
+            return file_name
+        response.raise_for_status()
+        #206 means the server is sending just the rest of the file
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        with open(part_name, mode) as file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                file.write(chunk)
+    os.replace(part_name, file_name)
+    return file_name
 '''This function extracts the data that meets input specifications to the current working directory. In order to run, you must be an API user and registered with the RDH site.
+Files are downloaded concurrently, up to max_workers at a time, over one shared session.
 Inputs: username or email (string), password (string), states (string/list), additional_filtering (string)
-Output: N/A'''
-def get_data(username_or_email, password, states,additional_filtering):
-    df = get_list(username_or_email, password,states)
+Optional Inputs: baseurl, max_workers (int), out_dir (string)
+Output: list of downloaded file paths'''
+def get_data(username_or_email, password, states,additional_filtering, baseurl=baseurl, max_workers=max_workers, out_dir='.'):
+    session = make_session(max_workers)
+    try:
+        return fetch_data(session, username_or_email, password, states, baseurl=baseurl,
+                          max_workers=max_workers, out_dir=out_dir)
+    finally:
+        session.close()
+"""This function does the work of get_data over an open session (which it leaves open).
+Inputs: session (requests.Session), username or email (string), password (string), states (list)
+Optional Inputs: baseurl, max_workers (int), out_dir (string)
+Output: list of downloaded file paths"""
+def fetch_data(session, username_or_email, password, states, baseurl=baseurl, max_workers=max_workers, out_dir='.'):
+    df = get_list(username_or_email, password,states, baseurl=baseurl, session=session, max_workers=max_workers)
+    if df is None:
+        return
     #read in the list of data
     for i in df.columns:
         if 'Filter by state found 0 states or unknown states' in i:
@@ -147,13 +219,8 @@ def get_data(username_or_email, password, states,additional_filtering):
         new_urls.append(new)
     ftype = list(df['Format'])
     data = dict(zip(new_urls,ftype))
-    counter = 1
-    #iterate over all of the new urls and retrieve the data
+    jobs = []
     for i in new_urls:
-        print('Retrieving', str(counter), 'of',str(len(new_urls)),'files')
-        #get the data from the url and the params listed above
-        params.update({'datasetid':id_dict.get(i)})
-        response = requests.get(i,params)
         #get the file name of the dataset
         file_name = i.split('%2F')[-1]
         file_name = file_name.split('/')[-1]
@@ -169,13 +236,22 @@ def get_data(username_or_email, password, states,additional_filtering):
         if dtype in file_name_no_zip:
             dtype = ''
         file_name = file_name_no_zip+dtype+zipdot
+        #the same file can be listed more than once; only download it once
+        if any(file_name == os.path.basename(job[2]) for job in jobs):
+            continue
+        #each file gets its own copy of the params, since downloads run at the same time
+        jobs.append((i, dict(params, datasetid=id_dict.get(i)), os.path.join(out_dir, file_name)))
+    os.makedirs(out_dir, exist_ok=True)
+    def retrieve(job):
+        url, file_params, file_name = job
         print('Retrieving ', file_name)
-        #write the data
-        file = open(file_name, "wb")
-        file.write(response.content)
-        file.close()
-        counter = counter+1
+        return download_file(session, url, file_params, file_name)
+    print('Retrieving', str(len(jobs)), 'files,', str(max_workers), 'at a time')
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        written = list(pool.map(retrieve, jobs))
     print('\nDone extracting datasets to current working directory.')
     print('Please re-run to extract additional data.')
-def run(username_or_email = username_or_email,password = password,states=states,additional_filtering=additional_filtering):
-    get_data(username_or_email, password, states,additional_filtering)
\ No newline at end of file
+    return written
+def run(username_or_email = username_or_email,password = password,states=states,additional_filtering=additional_filtering,
+        baseurl=baseurl, max_workers=max_workers, out_dir='.'):
+    return get_data(username_or_email, password, states,additional_filtering, baseurl=baseurl, max_workers=max_workers, out_dir=out_dir)
\ No newline at end of file
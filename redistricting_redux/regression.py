@@ -6,9 +6,14 @@ import proportionality
 import load_state_data
 import stats
 import pandas as pd
+import numpy as np
+import os
 import random
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
+from scipy.stats import qmc
 from sklearn.linear_model import LinearRegression
+from instrumentation import phase
 
 # CONSTANTS
 
@@ -36,14 +41,56 @@ DEFAULT_NUM_DISTRICTS = 49
 
 DEFAULT_CLUSTER = True
 
+# Latin hypercube samples up to this many trials are also spread out as
+# evenly as possible across all of the parameters at once (see
+# latin_hypercube). This takes about a second for 1000 trials, and grows
+# with the square of the number of trials
+LHS_OPTIMIZE_LIMIT = 1000
+
+def latin_hypercube(ntrials, ndims):
+    """
+    Latin hypercube sample of the unit cube: each dimension is split into
+    ntrials equal strata and every stratum gets exactly one point, so the
+    parameters cover their ranges evenly instead of clumping by chance.
+    Up to LHS_OPTIMIZE_LIMIT points, the points are then shuffled between
+    strata to minimize their centered discrepancy, which also spreads them
+    evenly over combinations of parameters. Drawn with a seed from NumPy's
+    global generator, so seeding that (as generate_training_chunk does)
+    makes it reproducible.
+    Inputs:
+        ntrials (int): the number of points
+        ndims (int): the number of dimensions
+    Returns:
+        sample (2D NumPy array): ntrials x ndims values in [0, 1)
+    """
+    if ndims == 0:
+        return np.empty((ntrials, 0))
+    optimization = "random-cd" \
+        if 1 < ndims and ntrials <= LHS_OPTIMIZE_LIMIT else None
+    # seed= rather than rng=, which SciPy only accepts from 1.15
+    sampler = qmc.LatinHypercube(d = ndims, optimization = optimization, \
+        seed = np.random.randint(2**32))
+    return sampler.random(ntrials)
+
 def generate_training_data(ntrials, mean_voteshare = None, var = None, \
-    district_size = None, num_districts = None, cluster = None):
+    district_size = None, num_districts = None, cluster = None, \
+    sampling = "random", stratified = False, antithetic = False, \
+    common_random_numbers = False):
     """
     Generates several grids with varying parameters and creates a dataframe
     of the parameters and the resulting per_districts_won for each trial. The
     choices used for the ranges of the parameters are based on exploration of
     different options. The ultimate choices are somewhat arbitrary but the
     intent is to sample from a reasonably large space.
+
+    The other options trade independent random draws for ones whose errors
+    cancel out, so fewer grids give the same precision (see
+    proportionality.simulate_data for the last three). For the model
+    create_linear_model fits, "lhs" sampling and stratified grids together
+    give predictions about as precise as 4 times as many plain trials.
+    Antithetic pairs cost two grids per trial and don't beat twice as many
+    trials there, and common random numbers make the whole fit share one
+    grid's error; they are meant for comparing settings with each other.
     Inputs:
         ntrials (int): the number of grids to generate
         mean_voteshare (float), var (float), district_size (int),
@@ -51,39 +98,82 @@ def generate_training_data(ntrials, mean_voteshare = None, var = None, \
             values in order to only generate grids with the specified values, 
             otherwise randomly samples values with bounds defined in the above
             constants
+        sampling (str): "random" to sample each parameter independently, or
+            "lhs" for a Latin hypercube sample of the ones not set (see
+            latin_hypercube), in which half the trials are clustered
+        stratified (bool): draw every grid's voteshares stratified, so each
+            grid's voteshares follow the beta distribution closely
+        antithetic (bool): average each trial over an antithetic pair of
+            grids (twice the simulation time per trial)
+        common_random_numbers (bool): use the same random numbers for every
+            trial's grid
     Returns:
         df (Pandas dataframe): a dataframe that contains all of the generated
             data
     """
+    assert sampling in ("random", "lhs"), \
+        f"sampling must be 'random' or 'lhs', not {sampling!r}"
     data = {"per_districts_won":[], "mean_voteshare":[], "var":[], 
         "district_size":[], "num_districts":[], "clustering_score":[]}
 
+    if sampling == "lhs":
+        # One column of the sample for each parameter that isn't set
+        free = [name for name, value in [("mean_voteshare", mean_voteshare), \
+            ("var", var), ("district_size", district_size), \
+            ("num_districts", num_districts), ("cluster", cluster)] \
+            if not value]
+        sample = latin_hypercube(ntrials, len(free))
+        strata = [dict(zip(free, row)) for row in sample]
+    if common_random_numbers:
+        common_seed = np.random.randint(2**32)
+
     for i in range(ntrials):
         if mean_voteshare:
             mean_vshare = mean_voteshare
+        elif sampling == "lhs":
+            mean_vshare = MIN_VOTESHARE + \
+                strata[i]["mean_voteshare"] * (MAX_VOTESHARE - MIN_VOTESHARE)
         else:
             mean_vshare = random.uniform(MIN_VOTESHARE, MAX_VOTESHARE)
         if var:
             variance = var
+        elif sampling == "lhs":
+            variance = MIN_VAR + strata[i]["var"] * (MAX_VAR - MIN_VAR)
         else:
             variance = random.uniform(MIN_VAR, MAX_VAR)
         if district_size:
             dist_size = district_size
+        elif sampling == "lhs":
+            dist_size = MIN_DIST_SIZE + int(strata[i]["district_size"] * \
+                (MAX_DIST_SIZE - MIN_DIST_SIZE + 1))
         else:
             dist_size = random.randint(MIN_DIST_SIZE, MAX_DIST_SIZE)
         if num_districts:
             num_dists = num_districts
+        elif sampling == "lhs":
+            num_dists = (MIN_SQRT_NUM_DISTRICTS + \
+                int(strata[i]["num_districts"] * \
+                (MAX_SQRT_NUM_DISTRICTS - MIN_SQRT_NUM_DISTRICTS + 1))) ** 2
         else:
             num_dists = random.randint(MIN_SQRT_NUM_DISTRICTS, \
                 MAX_SQRT_NUM_DISTRICTS) ** 2
         if cluster:
             clustered = cluster
+        elif sampling == "lhs":
+            clustered = bool(strata[i]["cluster"] < 0.5)
         else:
             clustered = random.choice([True, False])
-        
+
+        if common_random_numbers:
+            seed = common_seed
+        elif stratified or antithetic:
+            seed = np.random.randint(2**32)
+        else:
+            seed = None
         per_districts_won, clustering_score = \
             proportionality.simulate_data(mean_vshare, variance, dist_size, \
-            num_dists, cluster = clustered)
+            num_dists, cluster = clustered, seed = seed, \
+            antithetic = antithetic, stratified = stratified)
         
         data["per_districts_won"].append(per_districts_won)
         data["mean_voteshare"].append(mean_vshare)
@@ -94,55 +184,130 @@ def generate_training_data(ntrials, mean_voteshare = None, var = None, \
 
     return pd.DataFrame(data)
 
-def create_plots(ntrials):
+# Parameters create_plots sweeps, one plot each, holding the rest at
+# PLOT_DEFAULTS (clustering_score is swept by drawing clustered and random
+# grids, through generate_training_data's cluster argument)
+PLOT_DEFAULTS = {"mean_voteshare": DEFAULT_VOTESHARE, "var": DEFAULT_VAR,
+    "district_size": DEFAULT_DIST_SIZE, "num_districts": DEFAULT_NUM_DISTRICTS,
+    "clustering_score": DEFAULT_CLUSTER}
+# Trials each worker simulates at a time
+SWEEP_CHUNK_TRIALS = 25
+
+def sweep_filepath(ntrials, seed):
+    return f"redistricting_redux/plots/sweep_{ntrials}_{seed}.csv"
+
+def generate_sweep_chunk(column, ntrials, seed):
+    """
+    Generates ntrials grids varying only one parameter, holding the others
+    at PLOT_DEFAULTS, after seeding both random number generators.
+    Inputs:
+        column (str): the parameter to vary, a key of PLOT_DEFAULTS
+        ntrials (int): the number of grids to generate
+        seed (int): seed for this chunk
+    Returns:
+        df (Pandas dataframe): as from generate_training_data, plus a "swept"
+            column naming the parameter that was varied
+    """
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    values = dict(PLOT_DEFAULTS, **{column: None})
+    df = generate_training_data(ntrials, mean_voteshare = values["mean_voteshare"], \
+        var = values["var"], district_size = values["district_size"], \
+        num_districts = values["num_districts"], cluster = values["clustering_score"])
+    df["swept"] = column
+    return df
+
+def generate_sweep(ntrials, seed = 0, max_workers = None):
+    """
+    Generates the data for every plot create_plots makes: ntrials grids for
+    each parameter in PLOT_DEFAULTS, all in one pool of worker processes,
+    SWEEP_CHUNK_TRIALS grids per task.
+    Inputs:
+        ntrials (int): the number of grids to generate for each parameter
+        seed (int): seed for the whole sweep
+        max_workers (int): worker processes (defaults to the number of CPUs)
+    Returns:
+        df (Pandas dataframe): as from generate_sweep_chunk, for every
+            parameter
+    """
+    tasks = [(column, min(SWEEP_CHUNK_TRIALS, ntrials - start))
+        for column in PLOT_DEFAULTS
+        for start in range(0, ntrials, SWEEP_CHUNK_TRIALS)]
+    seeds = np.random.SeedSequence(seed).generate_state(len(tasks), dtype=np.uint64)
+    with ProcessPoolExecutor(max_workers = max_workers) as pool:
+        chunks = list(pool.map(generate_sweep_chunk, *zip(*tasks), \
+            [int(s) for s in seeds]))
+    return pd.concat(chunks, ignore_index = True)
+
+def load_sweep(ntrials, seed = 0, max_workers = None, refresh = False):
+    """
+    generate_sweep's data, read from the csv it was saved to the last time
+    it was generated with the same ntrials and seed, if there is one, so
+    plots can be redrawn without simulating again.
+    Inputs:
+        ntrials, seed, max_workers: see generate_sweep
+        refresh (bool): simulate again even if there's a saved sweep
+    Returns:
+        df (Pandas dataframe): see generate_sweep
+    """
+    fp = sweep_filepath(ntrials, seed)
+    if not refresh and os.path.exists(fp):
+        return pd.read_csv(fp)
+    df = generate_sweep(ntrials, seed, max_workers)
+    df.to_csv(fp, index = False)
+    return df
+
+def plot_sweep(df, column):
+    """
+    Draws one of create_plots' scatter plots, on a headless backend so it
+    can run in a worker process.
+    Inputs:
+        df (Pandas dataframe): the rows of a sweep that varied column
+        column (str): the parameter that was varied
+    Returns:
+        filepath (str): where the plot was saved
+    """
+    plt.switch_backend("Agg")
+    fig, ax = plt.subplots()
+    ax.scatter(df[column], df["per_districts_won"])
+
+    title = f"How {column} affects per_districts_won, with"
+    for param, val in PLOT_DEFAULTS.items():
+        if val and param != column:
+            title += f" {param} = {val},"
+    # delete the trailing comma
+    title = title[:-1]
+    ax.set_title(title, wrap = True)
+    ax.set_xlabel(f"{column}")
+    ax.set_ylabel("per_districts_won")
+    filepath = f"redistricting_redux/plots/{column}.png"
+    fig.savefig(filepath)
+    plt.close(fig)
+    return filepath
+
+def create_plots(ntrials, seed = 0, max_workers = None, refresh = False):
     """
     Create plots exploring the relationships between each of the parameters
     individually and the percentage of districts won. As we explore each
     parameter individually, we hold the values of all of the other parameters
     constant. These constant values are designated by the default values
-    assigned at the top of the script.
+    assigned at the top of the script. The simulated data is saved (see
+    load_sweep), so changing how the plots look doesn't mean simulating
+    again, and the plots are drawn in parallel.
     Inputs:
         ntrials (int): the number of grids to generate, which is the number of
             datapoints on each plot
+        seed (int): seed for the simulations
+        max_workers (int): worker processes (defaults to the number of CPUs)
+        refresh (bool): simulate again even if there's saved data
     Returns:
-        Nothing, saves plots to redistricting_redux/plots
-    """
-    # We start by generating a dummy dataframe just to pull the column names in
-    # an efficient manner
-    dummy_df = generate_training_data(1)
-    for column in dummy_df.columns:
-
-        if column != "per_districts_won":
-
-            default_values = {"mean_voteshare": DEFAULT_VOTESHARE, \
-                "var": DEFAULT_VAR, \
-                "district_size": DEFAULT_DIST_SIZE, \
-                "num_districts": DEFAULT_NUM_DISTRICTS, \
-                "clustering_score": DEFAULT_CLUSTER}
-            # We set the default value of the parameter we're plotting to None
-            # in order to produce variation in this parameter.
-            default_values[f"{column}"] = None
-
-            df = generate_training_data(100, \
-                mean_voteshare = default_values["mean_voteshare"], \
-                var = default_values["var"], \
-                district_size = default_values["district_size"], \
-                num_districts = default_values["num_districts"], \
-                cluster = default_values["clustering_score"])
-
-            plt.scatter(df[[column]], df[["per_districts_won"]])
-
-            title = f"How {column} affects per_districts_won, with"
-            for param, val in default_values.items():
-                if val:
-                    title += f" {param} = {val},"
-            # delete the trailing comma
-            title = title[:-1]
-            plt.title(title, wrap = True)
-            plt.xlabel(f"{column}")
-            plt.ylabel("per_districts_won")
-            plt.savefig(f"redistricting_redux/plots/{column}.png")
-            plt.clf()
+        filepaths (list of str): the saved plots, in redistricting_redux/plots
+    """
+    df = load_sweep(ntrials, seed, max_workers, refresh)
+    with ProcessPoolExecutor(max_workers = max_workers) as pool:
+        futures = [pool.submit(plot_sweep, df[df["swept"] == column], column)
+            for column in PLOT_DEFAULTS]
+        return [future.result() for future in futures]
 
 # The results of running create_plots(100) can be found in the plots directory.
 
@@ -169,6 +334,7 @@ def create_plots(ntrials):
 # to our model's tendency to overpredict seats for the majority party, we chose
 # to adjust our default value to 2 for district_size.
 
+@phase("regression training")
 def create_linear_model(ntrials):
     """
     Creates a linear model where the first column of the dataframe is the
@@ -180,7 +346,18 @@ def create_linear_model(ntrials):
         model (LinearRegression object)
     """
     print("generating training data")
-    df = generate_training_data(ntrials, district_size = 2, num_districts = 49)
+    df = generate_training_data(ntrials, district_size = 2, num_districts = 49, \
+        sampling = "lhs", stratified = True)
+    return fit_linear_model(df)
+
+def fit_linear_model(df):
+    """
+    Fits the linear model on training data that has already been generated.
+    Inputs:
+        df (Pandas dataframe): output of generate_training_data
+    Returns:
+        model (LinearRegression object)
+    """
     X = df[["mean_voteshare", "var", "clustering_score"]]
     Y = df[["per_districts_won"]]
 
@@ -189,24 +366,50 @@ def create_linear_model(ntrials):
 
     return model
 
-def predict_state_voteshare(state, ntrials):
+def generate_training_chunk(ntrials, seed):
+    """
+    Generates ntrials rows of the training data create_linear_model uses,
+    after seeding both random number generators, so chunks generated in
+    separate worker processes don't repeat each other.
+    Inputs:
+        ntrials (int): the number of grids to generate
+        seed (int): seed for this chunk
+    Returns:
+        df (Pandas dataframe): as from generate_training_data
+    """
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    return generate_training_data(ntrials, district_size = 2, num_districts = 49, \
+        sampling = "lhs", stratified = True)
+
+def predict_state_voteshare(state, ntrials, gdf=None, model=None):
     """
     Predicts the expected partisan balance of a state based on our model.
     Inputs:
         state (str): the two-letter abbreviation of the state
         ntrials (int): the number of datapoints to generate - a larger number
             will result in a more accurate estimate at the expense of runtime
+        gdf (GeoPandas GeoDataFrame): the state's data, if it's already been
+            loaded - otherwise it is loaded from file
+        model (LinearRegression object): an already trained model to reuse,
+            in which case ntrials is ignored. An emulator.SeatShareEmulator
+            works here too, and its error bound is printed
     Returns:
-        Nothing - prints the expected partisan balance
+        prediction (float): the expected share of seats won by the majority
+            party (also printed)
     """
-    model = create_linear_model(ntrials)
+    if model is None:
+        model = create_linear_model(ntrials)
 
     print("applying model to state")
-    gdf = load_state_data.load_state(state)
-    neighbors_dict = load_state_data.make_neighbors_dict(gdf)
+    if gdf is None:
+        gdf = load_state_data.load_state(state)
+    adjacency = load_state_data.make_adjacency_matrix(gdf)
+    voteshares = load_state_data.dem_voteshares(gdf)
 
-    var = gdf["dem_voteshare"].var()
-    cluster_score = proportionality.clustering_score(neighbors_dict)
+    # ddof=1 matches the pandas .var() this used to be computed with
+    var = np.nanvar(voteshares, ddof=1)
+    cluster_score = proportionality.sparse_clustering_score(adjacency, voteshares)
     mean_vshare = stats.mean_voteshare(gdf)
     if mean_vshare > 0.5:
         maj_party = "Democrats"
@@ -221,4 +424,6 @@ def predict_state_voteshare(state, ntrials):
     prediction = min(prediction, 1)
     prediction = max(0.5, prediction)
     print(f"{maj_party} are expected to win {round(prediction * 100, 2)}% of the seats")
+    if getattr(model, "error_bound", None) is not None:
+        print(f"(within about {round(model.error_bound * 100, 1)} percentage points of what simulating it directly would give)")
     return prediction
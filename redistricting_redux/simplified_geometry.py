@@ -0,0 +1,142 @@
+'''
+Simplified precinct geometries for drawing maps.
+
+Full-resolution precinct polygons make plotting and dissolving slow for big
+states, with far more detail than a 300 dpi image can show. So each state's
+polygons are simplified once, at every tolerance in RESOLUTIONS, and cached
+next to the adjacency matrix. Simplification uses
+shapely.coverage_simplify, which simplifies each border two precincts share
+only once, the same way for both, so neighbors still meet exactly (no gaps
+or slivers) and dissolving them still gives clean districts.
+
+Only drawing uses these: dissolve_map and the plotting functions take a
+resolution, and look the simplified shapes up by the state load_state
+recorded in df.attrs. Populations and votes are summed as always, and
+compactness.py measures areas and perimeters from the exact shapes.
+'''
+from collections import OrderedDict
+import geopandas as gpd
+import shapely
+
+from compactness import EQUAL_AREA_CRS
+from plan_store import geoid_digest
+
+#Simplification tolerances, in meters (roughly the square root of the area
+#of the smallest bends kept)
+RESOLUTIONS = OrderedDict({'low': 500, 'medium': 100, 'high': 25})
+#Resolution the app and pipeline draw and dissolve maps at
+DISPLAY_RESOLUTION = 'medium'
+
+
+def simplified_filepath(state_input, level="vtd"):
+    return f"redistricting_redux/merged_shps/{state_input}_2020_{level}_simplified.parquet"
+
+
+def simplify_coverage(geoms, tolerance):
+    '''
+    Simplifies an array of polygons that tile a state together. Falls back on
+    simplifying each polygon on its own, which can leave small gaps between
+    neighbors, with shapely older than 2.1.
+
+    Inputs:
+        -geoms (NumPy array of shapely geometries)
+        -tolerance (float): in the geometries' units
+
+    Returns (NumPy array of shapely geometries)
+    '''
+    if hasattr(shapely, 'coverage_simplify'):
+        return shapely.coverage_simplify(geoms, tolerance)
+    return shapely.simplify(geoms, tolerance, preserve_topology=True)
+
+
+def simplify_geometries(df):
+    '''
+    Simplifies every unit's polygon at each resolution in RESOLUTIONS,
+    working in EQUAL_AREA_CRS so tolerances are in meters.
+
+    Inputs:
+        -df (geopandas GeoDataFrame): state data with geometry. If it has no
+        CRS, its coordinates are taken to be equal-area meters already
+
+    Returns (geopandas GeoDataFrame): GEOID20, and one geometry column per
+    resolution (named after it) in df's CRS, in df's row order
+    '''
+    geometry = df.geometry
+    projected = geometry.to_crs(EQUAL_AREA_CRS) if geometry.crs is not None else geometry
+    simplified = gpd.GeoDataFrame({'GEOID20': df['GEOID20'].astype(str).to_numpy()})
+    for name, tolerance in RESOLUTIONS.items():
+        shapes = gpd.GeoSeries(simplify_coverage(projected.values, tolerance),
+                               crs=projected.crs)
+        if geometry.crs is not None:
+            shapes = shapes.to_crs(geometry.crs)
+        simplified[name] = shapes.values
+    return simplified.set_geometry(DISPLAY_RESOLUTION)
+
+
+def save_simplified_geometries(simplified, filepath):
+    simplified.to_parquet(filepath)
+
+
+def load_simplified_geometries(state_input, df=None, level="vtd"):
+    '''
+    Loads a state's simplified geometries from the cache written by
+    save_simplified_geometries. If there's no cache yet, or it was built for
+    a different unit order than df's, they are simplified from df and
+    cached for next time.
+
+    Inputs:
+        -state_input (str): 2-letter state postal code abbreviation
+        -df (geopandas GeoDataFrame): the state's data, needed to build the
+        cache and to check it matches
+        -level (str): "vtd" or "block"
+
+    Returns (geopandas GeoDataFrame): see simplify_geometries
+    '''
+    fp = simplified_filepath(state_input, level)
+    try:
+        simplified = gpd.read_parquet(fp)
+        if df is None or geoid_digest(simplified['GEOID20']) == geoid_digest(df['GEOID20']):
+            return simplified
+    except FileNotFoundError:
+        if df is None:
+            raise FileNotFoundError(f"No simplified geometry cache at {fp}. Pass the "
+                                    "state's GeoDataFrame to build one")
+    simplified = simplify_geometries(df)
+    save_simplified_geometries(simplified, fp)
+    return simplified
+
+
+def resolution_geometry(df, resolution=None):
+    '''
+    df's polygons at a resolution, for drawing. The state (and level) are
+    read from df.attrs, which load_state sets.
+
+    Inputs:
+        -df (geopandas GeoDataFrame): a whole state's data, in the row order
+        load_state gives
+        -resolution (str): a key of RESOLUTIONS, or None for the exact shapes
+
+    Returns (geopandas GeoSeries): indexed like df. df's own geometry if
+    resolution is None or df doesn't say what state it is
+    '''
+    if resolution is None or 'state' not in df.attrs:
+        return df.geometry
+    assert resolution in RESOLUTIONS, \
+        f"resolution must be one of {list(RESOLUTIONS)} or None, not {resolution!r}"
+    simplified = load_simplified_geometries(df.attrs['state'], df,
+                                            df.attrs.get('level', 'vtd'))
+    return gpd.GeoSeries(simplified[resolution].values, index=df.index, crs=df.crs,
+                         name=df.geometry.name)
+
+
+def with_resolution(df, resolution=None):
+    '''
+    A copy of df with its polygons at a resolution (see resolution_geometry),
+    or df itself if they'd be the same.
+    '''
+    if resolution is None or 'state' not in df.attrs:
+        return df
+    geometry = resolution_geometry(df, resolution)
+    df = df.copy()
+    df[df.geometry.name] = geometry
+    return df
@@ -5,7 +5,9 @@ Separating basic stats about the geoDataFrame that aren't *inherently* mapping
 functions into their own file for better code organization.
 '''
 from math import sqrt
+from instrumentation import timed
 
+@timed
 def population_sum(df, colname="POP100", district=None):
     '''
     Calculates the total population across a state df, or district therein, of 
@@ -0,0 +1,238 @@
+'''
+Synthetic states of any size, for testing how the drawing and balancing code
+scales beyond the few thousand VTDs in merged_shps.
+
+make_synthetic_state returns a GeoDataFrame with the same columns load_state
+returns (GEOID20, POP100, G20PREDBID, G20PRERTRU, geometry, neighbors,
+dist_id), built on either a square grid or a Voronoi tessellation of random
+points. Voteshares come from the same beta distribution, bounds and
+clustered/random choice as the grids in proportionality.py.
+save_synthetic_state writes one to merged_shps so load_state can read it
+back like a real state.
+'''
+import math
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from scipy import sparse
+from scipy.spatial import Voronoi
+
+import proportionality
+
+#Equal-area projection used for real states too (CONUS Albers), in meters
+SYNTHETIC_CRS = "EPSG:5070"
+CELL_SIZE = 1000
+DEFAULT_UNITS_PER_COUNTY = 500
+#GEOID20 is a 2-digit state, 3-digit county and 6-digit unit code
+MAX_COUNTIES = 999
+MAX_UNITS_PER_COUNTY = 999999
+
+
+def grid_adjacency(num_rows, num_cols):
+    '''
+    Adjacency of a num_rows x num_cols grid of square cells, numbered row by
+    row. Cells touching at an edge or a corner are neighbors, which is what
+    set_precinct_neighbors finds for square polygons.
+
+    Inputs:
+        -num_rows, num_cols (int): grid dimensions
+
+    Returns (scipy sparse csr_matrix): symmetric n x n adjacency matrix
+    '''
+    index = np.arange(num_rows * num_cols, dtype=np.int32).reshape(num_rows, num_cols)
+    rows, cols = [], []
+    for dr, dc in [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]:
+        #cell (r, c) and its neighbor (r + dr, c + dc), for every cell that has one
+        src = index[slice(max(0, -dr), num_rows - max(0, dr)),
+                    slice(max(0, -dc), num_cols - max(0, dc))]
+        dst = index[slice(max(0, dr), num_rows - max(0, -dr)),
+                    slice(max(0, dc), num_cols - max(0, -dc))]
+        rows.append(src.ravel())
+        cols.append(dst.ravel())
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    n = num_rows * num_cols
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+
+
+def grid_units(num_units):
+    '''
+    Square cells for a roughly square grid with num_units cells.
+
+    Returns (tuple): (GeoSeries of polygons, n x 2 array of cell centers,
+    adjacency matrix)
+    '''
+    num_cols = math.ceil(math.sqrt(num_units))
+    num_rows = math.ceil(num_units / num_cols)
+    r, c = np.divmod(np.arange(num_rows * num_cols), num_cols)
+    x0, y0 = c * CELL_SIZE, (num_rows - 1 - r) * CELL_SIZE
+    polygons = shapely.box(x0, y0, x0 + CELL_SIZE, y0 + CELL_SIZE)
+    centers = np.column_stack([x0 + CELL_SIZE / 2, y0 + CELL_SIZE / 2])
+    adjacency = grid_adjacency(num_rows, num_cols)
+    #drop the unfilled tail of the last row
+    adjacency = adjacency[:num_units][:, :num_units].tocsr()
+    return (gpd.GeoSeries(polygons[:num_units], crs=SYNTHETIC_CRS),
+            centers[:num_units], adjacency)
+
+
+def voronoi_units(num_units, rng):
+    '''
+    Voronoi cells of num_units uniformly random points in a square, clipped
+    to the square. Neighbors are pairs of points sharing a Voronoi ridge,
+    dropping pairs whose shared ridge lies entirely outside the square.
+
+    Returns (tuple): (GeoSeries of polygons, n x 2 array of points,
+    adjacency matrix)
+    '''
+    side = math.sqrt(num_units) * CELL_SIZE
+    points = rng.uniform(0, side, size=(num_units, 2))
+    extent = shapely.box(0, 0, side, side)
+    cells = shapely.voronoi_polygons(shapely.multipoints(points), extend_to=extent,
+                                     ordered=True)
+    polygons = shapely.intersection(shapely.get_parts(cells), extent)
+
+    ridges = Voronoi(points).ridge_points.astype(np.int32)
+    ridges = ridges[shapely.intersects(polygons[ridges[:, 0]], polygons[ridges[:, 1]])]
+    rows = np.concatenate([ridges[:, 0], ridges[:, 1]])
+    cols = np.concatenate([ridges[:, 1], ridges[:, 0]])
+    adjacency = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                                  shape=(num_units, num_units))
+    return gpd.GeoSeries(polygons, crs=SYNTHETIC_CRS), points, adjacency
+
+
+def arrange_voteshares(voteshares, adjacency, cluster, rng, smoothing=10):
+    '''
+    Places voteshares onto units. With cluster=True, like
+    proportionality.generate_clustered_grid, neighboring units get voteshares
+    of similar percentile rank: a random field is smoothed over the adjacency
+    graph, and the sorted voteshares are handed out in the order of the
+    field's ranks. Unlike generate_clustered_grid this is O(n log n), so it
+    works for a million units.
+
+    Inputs:
+        -voteshares (NumPy array): one voteshare per unit, in any order
+        -adjacency (scipy sparse matrix): unit adjacency
+        -cluster (boolean): cluster similar voteshares if True, otherwise
+        shuffle them randomly
+        -rng (NumPy Generator)
+        -smoothing (int): neighbor-averaging passes; more passes make
+        bigger clusters
+
+    Returns (NumPy array): voteshares in unit order
+    '''
+    if not cluster:
+        return rng.permutation(voteshares)
+    field = rng.standard_normal(len(voteshares))
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    for _ in range(smoothing):
+        field = (field + adjacency @ field) / (1 + degree)
+    arranged = np.empty_like(voteshares)
+    arranged[np.argsort(field, kind='stable')] = np.sort(voteshares)
+    return arranged
+
+
+def make_synthetic_state(num_units, mean_voteshare=0.5, var=0.02, cluster=True,
+                         kind="grid", mean_pop=1500, units_per_county=None,
+                         state_fips="99", seed=2023, with_neighbors=True):
+    '''
+    Generates a synthetic state in the same schema load_state returns.
+
+    Inputs:
+        -num_units (int): number of precincts/VTDs (or blocks)
+        -mean_voteshare (float): mean Democratic voteshare, between
+        proportionality.MIN_MEAN and MAX_MEAN
+        -var (float): variance of unit voteshares, at most
+        proportionality.MAX_VARIANCE
+        -cluster (boolean): whether similar voteshares are placed near each
+        other, as in proportionality.simulate_data
+        -kind (str): "grid" for square cells, "voronoi" for irregular cells
+        -mean_pop (int): mean POP100 per unit
+        -units_per_county (int): roughly how many units share a county FIPS
+        code in GEOID20. Defaults to 500, or to enough to keep the state
+        within the 999 county codes GEOID20 has room for
+        -state_fips (str): 2-digit state FIPS code to start each GEOID20 with
+        -seed (int): seed for random number generation, for replicability
+        -with_neighbors (boolean): build the 'neighbors' column of GEOID20
+        arrays. That column dominates memory at large sizes; skip it when
+        only the adjacency matrix is needed
+
+    Returns (tuple): (geopandas GeoDataFrame, scipy sparse csr_matrix
+    adjacency in row order)
+    '''
+    assert proportionality.MIN_MEAN <= mean_voteshare <= proportionality.MAX_MEAN, \
+        f"mean_voteshare must be between {proportionality.MIN_MEAN} and {proportionality.MAX_MEAN}"
+    assert 0 < var <= proportionality.MAX_VARIANCE, \
+        f"variance must be between 0 and {proportionality.MAX_VARIANCE}"
+    assert len(state_fips) == 2, "state_fips must be a 2-digit code"
+    rng = np.random.default_rng(seed)
+
+    if kind == "grid":
+        geometry, centers, adjacency = grid_units(num_units)
+    elif kind == "voronoi":
+        geometry, centers, adjacency = voronoi_units(num_units, rng)
+    else:
+        raise ValueError(f"kind must be 'grid' or 'voronoi', not {kind!r}")
+
+    alpha, beta = proportionality.beta_parameters(mean_voteshare, var)
+    voteshares = arrange_voteshares(rng.beta(alpha, beta, size=num_units),
+                                    adjacency, cluster, rng)
+
+    pops = np.maximum(1, rng.lognormal(math.log(mean_pop), 0.5, size=num_units)
+                      .round()).astype(np.int64)
+    turnout = rng.uniform(0.35, 0.55, size=num_units)
+    total_votes = np.round(pops * turnout)
+    d_votes = np.round(total_votes * voteshares)
+
+    #counties are square blocks of units laid over the map
+    if units_per_county is None:
+        units_per_county = max(DEFAULT_UNITS_PER_COUNTY, math.ceil(num_units / 800))
+    county_side = math.sqrt(units_per_county) * CELL_SIZE
+    county_col = (centers[:, 0] // county_side).astype(np.int64)
+    county_row = (centers[:, 1] // county_side).astype(np.int64)
+    counties = pd.factorize(county_row * (county_col.max() + 1) + county_col, sort=True)[0] + 1
+    if counties.max() > MAX_COUNTIES:
+        raise ValueError(f"{counties.max()} counties don't fit in GEOID20's 3-digit county code; "
+                         f"raise units_per_county above {units_per_county}")
+    #units are numbered within their county, like VTD codes
+    order = np.argsort(counties, kind='stable')
+    county_start = np.searchsorted(counties[order], counties[order])
+    unit_numbers = np.empty(num_units, dtype=np.int64)
+    unit_numbers[order] = np.arange(num_units) - county_start + 1
+    if unit_numbers.max() > MAX_UNITS_PER_COUNTY:
+        raise ValueError(f"A county has {unit_numbers.max()} units, more than GEOID20's "
+                         f"6-digit unit code holds; lower units_per_county")
+    geoids = np.char.add(np.char.add(state_fips, np.char.zfill(counties.astype(str), 3)),
+                         np.char.zfill(unit_numbers.astype(str), 6))
+    assert (np.char.str_len(geoids) == 11).all(), "Every GEOID20 must be 11 characters long"
+
+    gdf = gpd.GeoDataFrame({'GEOID20': geoids.astype(object),
+                            'POP100': pops,
+                            'G20PREDBID': d_votes,
+                            'G20PRERTRU': total_votes - d_votes},
+                           geometry=geometry.values, crs=SYNTHETIC_CRS)
+    if with_neighbors:
+        indptr, indices = adjacency.indptr, adjacency.indices
+        gdf['neighbors'] = [geoids[indices[indptr[i]:indptr[i + 1]]].astype(object)
+                            for i in range(num_units)]
+    gdf['dist_id'] = None
+
+    return gdf, adjacency
+
+
+def save_synthetic_state(gdf, state_postal):
+    '''
+    Writes a synthetic state to merged_shps in the same files real states use,
+    so load_state(state_postal) reads it back.
+
+    Inputs:
+        -gdf (geopandas GeoDataFrame): output of make_synthetic_state, with
+        neighbors
+        -state_postal (str): made-up code to save it under, e.g. "S1"
+
+    Returns: None, writes files
+    '''
+    assert 'neighbors' in gdf.columns, "Build the state with with_neighbors=True"
+    gdf.drop(columns=['neighbors', 'dist_id']).to_file(
+        f"redistricting_redux/merged_shps/{state_postal}_VTD_merged.shp")
+    pd.Series([np.array(n, dtype=str) for n in gdf['neighbors']], name='neighbors').to_csv(
+        f'redistricting_redux/merged_shps/{state_postal}_2020_neighbors.csv')
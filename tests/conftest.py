@@ -0,0 +1,42 @@
+import os
+import sys
+
+#the package's modules import each other by bare name, as when run with
+#"poetry run python redistricting_redux"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "redistricting_redux"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "redistricting_redux", "rdh_2020"))
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import connected_components
+
+MERGED_SHPS = os.path.join(os.path.dirname(__file__), "..", "redistricting_redux", "merged_shps")
+
+
+def load_bundled_state(state_postal):
+    '''
+    A bundled state's attribute table (read from the .dbf, without polygons)
+    with neighbors affixed from its neighbors csv, as load_state returns it.
+    '''
+    from load_state_data import affix_neighbors_list
+    df = gpd.read_file(os.path.join(MERGED_SHPS, f"{state_postal}_VTD_merged.dbf"))
+    affix_neighbors_list(df, os.path.join(MERGED_SHPS, f"{state_postal}_2020_neighbors.csv"))
+    df['dist_id'] = None
+    return df
+
+
+@pytest.fixture
+def nv_state():
+    return load_bundled_state("NV")
+
+
+def district_pieces(adjacency, assignment, num_districts):
+    '''
+    Number of connected pieces each district is in.
+    '''
+    pieces = []
+    for id in range(1, num_districts + 1):
+        units = np.flatnonzero(assignment == id)
+        pieces.append(connected_components(adjacency[units][:, units], directed=False)[0])
+    return pieces
@@ -0,0 +1,33 @@
+import io
+import json
+
+import batch
+import synthetic_state
+
+
+def test_run_plan_scores_the_columns_it_is_given():
+    gdf, _ = synthetic_state.make_synthetic_state(400, state_fips="32", seed=4)
+    #a race the Democrats lose everywhere, in other columns
+    gdf['G20USSDOTH'] = 0
+    gdf['G20USSROTH'] = gdf['POP100']
+    default = batch.run_plan(gdf, 'NV', 1)
+    other = batch.run_plan(gdf, 'NV', 1, dcol='G20USSDOTH', rcol='G20USSROTH')
+    assert other['d_seats'] == 0
+    assert other['point_swing'] == [-100.0] * 4
+    assert other['declination'] is None
+    assert other['efficiency_gap'] != default['efficiency_gap']
+
+
+def test_state_that_fails_to_load_does_not_stop_the_batch(tmp_path, monkeypatch):
+    #a small synthetic state stands in for NV; AZ has no data, so it fails
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "redistricting_redux" / "merged_shps").mkdir(parents=True)
+    gdf, _ = synthetic_state.make_synthetic_state(400, state_fips="32", seed=4)
+    synthetic_state.save_synthetic_state(gdf, "NV")
+
+    out = io.StringIO()
+    records = batch.run_batch(["AZ", "NV"], [1, 2], out=out)
+    assert [(r['type'], r['state']) for r in records] == [('error', 'AZ'), ('plan', 'NV'),
+                                                          ('plan', 'NV')]
+    assert records[0]['failed_stage'] == 'load'
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == records
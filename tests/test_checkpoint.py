@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+
+import batch
+import checkpoint
+import draw_random_maps
+import graph_maps
+import synthetic_state
+
+
+class Killed(Exception):
+    pass
+
+
+def kill_after(monkeypatch, module, name, calls):
+    '''
+    Makes module.name raise Killed once it has been called calls times, as
+    if the process died partway through the next one.
+    '''
+    real = getattr(module, name)
+    made = []
+
+    def dying(*args, **kwargs):
+        if len(made) == calls:
+            raise Killed
+        made.append(1)
+        return real(*args, **kwargs)
+    monkeypatch.setattr(module, name, dying)
+
+
+@pytest.fixture
+def small_state():
+    #74433 -> 14695 -> 849 over two swap cycles, so both cycles move precincts
+    gdf, adjacency = synthetic_state.make_synthetic_state(400, state_fips="32", seed=4)
+    draw_random_maps.draw_dart_throw_map(gdf, 4, seed=1)
+    return gdf, adjacency
+
+
+def test_repeated_pop_swap_resumes_to_same_map(small_state, tmp_path, monkeypatch):
+    gdf, _ = small_state
+    fp = str(tmp_path / "swap.npz")
+    uninterrupted = gdf.copy()
+    draw_random_maps.repeated_pop_swap(uninterrupted, allowed_deviation=100, stop_after=2)
+
+    killed = gdf.copy()
+    with monkeypatch.context() as m:
+        kill_after(m, draw_random_maps, "mapwide_pop_swap", 1)
+        with pytest.raises(Killed):
+            draw_random_maps.repeated_pop_swap(killed, allowed_deviation=100, stop_after=2,
+                                               checkpoint_fp=fp)
+    resumed = gdf.copy()
+    draw_random_maps.repeated_pop_swap(resumed, allowed_deviation=100, stop_after=2,
+                                       checkpoint_fp=fp)
+    assert resumed['dist_id'].tolist() == uninterrupted['dist_id'].tolist()
+
+    #rerunning the finished run restores its map without swapping
+    rerun = gdf.copy()
+    with monkeypatch.context() as m:
+        kill_after(m, draw_random_maps, "mapwide_pop_swap", 0)
+        draw_random_maps.repeated_pop_swap(rerun, allowed_deviation=100, stop_after=2,
+                                           checkpoint_fp=fp)
+    assert rerun['dist_id'].tolist() == uninterrupted['dist_id'].tolist()
+
+
+def test_reopened_checkpoint_swaps_more(small_state, tmp_path):
+    gdf, _ = small_state
+    fp = str(tmp_path / "swap.npz")
+    draw_random_maps.repeated_pop_swap(gdf, allowed_deviation=100, stop_after=1,
+                                       checkpoint_fp=fp)
+    assert checkpoint.load_checkpoint(fp)['counters']['finished']
+    checkpoint.reopen_checkpoint(fp)
+    saved = checkpoint.load_checkpoint(fp)
+    assert 'finished' not in saved['counters']
+    assert len(saved['deviations']) == 1
+
+
+def test_repeated_pop_swap_assignment_resumes_to_same_map(small_state, tmp_path, monkeypatch):
+    gdf, adjacency = small_state
+    pops = gdf['POP100'].to_numpy()
+    drawn = graph_maps.dart_throw_assignment(adjacency, pops, 4, seed=1)
+    fp = str(tmp_path / "swap.npz")
+    uninterrupted = drawn.copy()
+    expected = graph_maps.repeated_pop_swap_assignment(adjacency, pops, uninterrupted, 4,
+                                                       allowed_deviation=100, stop_after=4)
+
+    with monkeypatch.context() as m:
+        kill_after(m, graph_maps, "pop_swap_assignment", 2)
+        with pytest.raises(Killed):
+            graph_maps.repeated_pop_swap_assignment(adjacency, pops, drawn.copy(), 4,
+                                                    allowed_deviation=100, stop_after=4,
+                                                    checkpoint_fp=fp)
+    resumed = drawn.copy()
+    history = graph_maps.repeated_pop_swap_assignment(adjacency, pops, resumed, 4,
+                                                      allowed_deviation=100, stop_after=4,
+                                                      checkpoint_fp=fp)
+    assert np.array_equal(resumed, uninterrupted)
+    assert history == expected
+
+    rerun = drawn.copy()
+    with monkeypatch.context() as m:
+        kill_after(m, graph_maps, "pop_swap_assignment", 0)
+        history = graph_maps.repeated_pop_swap_assignment(adjacency, pops, rerun, 4,
+                                                          allowed_deviation=100, stop_after=4,
+                                                          checkpoint_fp=fp)
+    assert np.array_equal(rerun, uninterrupted)
+    assert history == expected
+
+
+def without_timing(record):
+    return {k: v for k, v in record.items() if k != 'seconds'}
+
+
+def test_run_plan_resumes_and_reruns_unchanged(small_state, tmp_path, monkeypatch):
+    gdf, _ = small_state
+    options = {'allowed_deviation': 100, 'swap_steps': 2}
+    expected = batch.run_plan(gdf.copy(), 'NV', 1, **options)
+
+    with monkeypatch.context() as m:
+        kill_after(m, draw_random_maps, "mapwide_pop_swap", 1)
+        with pytest.raises(Killed):
+            batch.run_plan(gdf.copy(), 'NV', 1, checkpoint_dir=str(tmp_path), **options)
+    resumed = batch.run_plan(gdf.copy(), 'NV', 1, checkpoint_dir=str(tmp_path), **options)
+    assert without_timing(resumed) == without_timing(expected)
+
+    for _ in range(2):
+        with monkeypatch.context() as m:
+            kill_after(m, draw_random_maps, "mapwide_pop_swap", 0)
+            rerun = batch.run_plan(gdf.copy(), 'NV', 1, checkpoint_dir=str(tmp_path), **options)
+        assert without_timing(rerun) == without_timing(expected)
+
+
+def test_run_plan_keeps_settings_apart(small_state, tmp_path):
+    gdf, adjacency = small_state
+    batch.run_plan(gdf.copy(), 'NV', 1, allowed_deviation=100, swap_steps=2,
+                   checkpoint_dir=str(tmp_path))
+    expected = batch.run_plan(gdf.copy(), 'NV', 1, allowed_deviation=100, swap_steps=2,
+                              balancer='flow', adjacency=adjacency)
+    flow = batch.run_plan(gdf.copy(), 'NV', 1, allowed_deviation=100, swap_steps=2,
+                          balancer='flow', adjacency=adjacency, checkpoint_dir=str(tmp_path))
+    assert without_timing(flow) == without_timing(expected)
+    assert len(list(tmp_path.iterdir())) == 2
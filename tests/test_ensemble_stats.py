@@ -0,0 +1,32 @@
+import json
+
+import numpy as np
+
+import ensemble_stats
+
+
+def reject_constant(name):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def test_empty_aggregator_saves_strict_json(tmp_path):
+    aggregator = ensemble_stats.EnsembleAggregator(4, target_pop=1000)
+    filepath = tmp_path / "empty.json"
+    aggregator.save(filepath)
+    #json.load accepts NaN/Infinity unless told not to
+    with open(filepath) as f:
+        json.load(f, parse_constant=reject_constant)
+    loaded = ensemble_stats.EnsembleAggregator.load(filepath)
+    loaded.add_plan([1000, 990, 1010, 1000], [10, 20, 30, 40], [40, 30, 20, 10])
+    assert loaded.summary()['num_plans'] == 1
+
+
+def test_running_moments_round_trip_after_merge():
+    empty = ensemble_stats.RunningMoments((2,))
+    moments = ensemble_stats.RunningMoments((2,))
+    moments.update([1, 5])
+    moments.update([3, -1])
+    restored = ensemble_stats.RunningMoments.from_dict(empty.to_dict()).merge(moments)
+    assert restored.count == 2
+    assert np.array_equal(restored.min, [1, -1])
+    assert np.array_equal(restored.max, [3, 5])
@@ -0,0 +1,38 @@
+import checkpoint
+import ethan_balance
+import graph_maps
+from load_state_data import make_adjacency_matrix
+
+
+def draw(df, num_districts=4, seed=1):
+    adjacency = make_adjacency_matrix(df)
+    assignment = graph_maps.dart_throw_assignment(adjacency, df['POP100'].to_numpy(),
+                                                  num_districts, seed=seed)
+    graph_maps.set_dist_ids(df, assignment)
+
+
+def test_single_transfer_keeps_history_across_resume(nv_state, tmp_path):
+    draw(nv_state)
+    fp = str(tmp_path / "single.npz")
+    first = {}
+    ethan_balance.single_balance_transfer(nv_state, run_dict=first, stop_after=2,
+                                          checkpoint_fp=fp)
+    assert list(first) == [1, 2]
+    saved = checkpoint.load_checkpoint(fp, num_units=len(nv_state))
+    assert saved['deviations'] == list(first.values())
+
+    resumed = {}
+    ethan_balance.single_balance_transfer(nv_state, run_dict=resumed, stop_after=3,
+                                          checkpoint_fp=fp)
+    assert list(resumed) == [1, 2, 3]
+    assert [resumed[1], resumed[2]] == [first[1], first[2]]
+    assert checkpoint.load_checkpoint(fp)['deviations'] == list(resumed.values())
+
+
+def test_calls_dont_share_history(nv_state):
+    draw(nv_state)
+    ethan_balance.batch_balance_transfer(nv_state, stop_after=1)
+    history = {}
+    ethan_balance.batch_balance_transfer(nv_state, run_dict=history, stop_after=1)
+    assert list(history) == [1]
+    assert ethan_balance.run_dict == {}
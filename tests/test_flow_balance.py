@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from conftest import district_pieces, load_bundled_state
+import flow_balance
+import graph_maps
+from load_state_data import make_adjacency_matrix
+
+NUM_DISTRICTS = {"NV": 4, "AZ": 9, "GA": 14}
+#(state, seed) pairs whose dart throw flow balancing gets within a tenth of
+#the target district population
+BALANCED = [("NV", 2), ("NV", 3), ("AZ", 1), ("AZ", 2), ("GA", 1), ("GA", 3)]
+
+
+def draw_and_balance(state, seed):
+    df = load_bundled_state(state)
+    adjacency = make_adjacency_matrix(df)
+    pops = df['POP100'].to_numpy()
+    num_districts = NUM_DISTRICTS[state]
+    allowed_deviation = int(pops.sum()) // num_districts // 10
+    assignment = graph_maps.dart_throw_assignment(adjacency, pops, num_districts, seed=seed)
+    deviations = flow_balance.flow_balance_assignment(adjacency, pops, assignment,
+                                                      num_districts, allowed_deviation)
+    return adjacency, pops, assignment, deviations, allowed_deviation
+
+
+@pytest.mark.parametrize("state", list(NUM_DISTRICTS))
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_flow_balance_keeps_districts_connected(state, seed):
+    adjacency, pops, assignment, deviations, _ = draw_and_balance(state, seed)
+    num_districts = NUM_DISTRICTS[state]
+    assert district_pieces(adjacency, assignment, num_districts) == [1] * num_districts
+    assert deviations[-1] == graph_maps.deviation_array(assignment, pops, num_districts)
+    assert deviations[-1] <= deviations[0]
+
+
+@pytest.mark.parametrize("state, seed", BALANCED)
+def test_flow_balance_reaches_allowed_deviation(state, seed):
+    _, _, _, deviations, allowed_deviation = draw_and_balance(state, seed)
+    assert deviations[-1] <= allowed_deviation
+
+
+def test_solve_flows_moves_surplus_to_shortfall():
+    #a path of districts 1 - 2 - 3: 1 has 10 too many, 3 has 10 too few
+    pairs = np.array([[1, 2], [2, 1], [2, 3], [3, 2]])
+    flows = flow_balance.solve_flows(pairs, np.array([10, 0, -10]))
+    assert np.allclose(flows, [10, 0, 10, 0])
+    #with the 2 -> 3 border capped, what can't get through stays put
+    flows = flow_balance.solve_flows(pairs, np.array([10, 0, -10]),
+                                     capacity=np.array([np.inf, np.inf, 4, np.inf]))
+    assert np.allclose(flows, [4, 0, 4, 0])
@@ -0,0 +1,88 @@
+import zipfile
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import MERGED_SHPS, load_bundled_state
+import join_data_to_shp
+import synthetic_state
+from load_state_data import (load_adjacency, load_state, make_adjacency_matrix,
+                             read_neighbors_csv)
+
+
+def write_rdh_zips(gdf, data_dir):
+    '''
+    Writes a synthetic state as the three zips RDH downloads come in.
+    '''
+    shp_dir = data_dir / "shp"
+    shp_dir.mkdir()
+    gdf[['GEOID20', 'geometry']].to_file(shp_dir / "s1_vtd_2020_bound.shp")
+    with zipfile.ZipFile(data_dir / "s1_vtd_2020_bound_shp.zip", "w") as z:
+        for fp in shp_dir.iterdir():
+            z.write(fp, fp.name)
+
+    election = gdf[['GEOID20', 'G20PREDBID', 'G20PRERTRU']].copy()
+    election['G20PRELJOR'] = 1.0
+    #a VTD with no boundary is dropped by the join
+    election.loc[len(election)] = ["06999999999", 5.0, 5.0, 0.0]
+    with zipfile.ZipFile(data_dir / "s1_2020_2020_vtd_csv.zip", "w") as z:
+        z.writestr("s1_2020_2020_vtd/s1_2020_2020_vtd.csv", election.to_csv(index=False))
+
+    census = gdf[['GEOID20', 'POP100']].assign(P0010002=0)
+    with zipfile.ZipFile(data_dir / "s1_pl2020_vtd_csv.zip", "w") as z:
+        z.writestr("s1_pl2020_vtd.csv", census.to_csv(index=False))
+
+
+def test_ingest_round_trip(tmp_path, monkeypatch):
+    gdf, adjacency = synthetic_state.make_synthetic_state(400, kind="voronoi",
+                                                          state_fips="06", seed=5)
+    data_dir = tmp_path / "downloads"
+    data_dir.mkdir()
+    write_rdh_zips(gdf, data_dir)
+    #merged files and caches go to redistricting_redux/merged_shps under the cwd
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "redistricting_redux" / "merged_shps").mkdir(parents=True)
+
+    merged_fp = join_data_to_shp.ingest_state("s1", data_dir=str(data_dir))
+    assert merged_fp == "redistricting_redux/merged_shps/S1_VTD_merged.parquet"
+
+    df = load_state("S1")
+    assert list(df.columns) == ['POP100', 'GEOID20', 'G20PREDBID', 'G20PRERTRU',
+                                'geometry', 'neighbors', 'dist_id']
+    #GEOIDs keep their leading zero, and only VTDs with boundaries are kept
+    assert df['GEOID20'].tolist() == gdf['GEOID20'].tolist()
+    assert np.array_equal(df['POP100'].to_numpy(), gdf['POP100'].to_numpy())
+    assert np.allclose(df['G20PREDBID'], gdf['G20PREDBID'])
+
+    #neighbors found from the polygons match the tessellation's, and the
+    #cached adjacency matrix matches the neighbors csv
+    from_polygons = make_adjacency_matrix(df)
+    assert (from_polygons != adjacency).nnz == 0
+    assert (load_adjacency("S1") != from_polygons).nnz == 0
+
+
+def test_lean_load_of_ingested_state(tmp_path, monkeypatch):
+    gdf, _ = synthetic_state.make_synthetic_state(100, seed=5)
+    data_dir = tmp_path / "downloads"
+    data_dir.mkdir()
+    write_rdh_zips(gdf, data_dir)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "redistricting_redux" / "merged_shps").mkdir(parents=True)
+    join_data_to_shp.ingest_state("S1", data_dir=str(data_dir))
+
+    df = load_state("S1", lean=True)
+    assert isinstance(df['GEOID20'].dtype, pd.CategoricalDtype)
+    assert df['dist_id'].isna().all()
+    assert int(df['POP100'].sum()) == int(gdf['POP100'].sum())
+
+
+@pytest.mark.parametrize("state", ["NV", "AZ", "GA"])
+def test_neighbors_csv_matches_affixed_neighbors(state):
+    df = load_bundled_state(state)
+    adjacency = read_neighbors_csv(os.path.join(MERGED_SHPS, f"{state}_2020_neighbors.csv"),
+                                   df['GEOID20'], chunk_size=500)
+    assert (adjacency != make_adjacency_matrix(df)).nnz == 0
+    assert (adjacency != adjacency.T).nnz == 0
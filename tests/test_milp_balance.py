@@ -0,0 +1,52 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import shortest_path
+
+from conftest import district_pieces, load_bundled_state
+import flow_balance
+import graph_maps
+import milp_balance
+from load_state_data import make_adjacency_matrix
+
+
+def test_milp_keeps_districts_connected():
+    df = load_bundled_state("NV")
+    adjacency = make_adjacency_matrix(df)
+    pops = df['POP100'].to_numpy()
+    assignment = graph_maps.dart_throw_assignment(adjacency, pops, 4, seed=3)
+    flow_balance.flow_balance_assignment(adjacency, pops, assignment, 4)
+    assert district_pieces(adjacency, assignment, 4) == [1] * 4
+
+    deviations = milp_balance.milp_balance_assignment(adjacency, pops, assignment, 4,
+                                                      time_limit=5)
+    assert deviations[-1] < deviations[0]
+    assert deviations == sorted(deviations, reverse=True)
+    assert deviations[-1] == graph_maps.deviation_array(assignment, pops, 4)
+    assert district_pieces(adjacency, assignment, 4) == [1] * 4
+
+
+def test_candidate_moves_chain_back_to_a_border():
+    df = load_bundled_state("NV")
+    adjacency = make_adjacency_matrix(df)
+    assignment = graph_maps.dart_throw_assignment(adjacency, df['POP100'].to_numpy(), 4, seed=3)
+    units, targets, steps = milp_balance.candidate_moves(adjacency, assignment, hops=2)
+    assert set(steps.tolist()) == {1, 2}
+    for unit, target, step in zip(units.tolist(), targets.tolist(), steps.tolist()):
+        nabes = adjacency.indices[adjacency.indptr[unit]:adjacency.indptr[unit + 1]]
+        assert (target in assignment[nabes]) == (step == 1)
+
+
+def test_border_distance_stays_in_each_district():
+    df = load_bundled_state("NV")
+    adjacency = make_adjacency_matrix(df)
+    assignment = graph_maps.dart_throw_assignment(adjacency, df['POP100'].to_numpy(), 4, seed=3)
+    distance = milp_balance.border_distance(adjacency, assignment, hops=3)
+    #steps from the border, counted only through each unit's own district
+    edges = adjacency.tocoo()
+    same = assignment[edges.row] == assignment[edges.col]
+    inside = sparse.csr_matrix((np.ones(same.sum()), (edges.row[same], edges.col[same])),
+                               shape=adjacency.shape)
+    on_border = np.unique(edges.row[~same])
+    expected = shortest_path(inside, unweighted=True, indices=on_border).min(axis=0) + 1
+    expected[expected > 3] = 0
+    assert np.array_equal(distance, expected)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from conftest import district_pieces, load_bundled_state
+import graph_maps
+from load_state_data import make_adjacency_matrix
+import multilevel
+import synthetic_state
+
+NUM_DISTRICTS = 38
+
+
+@pytest.mark.parametrize("kind", ["grid", "voronoi"])
+def test_every_district_is_connected(kind):
+    gdf, adjacency = synthetic_state.make_synthetic_state(10_000, kind=kind, seed=7)
+    multilevel.draw_multilevel_map(gdf, adjacency, NUM_DISTRICTS, seed=7, by_county=True)
+    assignment = graph_maps.assignment_from_df(gdf)
+    assert (assignment > 0).all()
+    assert district_pieces(adjacency, assignment, NUM_DISTRICTS) == [1] * NUM_DISTRICTS
+    assert graph_maps.deviation_array(assignment, gdf['POP100'].to_numpy(),
+                                      NUM_DISTRICTS) <= 70000
+
+
+@pytest.mark.parametrize("state, num_districts", [("NV", 4), ("AZ", 9), ("GA", 14)])
+def test_bundled_states(state, num_districts):
+    df = load_bundled_state(state)
+    adjacency = make_adjacency_matrix(df)
+    allowed_deviation = int(df['POP100'].sum()) // num_districts // 10
+    multilevel.draw_multilevel_map(df, adjacency, num_districts, seed=3,
+                                   allowed_deviation=allowed_deviation)
+    assignment = graph_maps.assignment_from_df(df)
+    assert district_pieces(adjacency, assignment, num_districts) == [1] * num_districts
+    assert graph_maps.deviation_array(assignment, df['POP100'].to_numpy(),
+                                      num_districts) <= allowed_deviation
+
+
+def test_no_refinement_passes():
+    gdf, adjacency = synthetic_state.make_synthetic_state(2_000, with_neighbors=False)
+    assignment = multilevel.multilevel_assignment(adjacency, gdf['POP100'].to_numpy(), 4,
+                                                  coarse_passes=0, refine_passes=0)
+    assert len(assignment) == 2_000
+    assert set(np.unique(assignment)) == {1, 2, 3, 4}
+
+
+def test_county_codes():
+    codes = multilevel.county_codes(["32003000001", "32003000002", "32005000001"])
+    assert codes.tolist() == [0, 0, 1]
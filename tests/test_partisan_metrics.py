@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import partisan_metrics
+
+#Democrats packed into one district: 90-10 there, 40-60 in the other three
+PACKED_D = np.array([90, 40, 40, 40])
+PACKED_R = np.array([10, 60, 60, 60])
+
+
+def test_packed_plan():
+    metrics = partisan_metrics.ensemble_metrics(PACKED_D, PACKED_R)
+    assert metrics['seats'] == 1
+    assert metrics['statewide_voteshare'] == pytest.approx(0.525)
+    #D waste 40 + 3 * 40, R waste 10 + 3 * 10, of 400 votes
+    assert metrics['efficiency_gap'] == pytest.approx(-0.3)
+    assert metrics['mean_median'] == pytest.approx(0.4 - 0.525)
+    #at a 50-50 tie D still win only the packed district
+    assert metrics['partisan_bias'] == pytest.approx(1 / 4 - 0.5)
+    theta_d = np.arctan((2 * 0.9 - 1) * 4 / 1)
+    theta_r = np.arctan((1 - 2 * 0.4) * 4 / 3)
+    assert metrics['declination'] == pytest.approx(2 * (theta_r - theta_d) / np.pi)
+    assert metrics['declination'] < 0
+
+
+def test_ensemble_matches_single_plans():
+    #the second plan is the first with the parties swapped, so every metric flips sign
+    d_votes = np.vstack([PACKED_D, PACKED_R])
+    r_votes = np.vstack([PACKED_R, PACKED_D])
+    metrics = partisan_metrics.ensemble_metrics(d_votes, r_votes)
+    assert metrics['seats'].tolist() == [1, 3]
+    for name in ['efficiency_gap', 'mean_median', 'partisan_bias', 'declination']:
+        single = partisan_metrics.ensemble_metrics(PACKED_D, PACKED_R)[name]
+        assert metrics[name].shape == (2,)
+        assert metrics[name] == pytest.approx([single, -single])
+
+
+def test_one_party_sweep():
+    metrics = partisan_metrics.ensemble_metrics([60, 55, 70], [40, 45, 30])
+    assert metrics['seats'] == 3
+    assert np.isnan(metrics['declination'])
+    curve = partisan_metrics.seats_votes_curve([60, 55, 70], [40, 45, 30], [0.3, 0.5, 0.7])
+    assert curve.tolist() == [0, 1, 3]
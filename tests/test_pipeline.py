@@ -0,0 +1,48 @@
+import os
+
+import pipeline
+import synthetic_state
+from pipeline import run_state
+
+
+def test_failing_state_does_not_stop_the_others(tmp_path, monkeypatch):
+    #a small synthetic state stands in for NV; AZ has no data, so it fails
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "redistricting_redux" / "merged_shps").mkdir(parents=True)
+    gdf, _ = synthetic_state.make_synthetic_state(400, state_fips="32", seed=4)
+    synthetic_state.save_synthetic_state(gdf, "NV")
+
+    summary = pipeline.run_pipeline(["AZ", "NV", "ZZ"], max_workers=2, swap_steps=0)
+    records = {record['state']: record for record in summary['states']}
+    assert summary['failed'] == ["AZ", "ZZ"]
+    assert records['AZ']['failed_stage'] == 'load'
+    assert records['ZZ']['error'] == "not a supported state"
+    assert 'error' not in records['NV']
+    assert records['NV']['precincts'] == 400
+    assert sum(records['NV']['district_pops']) == gdf['POP100'].sum()
+    assert "failed at load" in pipeline.format_summary(summary)
+
+
+def run_state_or_die(state_input, *args):
+    #AZ's worker is killed outright, as the OS does to a process out of memory
+    if state_input == "AZ":
+        os._exit(1)
+    return run_state(state_input, *args)
+
+
+def test_killed_worker_fails_only_its_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "redistricting_redux" / "merged_shps").mkdir(parents=True)
+    gdf, _ = synthetic_state.make_synthetic_state(400, state_fips="32", seed=4)
+    synthetic_state.save_synthetic_state(gdf, "NV")
+    monkeypatch.setattr(pipeline, "run_state", run_state_or_die)
+
+    #one worker: NV finishes, AZ kills the pool before GA starts
+    summary = pipeline.run_pipeline(["NV", "AZ", "GA"], max_workers=1, swap_steps=0)
+    records = {record['state']: record for record in summary['states']}
+    assert summary['failed'] == ["AZ", "GA"]
+    assert records['AZ']['failed_stage'] == 'worker killed'
+    #GA was rerun in a fresh pool and failed on its own missing data
+    assert records['GA']['failed_stage'] == 'load'
+    assert 'error' not in records['NV']
+    assert "failed at worker killed" in pipeline.format_summary(summary)
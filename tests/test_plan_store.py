@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import plan_store
+
+
+def test_relabeled_plans_are_stored_once(tmp_path):
+    store_dir = str(tmp_path / "store")
+    with plan_store.PlanStore(store_dir, num_units=6) as store:
+        assert store.add(np.array([2, 2, 1, 1, 3, 3])) == (0, True)
+        assert store.add(np.array([1, 1, 3, 3, 2, 2])) == (0, False)
+        assert store.add(np.array([1, 1, 1, 2, 2, 2])) == (1, True)
+    assert plan_store.read_plans(store_dir).tolist() == [[1, 1, 2, 2, 3, 3],
+                                                         [1, 1, 1, 2, 2, 2]]
+    assert plan_store.read_counts(store_dir).tolist() == [2, 1]
+
+
+def test_pack_round_trip(tmp_path):
+    store_dir = str(tmp_path / "store")
+    rng = np.random.default_rng(0)
+    with plan_store.PlanStore(store_dir, num_units=50) as store:
+        for _ in range(10):
+            store.add(rng.integers(1, 5, size=50))
+    plan_store.pack(store_dir, str(tmp_path / "store.npz"))
+    copy_dir = plan_store.unpack(str(tmp_path / "store.npz"), str(tmp_path / "copy"))
+    assert np.array_equal(plan_store.read_plans(copy_dir), plan_store.read_plans(store_dir))
+
+
+def test_too_many_districts_for_dtype(tmp_path):
+    with plan_store.PlanStore(str(tmp_path / "store"), num_units=300) as store:
+        with pytest.raises(AssertionError):
+            store.add(np.arange(1, 301))
+        assert len(store) == 0
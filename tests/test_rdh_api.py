@@ -0,0 +1,118 @@
+import http.server
+import os
+import threading
+from collections import Counter
+
+import pytest
+
+import rdh_api
+
+CONTENT = bytes(range(256)) * 40
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves the files in self.server.files, honoring "Range: bytes=N-" if
+    self.server.ranges is set, and a dataset list at /list.
+    '''
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.server.requests.append((path, self.headers.get('Range')))
+        if path == '/list':
+            body = self.server.listing.encode()
+        elif path in self.server.files:
+            body = self.server.files[path]
+        else:
+            self.send_error(404)
+            return
+        start = 0
+        range_header = self.headers.get('Range')
+        if self.server.ranges and range_header:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    httpd.files = {'/files/nv_2020_2020_vtd.zip': CONTENT,
+                   '/files/nv_pl2020_vtd.zip': CONTENT[::-1]}
+    httpd.ranges = True
+    httpd.requests = []
+    httpd.listing = ''
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return f'http://127.0.0.1:{server.server_address[1]}{path}'
+
+
+def download(server, tmp_path):
+    file_name = str(tmp_path / 'nv_2020_2020_vtd_csv.zip')
+    with rdh_api.make_session() as session:
+        rdh_api.download_file(session, url(server, '/files/nv_2020_2020_vtd.zip'), {},
+                              file_name, chunk_size=1000)
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def test_resumes_part_file(server, tmp_path):
+    (tmp_path / 'nv_2020_2020_vtd_csv.zip.part').write_bytes(CONTENT[:3000])
+    assert download(server, tmp_path) == CONTENT
+    assert server.requests == [('/files/nv_2020_2020_vtd.zip', 'bytes=3000-')]
+    assert not os.path.exists(tmp_path / 'nv_2020_2020_vtd_csv.zip.part')
+
+
+def test_complete_part_file(server, tmp_path):
+    (tmp_path / 'nv_2020_2020_vtd_csv.zip.part').write_bytes(CONTENT)
+    assert download(server, tmp_path) == CONTENT
+    assert server.requests == [('/files/nv_2020_2020_vtd.zip', f'bytes={len(CONTENT)}-')]
+
+
+def test_restarts_without_range_support(server, tmp_path):
+    server.ranges = False
+    (tmp_path / 'nv_2020_2020_vtd_csv.zip.part').write_bytes(CONTENT[:3000])
+    assert download(server, tmp_path) == CONTENT
+
+
+def test_finished_file_is_not_downloaded_again(server, tmp_path):
+    assert download(server, tmp_path) == CONTENT
+    assert download(server, tmp_path) == CONTENT
+    assert len(server.requests) == 1
+
+
+def test_get_data_downloads_each_file_once(server, tmp_path):
+    rows = ['Filename,URL,Format']
+    for i in range(12):
+        #the same files are listed over and over, as csv and as different datasets
+        for path in ['/files/nv_2020_2020_vtd.zip', '/files/nv_pl2020_vtd.zip']:
+            rows.append(f"{path.split('/')[-1]},{url(server, path)}?x=1&datasetid={i},CSV")
+    server.listing = '\n'.join(rows)
+    written = rdh_api.get_data('user', 'pass', ['nv'], None, baseurl=url(server, '/list'),
+                               out_dir=str(tmp_path))
+    assert sorted(os.path.basename(fp) for fp in written) == \
+        ['nv_2020_2020_vtd_csv.zip', 'nv_pl2020_vtd_csv.zip']
+    assert (tmp_path / 'nv_2020_2020_vtd_csv.zip').read_bytes() == CONTENT
+    assert (tmp_path / 'nv_pl2020_vtd_csv.zip').read_bytes() == CONTENT[::-1]
+    downloads = Counter(path for path, _ in server.requests if path != '/list')
+    assert downloads == {'/files/nv_2020_2020_vtd.zip': 1, '/files/nv_pl2020_vtd.zip': 1}
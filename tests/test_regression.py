@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+import regression
+
+
+@pytest.mark.parametrize("ntrials", [25, regression.LHS_OPTIMIZE_LIMIT + 1])
+def test_latin_hypercube_fills_every_stratum(ntrials):
+    np.random.seed(0)
+    sample = regression.latin_hypercube(ntrials, 2)
+    assert sample.shape == (ntrials, 2)
+    for column in sample.T:
+        assert sorted(np.floor(column * ntrials).astype(int)) == list(range(ntrials))
+
+
+def test_latin_hypercube_follows_global_seed():
+    np.random.seed(1)
+    first = regression.latin_hypercube(10, 3)
+    np.random.seed(1)
+    assert np.array_equal(first, regression.latin_hypercube(10, 3))
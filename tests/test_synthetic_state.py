@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import synthetic_state
+
+
+@pytest.mark.parametrize("kind", ["grid", "voronoi"])
+def test_schema_and_neighbors(kind):
+    gdf, adjacency = synthetic_state.make_synthetic_state(900, kind=kind, seed=1)
+    assert list(gdf.columns) == ['GEOID20', 'POP100', 'G20PREDBID', 'G20PRERTRU',
+                                 'geometry', 'neighbors', 'dist_id']
+    assert gdf['GEOID20'].is_unique
+    assert (adjacency != adjacency.T).nnz == 0
+    row = 17
+    nabes = adjacency.indices[adjacency.indptr[row]:adjacency.indptr[row + 1]]
+    assert set(gdf['neighbors'][row]) == set(gdf['GEOID20'].iloc[nabes])
+
+
+def test_geoids_fit_at_a_million_units():
+    gdf, _ = synthetic_state.make_synthetic_state(1_000_000, with_neighbors=False)
+    geoids = gdf['GEOID20'].astype(str)
+    assert (geoids.str.len() == 11).all()
+    assert geoids.is_unique
+    assert geoids.str[:5].nunique() <= synthetic_state.MAX_COUNTIES
+
+
+def test_too_many_counties_is_rejected():
+    with pytest.raises(ValueError):
+        synthetic_state.make_synthetic_state(1_000_000, units_per_county=500,
+                                             with_neighbors=False)
+
+
+def test_counties_are_blocks_of_units():
+    gdf, _ = synthetic_state.make_synthetic_state(10_000, units_per_county=400)
+    counties = gdf['GEOID20'].str[:5]
+    assert counties.nunique() == 25
+    assert np.allclose(counties.value_counts(), 400)
+
+
+def test_one_row_grid():
+    adjacency = synthetic_state.grid_adjacency(1, 4)
+    assert sorted(zip(*adjacency.nonzero())) == [(0, 1), (1, 0), (1, 2), (2, 1), (2, 3), (3, 2)]
+    assert synthetic_state.grid_adjacency(4, 1).nnz == 6
+    assert synthetic_state.grid_adjacency(1, 1).nnz == 0
+    for num_units in [1, 2]:
+        gdf, adjacency = synthetic_state.make_synthetic_state(num_units, kind="grid")
+        assert len(gdf) == num_units
+        assert adjacency.nnz == 2 * (num_units - 1)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import tally
+
+
+@pytest.fixture
+def units():
+    rng = np.random.default_rng(5)
+    return pd.DataFrame({'POP100': rng.integers(0, 2000, 60),
+                         'G20PREDBID': rng.integers(0, 500, 60),
+                         'G20PRERTRU': rng.integers(0, 500, 60),
+                         'G20USSDOSS': rng.integers(0, 500, 60),
+                         'G20USSRPER': rng.integers(0, 500, 60),
+                         'NOTAVOTE': rng.integers(0, 500, 60)})
+
+
+def groupby_totals(df, columns, assignment, num_districts):
+    sums = df[columns].groupby(assignment).sum()
+    return sums.reindex(range(1, num_districts + 1), fill_value=0).to_numpy(dtype=float)
+
+
+def test_membership_matrix():
+    assignments = np.array([[1, 2, 2, 0],
+                            [3, 3, 1, 2]])
+    membership = tally.membership_matrix(assignments, 3).toarray()
+    assert membership.tolist() == [[1, 0, 0, 0], [0, 1, 1, 0], [0, 0, 0, 0],
+                                   [0, 0, 1, 0], [0, 0, 0, 1], [1, 1, 0, 0]]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, tally.PLAN_CHUNK_SIZE])
+def test_district_totals_match_groupby(units, chunk_size):
+    matrix = tally.TallyMatrix(units)
+    assert matrix.columns == ['POP100', 'G20PREDBID', 'G20PRERTRU', 'G20USSDOSS', 'G20USSRPER']
+    rng = np.random.default_rng(6)
+    plans = rng.integers(1, 5, size=(7, len(units)))
+    #unassigned units count toward no district
+    plans[:, :5] = 0
+    totals = matrix.district_totals(plans, 4, chunk_size=chunk_size)
+    assert totals.shape == (7, 4, 5)
+    for plan, plan_totals in zip(plans, totals):
+        expected = groupby_totals(units, matrix.columns, plan, 4)
+        assert np.array_equal(plan_totals, expected)
+    assert np.array_equal(matrix.district_totals(plans[2], 4), totals[2])
+    assert totals[..., 0].sum() == units['POP100'].iloc[5:].sum() * 7
+
+
+def test_totals_frame_and_metrics(units):
+    matrix = tally.TallyMatrix(units)
+    assignment = np.arange(len(units)) % 3 + 1
+    frame = matrix.totals_frame(assignment, 3)
+    assert list(frame.index) == [1, 2, 3]
+    assert np.array_equal(frame.to_numpy(), groupby_totals(units, matrix.columns, assignment, 3))
+    metrics = matrix.election_metrics(matrix.district_totals(assignment, 3))
+    assert set(metrics) == {'G20PRE', 'G20USS'}
+
+
+def test_election_pairs_skip_incomplete_races():
+    columns = ['POP100', 'G20PREDBID', 'G20PRERTRU',
+               #two Democrats
+               'G20USSDOSS', 'G20USSDWAR', 'G20USSRPER',
+               #no Republican
+               'G20ATGDFOR',
+               'G18GOVDABR', 'G18GOVRKEM', 'g20predbid']
+    assert tally.election_pairs(columns) == [('G20PRE', 'G20PREDBID', 'G20PRERTRU'),
+                                             ('G18GOV', 'G18GOVDABR', 'G18GOVRKEM')]